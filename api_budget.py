@@ -0,0 +1,163 @@
+"""
+Salesforce API consumption tracking and budget governor
+
+Every REST call a ``RateCardGenerator`` makes is counted (per request, per user
+and per process) by a response hook on its HTTP session, which also reads the
+org-wide allocation from the ``Sforce-Limit-Info`` header. The governor keeps a
+token bucket per user and one for the whole process; before a rate card is
+built from Salesforce, ``governor.check()`` says whether the budgets allow it.
+When they don't, the web routes fall back to cached or stale results.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from instrumentation import registry
+
+# Sustained API calls per hour; bursts up to the hourly amount are allowed
+SF_API_BUDGET_PER_USER = float(os.getenv('SF_API_BUDGET_PER_USER', '600'))
+SF_API_BUDGET_GLOBAL = float(os.getenv('SF_API_BUDGET_GLOBAL', '6000'))
+# Leave this share of the org's daily allocation to other integrations
+SF_API_ORG_RESERVE = float(os.getenv('SF_API_ORG_RESERVE', '0.2'))
+# Calls a rate card is assumed to need when deciding whether it can be built
+SF_API_CALLS_PER_CARD = int(os.getenv('SF_API_CALLS_PER_CARD', '25'))
+
+# Who the current request's Salesforce calls are charged to
+current_user = contextvars.ContextVar('salesforce_api_user', default='system')
+# Mutable call count for the current request, or None outside a request
+_request_calls = contextvars.ContextVar('salesforce_api_request_calls', default=None)
+
+
+class TokenBucket:
+    """Classic token bucket: ``capacity`` tokens, refilled at ``rate`` per second
+
+    Calls are charged after they happen, so the level can go negative; the
+    bucket then has to refill past zero before more work is admitted.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def level(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def charge(self, tokens: float = 1):
+        self._refill()
+        self.tokens -= tokens
+
+
+class ApiGovernor:
+    """Counts Salesforce API calls and enforces the hourly budgets"""
+
+    def __init__(self, per_user: float = SF_API_BUDGET_PER_USER, global_budget: float = SF_API_BUDGET_GLOBAL,
+                 org_reserve: float = SF_API_ORG_RESERVE):
+        self.per_user = per_user
+        self.org_reserve = org_reserve
+        self._global = TokenBucket(global_budget, global_budget / 3600)
+        self._users = {}
+        self._calls = Counter()
+        self._org_usage = None
+        self._lock = threading.Lock()
+        self.degraded = 0
+
+    def _user_bucket(self, user: str) -> TokenBucket:
+        bucket = self._users.get(user)
+        if bucket is None:
+            bucket = self._users[user] = TokenBucket(self.per_user, self.per_user / 3600)
+        return bucket
+
+    def record_call(self, limit_info: Optional[str] = None):
+        """Charge one API call to the current user and request"""
+        user = current_user.get()
+        registry.inc('salesforce_api_calls_total', user=user)
+        with self._lock:
+            self._calls[user] += 1
+            self._global.charge()
+            self._user_bucket(user).charge()
+            if limit_info:
+                from simple_salesforce import Salesforce
+                usage = Salesforce.parse_api_usage(limit_info).get('api-usage')
+                if usage:
+                    self._org_usage = (usage.used, usage.total, time.time())
+        request_calls = _request_calls.get()
+        if request_calls is not None:
+            request_calls['calls'] += 1
+
+    def org_remaining(self) -> Optional[int]:
+        with self._lock:
+            if self._org_usage is None:
+                return None
+            used, total, _ = self._org_usage
+            return total - used
+
+    def check(self, user: Optional[str] = None, cost: int = SF_API_CALLS_PER_CARD) -> Optional[str]:
+        """None if ``cost`` more calls fit the budgets, otherwise the reason they don't"""
+        user = user or current_user.get()
+        with self._lock:
+            if self._org_usage is not None:
+                used, total, _ = self._org_usage
+                if total - used - cost < total * self.org_reserve:
+                    return f"Salesforce org API allocation low ({total - used} of {total} calls left today)"
+            if self._global.level() < cost:
+                return "Rate card API budget for this server is used up; try again shortly"
+            if self._user_bucket(user).level() < cost:
+                return "Your Salesforce API budget is used up; try again shortly"
+        return None
+
+    def note_degraded(self):
+        with self._lock:
+            self.degraded += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = {
+                'calls_total': sum(self._calls.values()),
+                'calls_by_user': dict(self._calls),
+                'global_budget_remaining': round(self._global.level(), 1),
+                'degraded_responses': self.degraded,
+                'org_api_used': None,
+                'org_api_total': None,
+            }
+            if self._org_usage is not None:
+                stats['org_api_used'], stats['org_api_total'], _ = self._org_usage
+        return stats
+
+
+governor = ApiGovernor()
+
+
+def count_salesforce_calls(response, *args, **kwargs):
+    """requests response hook: count REST API calls (SOAP login doesn't use the allocation)"""
+    if '/services/data/' in response.url:
+        governor.record_call(response.headers.get('Sforce-Limit-Info'))
+    return response
+
+
+def install_hook(session):
+    """Count every API call made through ``session`` (idempotent)"""
+    hooks = session.hooks.setdefault('response', [])
+    if count_salesforce_calls not in hooks:
+        hooks.append(count_salesforce_calls)
+
+
+def start_request(user: str):
+    """Charge Salesforce calls made while handling this request to ``user``"""
+    current_user.set(user)
+    _request_calls.set({'calls': 0})
+
+
+def request_calls() -> Optional[int]:
+    counts = _request_calls.get()
+    return counts['calls'] if counts is not None else None
@@ -0,0 +1,246 @@
+"""
+ASGI entry point for the async Salesforce path
+
+Serves the endpoints whose time goes on waiting for Salesforce with one shared
+``AsyncRateCardGenerator`` per process, so a single worker keeps hundreds of
+Salesforce requests in flight instead of needing a thread (and a pooled
+session) per request:
+
+- ``/async/search`` - as ``/search`` (``q``, ``limit``, ``cursor``; ``X-Next-Cursor``)
+- ``/async/generate-data`` - as ``GET /generate-data`` with a JSON response
+  (ETag and 304, precomputed artifacts, stale fallbacks)
+
+Each request runs inside a Flask request context of ``web_app.app`` with its
+before/after request hooks, so sessions, token checks, API budgets and
+Server-Timing work exactly as in the Flask routes. Anything that can block -
+the hooks (a token refresh), profile lookups, the shared SQLite cache, files -
+runs on a thread so the event loop keeps serving the other requests. Run with
+any ASGI server, e.g. ``uvicorn asgi:app``; on Vercel, ``/async/`` paths are
+routed here.
+"""
+import asyncio
+import contextvars
+import io
+import logging
+import sys
+from typing import Dict
+
+from flask import Response, jsonify, request
+
+import api_budget
+import rate_card_cache
+import retailer_search
+import web_app
+from async_salesforce import AsyncRateCardGenerator
+from circuit_breaker import SalesforceUnavailable
+from precompute import artifact_store
+
+logger = logging.getLogger(__name__)
+
+flask_app = web_app.app
+
+# Shared by every request of the process, created on first use
+generator = None
+
+
+def get_generator() -> AsyncRateCardGenerator:
+    global generator
+    if generator is None:
+        generator = AsyncRateCardGenerator.from_env()
+    return generator
+
+
+async def search():
+    """Async ``/search``: the index, or Salesforce through the async generator"""
+    if not web_app.is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+
+    query = request.args.get('q', '')
+    limit = retailer_search.clamp_page_size(request.args.get('limit', type=int))
+    cursor = request.args.get('cursor')
+    user_profile = await asyncio.to_thread(web_app.get_current_user)
+
+    try:
+        retailer_search.decode_cursor(cursor)
+    except retailer_search.CursorError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if user_profile['role'] == 'admin':
+        salesforce_id = None
+    else:
+        salesforce_id = user_profile.get('salesforce_id')
+        if not salesforce_id:
+            return jsonify({'error': 'User profile missing Salesforce ID. Please contact administrator.'}), 400
+
+    page = await asyncio.to_thread(rate_card_cache.retailer_index.search_page, query, salesforce_id, limit, cursor)
+    if page is None:
+        budget_problem = api_budget.governor.check(cost=1)
+        outage = None
+        if not budget_problem:
+            try:
+                page = await rate_card_cache.search_retailer_page_async(get_generator(), query, salesforce_id,
+                                                                        limit, cursor)
+            except SalesforceUnavailable as e:
+                outage = web_app.salesforce_outage(None, e)
+        if page is None:
+            page = await asyncio.to_thread(rate_card_cache.retailer_index.search_page, query, salesforce_id,
+                                           limit, cursor, allow_stale=True)
+            if page is None:
+                return web_app.no_stale_response(budget_problem, outage)
+
+    response = jsonify([{'name': r['Name'], 'id': r['Id']} for r in page['retailers']])
+    if page['next_cursor']:
+        response.headers['X-Next-Cursor'] = page['next_cursor']
+    return response
+
+
+async def generate_data():
+    """Async ``GET /generate-data`` (JSON only)"""
+    if not web_app.is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+    retailer_name, _ = await asyncio.to_thread(web_app.get_rate_card_request)
+    if not retailer_name:
+        return jsonify({'error': 'retailer is required'}), 400
+    rate_card_cache.request_counter.record(retailer_name)
+
+    artifact = rate_card_data = etag = None
+    budget_problem = api_budget.governor.check()
+    outage = None
+    if not budget_problem:
+        gen = get_generator()
+        try:
+            fingerprint = await rate_card_cache.data_fingerprint_async(gen, retailer_name)
+            etag = web_app.rate_card_etag(fingerprint, 'json')
+            cached = web_app.not_modified_response(etag)
+            if cached is not None:
+                return cached
+
+            artifact = await asyncio.to_thread(artifact_store.fresh_path, retailer_name, fingerprint, 'json')
+            if artifact is None:
+                rate_card_data = await rate_card_cache.get_rate_cards_async(gen, retailer_name, fingerprint)
+        except SalesforceUnavailable as e:
+            outage = web_app.salesforce_outage(retailer_name, e)
+    stale_reason = budget_problem or outage
+    if stale_reason:
+        etag = None
+        artifact, rate_card_data, age = await asyncio.to_thread(web_app.stale_rate_card, retailer_name, 'json')
+        if artifact is None and rate_card_data is None:
+            return web_app.no_stale_response(budget_problem, outage)
+
+    if artifact is not None:
+        response = Response(await asyncio.to_thread(_read_bytes, artifact), mimetype='application/json')
+    else:
+        response = jsonify({vertical: df.to_dict('records') for vertical, df in rate_card_data.items()})
+
+    if stale_reason:
+        return web_app.mark_stale(response, stale_reason, age)
+    return web_app.add_cache_headers(response, etag)
+
+
+async def _preprocess_request():
+    """``flask_app.preprocess_request()`` on a thread, keeping the context variables its hooks set"""
+    context = contextvars.copy_context()
+    response = await asyncio.get_running_loop().run_in_executor(None, context.run, flask_app.preprocess_request)
+    # e.g. the API budget's user and the request's timings, read later in this context
+    for var, value in context.items():
+        if var.get(None) is not value:
+            var.set(value)
+    return response
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+ROUTES = {
+    '/async/search': search,
+    '/async/generate-data': generate_data,
+}
+
+
+def wsgi_environ(scope: Dict, body: bytes = b'') -> Dict:
+    """WSGI environ for an ASGI HTTP scope, to build a Flask request context from"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def handle(scope: Dict) -> Response:
+    """Run the view for ``scope`` inside a Flask request context, with the app's request hooks"""
+    view = ROUTES.get(scope['path'])
+    with flask_app.request_context(wsgi_environ(scope)):
+        if view is None:
+            response = jsonify({'error': 'Not found'}), 404
+        elif scope['method'] not in ('GET', 'HEAD'):
+            response = jsonify({'error': 'Method not allowed'}), 405
+        else:
+            response = await _preprocess_request()
+            if response is None:
+                try:
+                    response = await view()
+                except Exception as e:
+                    logger.exception("Async view %s failed", scope['path'])
+                    response = jsonify({'error': str(e)}), 500
+        return flask_app.process_response(flask_app.make_response(response))
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if generator is not None:
+                await generator.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope: Dict, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    # Only GETs are served, so the request body is drained and ignored
+    message = {'more_body': True}
+    while message.get('more_body'):
+        message = await receive()
+
+    response = await handle(scope)
+    body = b'' if scope['method'] == 'HEAD' else response.get_data()
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
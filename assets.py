@@ -0,0 +1,119 @@
+"""
+Fingerprinted static assets with precompressed variants
+
+Templates call ``asset_url('js/rate_card_generator.js')`` and get a URL such as
+``/assets/js/rate_card_generator.3f2a9c1b7d0e.js``. Because the content hash is
+part of the URL, those responses can be cached by browsers for a year
+(``immutable``); a changed file simply gets a new URL. Text assets are
+compressed once per process (gzip, plus brotli when the ``brotli`` package is
+installed) and the best variant is picked from ``Accept-Encoding``.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:  # Optional - gzip alone is fine
+    brotli = None
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_URL_PREFIX = '/assets/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Only text benefits from compression; images are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+_assets = {}
+_lock = threading.Lock()
+
+
+class Asset:
+    """One static file, its content hash and its encoded variants"""
+
+    def __init__(self, logical_path: str, data: bytes, mtime: float):
+        self.logical_path = logical_path
+        self.mtime = mtime
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(logical_path)[0] or 'application/octet-stream'
+
+        base, ext = os.path.splitext(logical_path)
+        self.url = f"{ASSET_URL_PREFIX}{base}.{self.digest}{ext}"
+
+        self.variants = {'identity': data}
+        if self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            self.variants['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(data, quality=11)
+
+    def pick_encoding(self, accept_encodings) -> str:
+        """Choose the smallest variant the client accepts"""
+        accepted = [enc for enc in self.variants
+                    if enc != 'identity' and accept_encodings[enc]]
+        if not accepted:
+            return 'identity'
+        return min(accepted, key=lambda enc: len(self.variants[enc]))
+
+
+def get_asset(logical_path: str) -> Asset:
+    """Load (or return the cached) asset for a path relative to ``static/``"""
+    full_path = os.path.normpath(os.path.join(STATIC_ROOT, logical_path))
+    if not full_path.startswith(STATIC_ROOT + os.sep) or not os.path.isfile(full_path):
+        raise FileNotFoundError(logical_path)
+
+    mtime = os.path.getmtime(full_path)
+    asset = _assets.get(logical_path)
+    if asset is not None and asset.mtime == mtime:
+        return asset
+
+    with _lock:
+        asset = _assets.get(logical_path)
+        if asset is None or asset.mtime != mtime:
+            with open(full_path, 'rb') as f:
+                asset = Asset(logical_path, f.read(), mtime)
+            _assets[logical_path] = asset
+    return asset
+
+
+def asset_url(logical_path: str) -> str:
+    """Fingerprinted URL for a static file, for use in templates"""
+    return get_asset(logical_path).url
+
+
+def serve_asset(fingerprinted_path: str) -> Response:
+    """Serve ``<path>.<digest>.<ext>`` with long-lived caching
+
+    Unknown files and stale digests return 404, so an old URL is never
+    answered with new content under an immutable cache policy.
+    """
+    base, ext = os.path.splitext(fingerprinted_path)
+    logical_base, _, digest = base.rpartition('.')
+    if not logical_base or not digest:
+        abort(404)
+
+    try:
+        asset = get_asset(logical_base + ext)
+    except FileNotFoundError:
+        abort(404)
+    if asset.digest != digest:
+        abort(404)
+
+    headers = {'Cache-Control': IMMUTABLE_CACHE_CONTROL}
+    if len(asset.variants) > 1:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if request.if_none_match.contains(asset.digest):
+        response = Response(status=304, headers=headers)
+        response.set_etag(asset.digest)
+        return response
+
+    encoding = asset.pick_encoding(request.accept_encodings)
+    response = Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(asset.digest)
+    return response
@@ -0,0 +1,503 @@
+"""
+Asyncio Salesforce client and rate card generator
+
+``AsyncSalesforce`` runs SOQL over one ``httpx.AsyncClient``, so a single event
+loop keeps many Salesforce requests in flight: up to ``SF_ASYNC_CONCURRENCY`` at
+once, bounded by a semaphore shared by every query of the client. Queries go
+through the same circuit breakers, timeouts, API call counting and stage timing
+as the blocking client, and an expired session is logged into again once.
+
+The pages of a query are fetched concurrently. A ``nextRecordsUrl`` ends in the
+offset of the page it returns (``/query/01g...-2000``), so once the first page
+gives the page size and ``totalSize``, the locators of all the other pages are
+known.
+
+``AsyncRateCardGenerator`` is a ``RateCardGenerator`` whose Salesforce methods
+are coroutines. It builds the same SOQL and flattens and processes records with
+the same code, so its rate cards match the blocking generator's, but the line
+item queries of a plan (and their pages) run together, up to
+``SF_ASYNC_OPEN_CURSORS`` multi-page queries at a time. ``asgi.py`` serves
+search and rate card data with it.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import pandas as pd
+from simple_salesforce.api import DEFAULT_API_VERSION
+from simple_salesforce.login import SalesforceLogin
+from simple_salesforce.util import exception_handler
+
+import circuit_breaker
+import query_planner
+import retailer_search
+from api_budget import governor
+from circuit_breaker import SalesforceUnavailable
+from instrumentation import stage
+from log_config import RATE_LIMITED
+from rate_card_generator import AGGREGATE_ROW_LIMIT, RateCardGenerator, _like_escape
+
+# Most Salesforce requests one client has in flight
+SF_ASYNC_CONCURRENCY = int(os.getenv('SF_ASYNC_CONCURRENCY', '100'))
+# Most multi-page queries one client runs at once. Salesforce keeps 10 open query
+# cursors per user, shared with the blocking pool's sessions (SF_POOL_SIZE)
+SF_ASYNC_OPEN_CURSORS = int(os.getenv('SF_ASYNC_OPEN_CURSORS', '5'))
+
+logger = logging.getLogger(__name__)
+
+# A nextRecordsUrl: the query locator, then the offset of the page it returns
+_NEXT_RECORDS_URL = re.compile(r'(?P<locator>.*/query/[^/]+-)(?P<offset>\d+)')
+
+
+async def run_all(coroutines) -> list:
+    """Run coroutines concurrently; the first error cancels the others and is raised"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let cancelled tasks finish (and run their cleanup) before returning
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class AsyncSalesforce:
+    """SOQL queries over httpx, logged in with simple_salesforce's SOAP login
+
+    The httpx client, semaphore and login lock belong to the event loop they
+    were first used on; using the client from another loop starts new ones.
+    """
+
+    def __init__(self, username: str, password: str, security_token: str, domain: str = 'login',
+                 session=None, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 concurrency: int = SF_ASYNC_CONCURRENCY, version: str = DEFAULT_API_VERSION,
+                 open_cursors: int = SF_ASYNC_OPEN_CURSORS):
+        """
+        Args:
+            session: Optional ``requests.Session`` for the (blocking) SOAP login
+            transport: Optional httpx transport for queries, e.g. a fake's
+        """
+        self._credentials = {
+            'username': username,
+            'password': password,
+            'security_token': security_token,
+            'domain': domain
+        }
+        self.session = session
+        self.transport = transport
+        self.concurrency = concurrency
+        self.open_cursors = open_cursors
+        self.version = version
+        self.session_id = None
+        self.instance_url = None
+        self.relogins = 0
+        self._loop = None
+        self._client = None
+        self._limit = None
+        self._cursors = None
+        self._login_lock = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        connect, read = circuit_breaker.timeouts()
+        transport = self.transport or httpx.AsyncHTTPTransport(
+            retries=1,  # connection failures only; a query that timed out isn't sent again
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+        self._client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(read, connect=connect))
+        self._limit = asyncio.Semaphore(self.concurrency)
+        self._cursors = asyncio.Semaphore(self.open_cursors)
+        self._login_lock = asyncio.Lock()
+        self._loop = loop
+
+    async def login(self):
+        """Log in (on a worker thread: simple_salesforce's login is blocking)"""
+        self._bind()
+        with stage('salesforce_login'):
+            session_id, instance = await asyncio.to_thread(
+                SalesforceLogin, session=self.session, sf_version=self.version, **self._credentials)
+        self.session_id = session_id
+        self.instance_url = f"https://{instance}"
+
+    async def _ensure_login(self, expired_session_id: Optional[str] = None):
+        """Log in if nobody has yet, or if the session that expired is still the current one"""
+        async with self._login_lock:
+            if self.session_id is None or self.session_id == expired_session_id:
+                if expired_session_id:
+                    logger.warning("Salesforce session expired, logging in again")
+                    self.relogins += 1
+                await self.login()
+
+    async def _get(self, path: str, params: Optional[Dict], label: str) -> Dict:
+        self._bind()
+        if self.session_id is None:
+            await self._ensure_login()
+        for attempt in range(2):
+            session_id = self.session_id
+            async with self._limit:
+                response = await self._client.get(self.instance_url + path, params=params, headers={
+                    'Authorization': f"Bearer {session_id}",
+                    'Content-Type': 'application/json',
+                })
+            governor.record_call(response.headers.get('Sforce-Limit-Info'))
+            if response.status_code == 401 and attempt == 0:
+                await self._ensure_login(session_id)
+                continue
+            if response.status_code >= 300:
+                exception_handler(response, label)
+            return response.json()
+
+    async def _call(self, path: str, params: Optional[Dict], label: str) -> Dict:
+        """One REST call through the breaker for ``label``, timed as the ``soql`` stage"""
+        breaker = circuit_breaker.breakers.get(label)
+        breaker.before_call()
+        try:
+            with stage('soql', query=label) as timing:
+                result = await self._get(path, params, label)
+                timing['records'] = len(result.get('records', []))
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if circuit_breaker.is_outage(e):
+                breaker.record_failure()
+                raise SalesforceUnavailable(f"Salesforce {label} query failed: {e}") from e
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+    async def query(self, soql: str, label: str = 'query') -> Dict:
+        """The first page of a query"""
+        return await self._call(f"/services/data/v{self.version}/query/", {'q': soql}, label)
+
+    async def query_more(self, next_records_url: str, label: str = 'query') -> Dict:
+        return await self._call(next_records_url, None, label)
+
+    async def query_pages(self, soql: str, label: str = 'query') -> AsyncIterator[Tuple[int, List[Dict]]]:
+        """Yield ``(page number, records)`` for each page of a query as it arrives
+
+        Pages after the first are requested together and come in any order.
+        A query with more pages keeps a cursor open on Salesforce until its last
+        page is read, and Salesforce keeps only 10 per user (silently dropping
+        the oldest), so at most ``SF_ASYNC_OPEN_CURSORS`` queries run at once.
+        Close the generator (``aclose``) if you stop before the last page.
+        """
+        self._bind()
+        cursors = self._cursors
+        await cursors.acquire()
+        try:
+            first = await self.query(soql, label)
+            if first.get('done', True):
+                # One page: no cursor was left open
+                cursors.release()
+                cursors = None
+                yield 0, first['records']
+                return
+            yield 0, first['records']
+            more = self._more_pages(first, label)
+            try:
+                async for page in more:
+                    yield page
+            finally:
+                await more.aclose()
+        finally:
+            if cursors is not None:
+                cursors.release()
+
+    async def _more_pages(self, first: Dict, label: str) -> AsyncIterator[Tuple[int, List[Dict]]]:
+        """The pages after ``first``, as ``query_pages`` yields them"""
+        match = _NEXT_RECORDS_URL.fullmatch(first['nextRecordsUrl'])
+        page_size = int(match.group('offset')) if match else 0
+        if not page_size:
+            # Not an offset locator: follow the pages one after another
+            result, number = first, 0
+            while not result.get('done', True):
+                result = await self.query_more(result['nextRecordsUrl'], label)
+                number += 1
+                yield number, result['records']
+            return
+
+        total = first['totalSize']
+
+        async def fetch(number):
+            offset = number * page_size
+            result = await self.query_more(f"{match.group('locator')}{offset}", label)
+            expected = min(page_size, total - offset)
+            if len(result['records']) != expected:
+                raise RuntimeError(f"Salesforce {label} page at offset {offset} had "
+                                   f"{len(result['records'])} records, expected {expected}")
+            return number, result['records']
+
+        tasks = [asyncio.ensure_future(fetch(number)) for number in range(1, -(-total // page_size))]
+        try:
+            for next_page in asyncio.as_completed(tasks):
+                yield await next_page
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def query_all(self, soql: str, label: str = 'query') -> Dict:
+        """Every record of a query, in order"""
+        pages = {}
+        async for number, records in self.query_pages(soql, label):
+            pages[number] = records
+        records = [record for number in sorted(pages) for record in pages[number]]
+        return {'totalSize': len(records), 'done': True, 'records': records}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class AsyncRateCardGenerator(RateCardGenerator):
+    """RateCardGenerator whose Salesforce methods are coroutines
+
+    ``find_retailer``, ``find_retailer_page``, ``get_data_fingerprint`` and
+    ``process_rate_cards`` keep their signatures (``process_rate_cards`` also
+    takes ``previous``, as ``iter_rate_cards`` does) but must be awaited.
+    The blocking query methods raise TypeError. The legacy fallback for a
+    failing assigned rate card query isn't available: the error is raised, and
+    so is a bulk extract (``use_extract``): it always queries Salesforce.
+    """
+
+    def __init__(self, username: str, password: str, security_token: str, domain: str = 'login', session=None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None, concurrency: int = SF_ASYNC_CONCURRENCY):
+        # What RateCardGenerator.__init__ sets, without its blocking login: the client logs in on its first query
+        self._credentials = {
+            'username': username,
+            'password': password,
+            'security_token': security_token,
+            'domain': domain
+        }
+        self.session = session
+        self.sf = AsyncSalesforce(username, password, security_token, domain, session=session,
+                                  transport=transport, concurrency=concurrency)
+        self.last_plan = None
+        self.extract = None
+        self.product_groupings = None
+
+    @classmethod
+    def from_env(cls) -> 'AsyncRateCardGenerator':
+        """Generator logged in with the SF_* environment credentials"""
+        from salesforce_pool import make_salesforce_session
+        return cls(
+            os.getenv('SF_USERNAME'),
+            os.getenv('SF_PASSWORD'),
+            os.getenv('SF_TOKEN'),
+            os.getenv('SF_DOMAIN', 'login'),
+            session=make_salesforce_session()
+        )
+
+    @property
+    def relogins(self) -> int:
+        return self.sf.relogins
+
+    def _login(self):
+        raise TypeError("AsyncRateCardGenerator logs in on its first query")
+
+    def _call(self, method: str, soql: str, label: str, **kwargs) -> Dict:
+        raise TypeError("AsyncRateCardGenerator queries are coroutines; await its async methods")
+
+    def use_extract(self, extract):
+        if extract is not None:
+            raise TypeError("AsyncRateCardGenerator always queries Salesforce; use RateCardGenerator with an extract")
+
+    async def aclose(self):
+        await self.sf.aclose()
+
+    async def find_retailer(self, partial_name: str, salesforce_user_id: str = None) -> List[Dict]:
+        """Async ``RateCardGenerator.find_retailer``"""
+        name_filter = f"Retailer__r.Name LIKE '%{_like_escape(partial_name)}%'"
+        combined_results = []
+        after = None
+        while True:
+            page = await self._query_retailers_async(name_filter, salesforce_user_id, after, AGGREGATE_ROW_LIMIT,
+                                                     'find_retailer')
+            combined_results.extend(page)
+            if len(page) < AGGREGATE_ROW_LIMIT:
+                break
+            after = (page[-1]['Name'], page[-1]['Id'])
+        combined_results.sort(key=lambda x: x['Name'] or '')
+        return combined_results
+
+    async def find_retailer_page(self, partial_name: str, salesforce_user_id: str = None, limit: int = 20,
+                                 cursor: Optional[str] = None) -> Dict:
+        """Async ``RateCardGenerator.find_retailer_page``"""
+        after = retailer_search.decode_cursor(cursor)
+        ranked = []
+        for tier, name_filter in self._retailer_name_filters(partial_name).items():
+            if after and tier < after[0]:
+                continue
+            start = after[1:] if after and tier == after[0] else None
+            rows = await self._query_retailers_async(name_filter, salesforce_user_id, start,
+                                                     limit + 1 - len(ranked), 'find_retailer_page')
+            ranked.extend((tier, retailer) for retailer in rows)
+            if len(ranked) > limit or not partial_name:
+                break
+        return retailer_search.make_page(ranked, limit)
+
+    async def _query_retailers_async(self, name_filter: str, salesforce_user_id: Optional[str],
+                                     after: Optional[Tuple[str, str]], limit: int, label: str) -> List[Dict]:
+        query = self._retailer_query(name_filter, salesforce_user_id, after, limit)
+        return self._retailer_rows((await self.sf.query(query, label))['records'])
+
+    async def _resolve_opportunity_account_async(self, retailer_name: str) -> str:
+        account_result = await self.sf.query(self._account_query(retailer_name), 'account')
+        return self._opportunity_account(retailer_name, account_result['records'])
+
+    async def get_data_fingerprint(self, retailer_name: str) -> str:
+        """Async ``RateCardGenerator.get_data_fingerprint``; its two queries run together"""
+        opportunity_account_name = await self._resolve_opportunity_account_async(retailer_name)
+        arc_query, oli_query = self._fingerprint_queries(retailer_name, opportunity_account_name)
+        arc_results, oli_results = await run_all([self.sf.query_all(arc_query, 'fingerprint_arc'),
+                                                  self.sf.query_all(oli_query, 'fingerprint_oli')])
+        return self._fingerprint(retailer_name, opportunity_account_name, arc_results['records'],
+                                 oli_results['records'])
+
+    async def process_rate_cards(self, retailer_name: str, progress: Optional[Callable] = None,
+                                 previous: Optional[Dict[str, Dict]] = None) -> Dict[str, pd.DataFrame]:
+        """Async ``RateCardGenerator.process_rate_cards`` (see ``iter_rate_cards`` for ``previous``)
+
+        Line items are buffered per rate card row as their pages arrive, in any
+        order. Processing the verticals is CPU work, so it runs on a worker
+        thread and the event loop keeps serving other requests meanwhile.
+        """
+        buffers = self._new_buffers()
+        await self._fetch_rate_card_items(retailer_name, buffers, progress)
+        return await asyncio.to_thread(
+            lambda: dict(self._iter_buffered_rate_cards(retailer_name, buffers, progress, previous)))
+
+    async def _fetch_rate_card_items(self, retailer_name: str, buffers: Dict, progress: Optional[Callable] = None):
+        """Async ``iter_rate_card_items``, adding each item to ``buffers``"""
+        opportunity_account_name = await self._resolve_opportunity_account_async(retailer_name)
+
+        self._report(progress, 'account_resolved',
+                     retailer=retailer_name,
+                     account=opportunity_account_name,
+                     is_branch=opportunity_account_name != retailer_name)
+
+        arc_results = await self.sf.query_all(self._arc_query(retailer_name, opportunity_account_name),
+                                              'assigned_rate_cards')
+        opportunity_ids = {r.get('Opportunity__c') for r in arc_results['records']}
+        self._report(progress, 'arc_count',
+                     count=len(arc_results['records']),
+                     opportunities=len(opportunity_ids))
+
+        if not arc_results['records']:
+            logger.warning("No assigned rate cards found for %s", retailer_name)
+            return
+
+        arc_by_opportunity = self._arc_by_opportunity(arc_results['records'])
+        opportunity_ids = list(arc_by_opportunity)
+        arc_order = {opportunity_id: index for index, opportunity_id in enumerate(opportunity_ids)}
+
+        def add(fetch_order, oli_record):
+            # (query, page, record) sorts like the blocking generator's fetch sequence
+            opportunity_id = oli_record['OpportunityId']
+            flat_record = self._flatten_line_item(oli_record, arc_by_opportunity[opportunity_id])
+            if flat_record is not None:
+                self._buffer_item(buffers, (arc_order[opportunity_id], fetch_order), flat_record)
+
+        plan = await self._plan_line_items_async(opportunity_account_name, opportunity_ids)
+        with stage('line_items', plan=plan['strategy']):
+            await self._fetch_line_items(plan, opportunity_account_name, opportunity_ids, add, progress)
+        self._finish_plan(retailer_name, plan)
+
+    async def _plan_line_items_async(self, opportunity_account_name: str, opportunity_ids: List[str]) -> Dict:
+        if not query_planner.needs_counts(len(opportunity_ids)):
+            return query_planner.choose(len(opportunity_ids))
+        try:
+            counts = await self.sf.query(self._line_item_count_query(opportunity_account_name), 'line_item_counts')
+        except SalesforceUnavailable:
+            raise
+        except Exception as e:
+            logger.warning("Line item pre-count failed, planning without it: %s", e)
+            return query_planner.choose(len(opportunity_ids))
+        return self._plan_from_counts(opportunity_ids, counts['records'])
+
+    async def _fetch_line_items(self, plan: Dict, opportunity_account_name: str, opportunity_ids: List[str],
+                                add: Callable, progress: Optional[Callable] = None):
+        """Async ``_iter_line_items``: every query of the plan at once, ``add``-ing wanted line items
+
+        Failures are handled as in ``_iter_line_items``: a query that fails
+        before any of its line items were used is skipped (account-wide:
+        replaced by batches), otherwise, and on an outage, the fetch fails.
+        """
+        started = time.perf_counter()
+        wanted = set(opportunity_ids)
+        actual = {'queries': 0, 'calls': 0, 'rows_fetched': 0, 'rows_used': 0}
+
+        async def run(number, soql, label, used):
+            actual['queries'] += 1
+            pages = self.sf.query_pages(soql, label)
+            try:
+                async for page_number, records in pages:
+                    actual['calls'] += 1
+                    actual['rows_fetched'] += len(records)
+                    for index, record in enumerate(records):
+                        if record.get('OpportunityId') in wanted:
+                            actual['rows_used'] += 1
+                            used['rows'] += 1
+                            add((number, page_number, index), record)
+            finally:
+                # Frees its cursor slot now, even if add() failed part-way
+                await pages.aclose()
+
+        if plan['strategy'] == 'account_wide':
+            used = {'rows': 0}
+            try:
+                await run(0, self._line_item_query(self._account_line_item_filter(opportunity_account_name)),
+                          'line_items_account', used)
+                self._report(progress, 'oli_batch',
+                             opportunities=len(opportunity_ids),
+                             line_items=actual['rows_used'],
+                             fetched=len(opportunity_ids),
+                             total=len(opportunity_ids))
+            except SalesforceUnavailable:
+                raise
+            except Exception as e:
+                if used['rows']:
+                    raise
+                logger.error("Account-wide line item query failed, fetching in batches: %s", e)
+                plan['fallback_from'] = plan['strategy']
+                plan['strategy'] = 'batched'
+
+        if plan['strategy'] != 'account_wide':
+            fetched = {'opportunities': 0}
+
+            async def run_batch(number, batch, soql, label):
+                used = {'rows': 0}
+                try:
+                    await run(number, soql, label, used)
+                except SalesforceUnavailable:
+                    raise
+                except Exception as e:
+                    if used['rows']:
+                        raise
+                    logger.error("Line item query failed for %d opportunities: %s", len(batch), e,
+                                 extra=RATE_LIMITED)
+                    fetched['opportunities'] += len(batch)
+                    return
+                fetched['opportunities'] += len(batch)
+                logger.debug("Opportunities %s: %d line items", batch[0] if len(batch) == 1 else len(batch),
+                             used['rows'])
+                self._report(progress, 'oli_batch',
+                             opportunity_id=batch[0] if len(batch) == 1 else None,
+                             opportunities=len(batch),
+                             line_items=used['rows'],
+                             fetched=fetched['opportunities'],
+                             total=len(opportunity_ids))
+
+            await run_all(run_batch(number, batch, soql, label) for number, (_, batch, soql, label)
+                          in enumerate(self._line_item_batches(plan, opportunity_ids)))
+
+        actual['seconds'] = round(time.perf_counter() - started, 3)
+        plan['actual'] = actual
@@ -0,0 +1,129 @@
+"""
+Blocking vs asyncio Salesforce access under injected latency.
+
+Runs against the fake Salesforce with ``--latency`` seconds per call:
+
+- rate card: one huge retailer's rate card, built by ``RateCardGenerator``
+  (queries one after another) and by ``AsyncRateCardGenerator`` (every line
+  item query and page at once), for each line item plan
+- searches: ``--searches`` concurrent ``find_retailer_page`` calls, from a
+  thread pool of ``--threads`` blocking generators (one session each, as
+  salesforce_pool lends them) and from one event loop sharing an async generator
+
+Reported per case: wall time, Salesforce calls and the most calls in flight
+at once. Both generators must produce the same rate card; the run fails if not.
+
+    python benchmarks/async_fanout.py
+    python benchmarks/async_fanout.py --latency 0.1 --searches 200 --threads 8 -o async.json
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce  # noqa: E402
+from salesforce_fixtures import build_tables  # noqa: E402
+
+RETAILER = 'Bench Huge Retailer'
+PLANS = ('per_opportunity', 'batched', 'account_wide')
+
+
+def _forced_plan(strategy):
+    """query_planner.choose, always picking ``strategy``"""
+    import query_planner
+    choose = query_planner.choose
+
+    def forced(opportunities, *args, **kwargs):
+        return dict(choose(opportunities, *args, **kwargs), strategy=strategy)
+    return choose, forced
+
+
+def _measure(fake, func) -> dict:
+    fake.reset_counts()
+    start = time.perf_counter()
+    result = func()
+    return {'seconds': round(time.perf_counter() - start, 3), 'calls': sum(fake.requests.values()),
+            'peak_in_flight': fake.peak_in_flight, 'result': result}
+
+
+def _same(a: dict, b: dict) -> bool:
+    return list(a) == list(b) and all(a[k].reset_index(drop=True).equals(b[k].reset_index(drop=True)) for k in a)
+
+
+@click.command()
+@click.option('--latency', default=0.05, show_default=True, help='Seconds added to every Salesforce call')
+@click.option('--page-size', default=500, show_default=True, help='Records per query page')
+@click.option('--searches', default=100, show_default=True, help='Concurrent retailer searches')
+@click.option('--threads', default=4, show_default=True, help='Blocking generators serving the searches')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(latency, page_size, searches, threads, output):
+    """Compare blocking and async rate card builds and searches"""
+    import query_planner
+    from async_salesforce import AsyncRateCardGenerator
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    fake = FakeSalesforce({'tables': build_tables()}, latency=latency, page_size=page_size)
+    sync_gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+    async_gen = AsyncRateCardGenerator('bench@example.com', 'password', 'token', session=fake.session(),
+                                       transport=fake.async_transport())
+    results = {'latency': latency, 'page_size': page_size, 'rate_card': {}, 'searches': {}}
+
+    async def run():
+        for plan in PLANS:
+            choose, forced = _forced_plan(plan)
+            query_planner.choose = forced
+            try:
+                blocking = _measure(fake, lambda: sync_gen.process_rate_cards(RETAILER))
+                fake.reset_counts()
+                start = time.perf_counter()
+                data = await async_gen.process_rate_cards(RETAILER)
+                concurrent = {'seconds': round(time.perf_counter() - start, 3), 'calls': sum(fake.requests.values()),
+                              'peak_in_flight': fake.peak_in_flight}
+            finally:
+                query_planner.choose = choose
+            if not _same(blocking.pop('result'), data):
+                raise click.ClickException(f"Async rate card differs from the blocking one ({plan})")
+            results['rate_card'][plan] = {'blocking': blocking, 'async': concurrent}
+            click.echo(f"rate card {plan:16s} blocking {blocking['seconds']:6.2f}s ({blocking['calls']} calls)  "
+                       f"async {concurrent['seconds']:6.2f}s (peak {concurrent['peak_in_flight']} in flight)")
+
+        terms = [f"bench {'smhu'[i % 4]}" for i in range(searches)]
+        pool = [RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+                for _ in range(threads)]
+
+        def search_blocking(index):
+            return pool[index % threads].find_retailer_page(terms[index])
+
+        with ThreadPoolExecutor(threads) as executor:
+            blocking = _measure(fake, lambda: list(executor.map(search_blocking, range(searches))))
+        blocking.pop('result')
+        fake.reset_counts()
+        start = time.perf_counter()
+        await asyncio.gather(*[async_gen.find_retailer_page(term) for term in terms])
+        concurrent = {'seconds': round(time.perf_counter() - start, 3), 'calls': sum(fake.requests.values()),
+                      'peak_in_flight': fake.peak_in_flight}
+        results['searches'] = {'count': searches, 'threads': threads, 'blocking': blocking, 'async': concurrent}
+        click.echo(f"{searches} searches        blocking {blocking['seconds']:6.2f}s ({threads} threads)  "
+                   f"async {concurrent['seconds']:6.2f}s (peak {concurrent['peak_in_flight']} in flight)")
+        await async_gen.aclose()
+
+    asyncio.run(run())
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Full-org refresh through REST queries vs one Bulk API 2.0 extract.
+
+Fingerprints and builds the rate card of every retailer in a synthetic org
+(``--retailers``), as ``precompute.py`` does before rendering files, against
+the fake Salesforce with ``--latency`` seconds per call:
+
+- rest: the account, fingerprint, assigned rate card and line item queries of
+  each retailer, paged 2,000 records at a time
+- bulk: one extract (describes, five query jobs, status polls and CSV result
+  pages), then every retailer answered from it
+
+Reported per mode: wall time and Salesforce calls by kind. Both modes must
+produce the same fingerprints and rate cards; the run fails if not.
+
+    python benchmarks/bulk_refresh.py
+    python benchmarks/bulk_refresh.py --retailers 500 --latency 0.05 -o bulk.json
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce  # noqa: E402
+from salesforce_fixtures import generate_org  # noqa: E402
+
+
+def _refresh(gen) -> dict:
+    cards = {}
+    for retailer in gen.find_retailer(''):
+        name = retailer['Name']
+        cards[name] = (gen.get_data_fingerprint(name), gen.process_rate_cards(name))
+    return cards
+
+
+def _same(a: dict, b: dict) -> bool:
+    if list(a) != list(b):
+        return False
+    for name, (fingerprint, data) in a.items():
+        other_fingerprint, other = b[name]
+        if fingerprint != other_fingerprint or list(data) != list(other):
+            return False
+        if not all(data[vertical].equals(other[vertical]) for vertical in data):
+            return False
+    return True
+
+
+@click.command()
+@click.option('--retailers', default=200, show_default=True, help='Retailers in the synthetic org')
+@click.option('--latency', default=0.02, show_default=True, help='Seconds added to every Salesforce call')
+@click.option('--seed', default=0, show_default=True, help='Synthetic org seed')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(retailers, latency, seed, output):
+    """Compare a per-retailer REST refresh with a Bulk API 2.0 extract"""
+    import bulk_extract
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    fake = FakeSalesforce({'tables': generate_org(seed, retailers=retailers)}, latency=latency)
+    gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+    results = {'retailers': retailers, 'latency': latency, 'modes': {}}
+
+    fake.reset_counts()
+    start = time.perf_counter()
+    rest = _refresh(gen)
+    results['modes']['rest'] = {'seconds': round(time.perf_counter() - start, 2), 'calls': dict(fake.requests)}
+
+    fake.reset_counts()
+    start = time.perf_counter()
+    client = bulk_extract.BulkClient(gen, poll_interval=latency)
+    gen.use_extract(bulk_extract.extract(gen, client=client))
+    extracted = time.perf_counter() - start
+    bulk = _refresh(gen)
+    results['modes']['bulk'] = {'seconds': round(time.perf_counter() - start, 2),
+                                'extract_seconds': round(extracted, 2), 'calls': dict(fake.requests),
+                                'records': gen.extract.stats()}
+    if not _same(rest, bulk):
+        raise click.ClickException('The bulk extract built different fingerprints or rate cards')
+
+    for mode, result in results['modes'].items():
+        click.echo(f"{mode:5s} {result['seconds']:7.2f}s  {sum(result['calls'].values()):6d} Salesforce calls  "
+                   f"{result['calls']}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Rate card requests with fingerprint checks vs change-event invalidation.
+
+Serves ``--requests`` rate card requests (data fingerprint, then
+``get_rate_cards``) for retailers of a synthetic org, most of them for a few
+popular retailers, against the fake Salesforce with ``--latency`` seconds per
+call. Every ``--change-every`` requests a random line item, opportunity,
+product or assigned rate card is edited (its SystemModstamp moves on):
+
+- fingerprint: ``FINGERPRINT_CACHE_TTL=0``, so every request fingerprints the
+  retailer's records before the cache can answer
+- events: fingerprints are reused until the edit's CDC event goes through
+  ``change_events.apply``, as the webhook would, which drops the affected ones
+
+After each request the served fingerprint is checked against a fresh one; a
+mismatch counts as a stale response. Reported per mode: wall time, Salesforce
+calls by kind (the webhook's own queries included) and stale responses.
+
+    python benchmarks/change_invalidation.py
+    python benchmarks/change_invalidation.py --requests 1000 --change-every 10 -o change_invalidation.json
+"""
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce  # noqa: E402
+from salesforce_fixtures import generate_org  # noqa: E402
+
+MODES = ('fingerprint', 'events')
+OBJECTS = ('OpportunityLineItem', 'Opportunity', 'Product2', 'Assigned_Rate_Card__c')
+
+
+class _Pool:
+    """Lends one generator, as ``SalesforcePool.checkout`` does"""
+
+    def __init__(self, gen):
+        self.gen = gen
+
+    @contextmanager
+    def checkout(self):
+        yield self.gen
+
+
+def _run(mode, tables, names, requests, change_every, latency, seed) -> dict:
+    import change_events
+    import rate_card_cache
+    from rate_card_generator import RateCardGenerator
+
+    rate_card_cache.result_cache = rate_card_cache.ResultCache(max_size=len(names))
+    rate_card_cache.fingerprint_cache = rate_card_cache.FingerprintCache(3600 if mode == 'events' else 0)
+    change_events.reverse_index = change_events.ReverseIndex()
+    fake = FakeSalesforce({'tables': tables}, latency=latency)
+    gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+    pool = _Pool(gen)
+    # Checks the served fingerprint on its own fake Salesforce, outside the counts
+    checker = RateCardGenerator('bench@example.com', 'password', 'token',
+                                session=FakeSalesforce({'tables': tables}).session())
+
+    rng = random.Random(seed)
+    picks = rng.choices(names, weights=[1 / (k + 1) for k in range(len(names))], k=requests)
+    stale = edits = 0
+    fake.reset_counts()
+    start = time.perf_counter()
+    for number, name in enumerate(picks, 1):
+        fingerprint = rate_card_cache.data_fingerprint(gen, name)
+        rate_card_cache.get_rate_cards(gen, name, fingerprint)
+        if fingerprint != checker.get_data_fingerprint(name):
+            stale += 1
+        if number % change_every == 0:
+            edits += 1
+            object_type = rng.choice(OBJECTS)
+            record = rng.choice(tables[object_type])
+            record['SystemModstamp'] = f"2025-02-01T00:00:{edits % 60:02d}.{edits:03d}+0000"
+            if mode == 'events':
+                change_events.apply([{'object': object_type, 'type': 'UPDATE', 'ids': [record['Id']],
+                                      'fields': {}}], lambda: pool)
+    return {'seconds': round(time.perf_counter() - start, 2), 'calls': dict(fake.requests), 'stale': stale,
+            'edits': edits}
+
+
+@click.command()
+@click.option('--requests', 'requests_', default=400, show_default=True, help='Rate card requests')
+@click.option('--change-every', default=20, show_default=True, help='Requests between record edits')
+@click.option('--retailers', default=20, show_default=True, help='Retailers in the synthetic org')
+@click.option('--latency', default=0.01, show_default=True, help='Seconds added to every Salesforce call')
+@click.option('--seed', default=0, show_default=True, help='Synthetic org and request seed')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(requests_, change_every, retailers, latency, seed, output):
+    """Compare per-request fingerprint checks with change-event invalidation"""
+    import rate_card_snapshots
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    rate_card_snapshots.snapshot_store = rate_card_snapshots.SnapshotStore(tempfile.mkdtemp())
+    names = [r['Name'] for r in RateCardGenerator(
+        'bench@example.com', 'password', 'token',
+        session=FakeSalesforce({'tables': generate_org(seed, retailers=retailers, lenders=40)}).session(),
+    ).find_retailer('')]
+    random.Random(seed).shuffle(names)
+    results = {'requests': requests_, 'change_every': change_every, 'retailers': len(names), 'latency': latency,
+               'modes': {}}
+    for mode in MODES:
+        # Each mode edits its own copy of the org, in the same order
+        tables = generate_org(seed, retailers=retailers, lenders=40)
+        result = results['modes'][mode] = _run(mode, tables, names, requests_, change_every, latency, seed)
+        click.echo(f"{mode:11s} {result['seconds']:7.2f}s  {sum(result['calls'].values()):6d} Salesforce calls  "
+                   f"stale {result['stale']}  {result['calls']}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
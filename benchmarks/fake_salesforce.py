@@ -0,0 +1,889 @@
+"""
+Local stand-in for the Salesforce login and query endpoints used by RateCardGenerator.
+
+``FakeSalesforce`` is a ``requests`` transport adapter: mount it on the session
+handed to ``RateCardGenerator(session=...)`` and every call that
+simple_salesforce makes (SOAP login, ``query``, ``query_all`` and its
+``nextRecordsUrl`` pages) is answered in process, with optional injected
+latency. An adapter rather than a local server because simple_salesforce
+builds https:// URLs for login and pagination. ``async_transport()`` answers
+httpx requests the same way (for ``AsyncRateCardGenerator``), sleeping without
+blocking the event loop.
+
+Bulk API 2.0 query jobs (``/jobs/query``, as ``bulk_extract`` runs them) are
+answered too: a job reports ``InProgress`` for its first ``bulk_polls`` status
+checks, then ``JobComplete``, and its results are CSV pages of up to
+``bulk_page_size`` records chained by ``Sforce-Locator``. Field types for
+``sobjects/<type>/describe`` are inferred from the table values.
+
+Queries are answered from a fixture:
+
+- ``responses``: records recorded from a real org, keyed by the SOQL text
+  (whitespace-normalised), replayed exactly (see ``record`` below)
+- ``tables``: records per object (Account, Opportunity, Product2,
+  Assigned_Rate_Card__c, OpportunityLineItem, ...) that the SOQL subset the
+  generator uses is evaluated against. Relationship paths such as
+  ``Opportunity__r.Lender_Company__r.Name`` follow ``Opportunity__c`` /
+  ``Lender_Company__c`` (and ``Product2`` follows ``Product2Id``) by record Id.
+
+    fake = FakeSalesforce(load_fixture('fixture.json.gz'), latency=0.05)
+    gen = RateCardGenerator('user', 'password', 'token', session=fake.session())
+
+Record a fixture from a live org (uses the SF_* variables from .env; the file
+holds customer data, so keep it out of git):
+
+    python benchmarks/fake_salesforce.py -r "Acme Solar" -o acme.json.gz
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import click
+import httpx
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+FIXTURE_VERSION = 1
+INSTANCE = 'fake.my.salesforce.com'
+PAGE_SIZE = 2000
+BULK_PAGE_SIZE = 50000
+# Query locators kept for queryMore; the oldest are dropped, as Salesforce expires idle ones
+# (a real org keeps 10 open per user: pass max_cursors=10 to model that)
+MAX_LOCATORS = 200
+AGGREGATES = {'COUNT', 'COUNT_DISTINCT', 'MIN', 'MAX', 'SUM', 'AVG'}
+_DATETIME = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d+)?(\+0000|Z)')
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*')
+  | (?P<number>-?\d+(?:\.\d+)?(?![\w-]))
+  | (?P<op><=|>=|!=|<>|=|<|>)
+  | (?P<punct>[(),])
+  | (?P<name>[A-Za-z_][\w.]*)
+)""", re.X)
+
+
+class SoqlError(Exception):
+    """The query is malformed, or outside the subset the fake understands"""
+
+
+def normalize_soql(soql: str) -> str:
+    return ' '.join(soql.split())
+
+
+def load_fixture(path: str) -> Dict:
+    """Read a fixture written by ``save_fixture`` (plain or gzipped JSON)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        fixture = json.load(f)
+    if fixture.get('version') != FIXTURE_VERSION:
+        raise ValueError(f"Unsupported fixture version in {path}: {fixture.get('version')}")
+    return fixture
+
+
+def save_fixture(path: str, tables: Optional[Dict] = None, responses: Optional[Dict] = None):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        json.dump({'version': FIXTURE_VERSION, 'tables': tables or {}, 'responses': responses or {}}, f)
+
+
+class _Parser:
+    """Recursive-descent parser for the SOQL subset the rate card queries use
+
+    SELECT fields and aggregates (COUNT(), COUNT(f), COUNT_DISTINCT, MIN, MAX,
+    SUM, AVG), each with an optional alias, FROM one object, WHERE with AND / OR / NOT,
+    parentheses, = != < <= > >=, LIKE, [NOT] IN (values or a semi-join
+    subquery), GROUP BY, ORDER BY ... ASC|DESC NULLS FIRST|LAST, LIMIT, OFFSET.
+    """
+
+    def __init__(self, soql: str):
+        self.tokens = []
+        position = 0
+        soql = soql.strip()
+        while position < len(soql):
+            match = _TOKEN.match(soql, position)
+            if not match or match.end() == position:
+                raise SoqlError(f"unexpected token at: {soql[position:position + 20]!r}")
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind)))
+            position = match.end()
+            while position < len(soql) and soql[position].isspace():
+                position += 1
+        self.position = 0
+
+    def peek(self, offset: int = 0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise SoqlError('unexpected end of query')
+        self.position += 1
+        return token
+
+    def keyword(self, *words) -> bool:
+        kind, value = self.peek()
+        if kind == 'name' and value.upper() == words[0]:
+            for offset, word in enumerate(words[1:], 1):
+                kind, value = self.peek(offset)
+                if kind != 'name' or value.upper() != word:
+                    return False
+            self.position += len(words)
+            return True
+        return False
+
+    def expect(self, value: str):
+        kind, token = self.next()
+        if token.upper() != value:
+            raise SoqlError(f"expected {value}, got {token}")
+
+    def punct(self, value: str) -> bool:
+        if self.peek() == ('punct', value):
+            self.position += 1
+            return True
+        return False
+
+    def name(self) -> str:
+        kind, value = self.next()
+        if kind != 'name':
+            raise SoqlError(f"expected a field name, got {value}")
+        return value
+
+    def query(self) -> Dict:
+        self.expect('SELECT')
+        fields = []
+        while True:
+            fields.append(self.select_item(len([f for f in fields if f['aggregate']])))
+            if not self.punct(','):
+                break
+        self.expect('FROM')
+        query = {'fields': fields, 'object': self.name(), 'where': None, 'group_by': [],
+                 'order_by': [], 'limit': None, 'offset': 0}
+        if self.keyword('WHERE'):
+            query['where'] = self.condition()
+        if self.keyword('GROUP', 'BY'):
+            query['group_by'].append(self.name())
+            while self.punct(','):
+                query['group_by'].append(self.name())
+        if self.keyword('ORDER', 'BY'):
+            while True:
+                key = self.order_key()
+                descending = self.keyword('DESC')
+                if not descending:
+                    self.keyword('ASC')
+                nulls_last = descending
+                if self.keyword('NULLS', 'FIRST'):
+                    nulls_last = False
+                elif self.keyword('NULLS', 'LAST'):
+                    nulls_last = True
+                query['order_by'].append((key, descending, nulls_last))
+                if not self.punct(','):
+                    break
+        if self.keyword('LIMIT'):
+            query['limit'] = int(self.next()[1])
+        if self.keyword('OFFSET'):
+            query['offset'] = int(self.next()[1])
+        return query
+
+    def select_item(self, aggregate_index: int) -> Dict:
+        name = self.name()
+        if name.upper() in AGGREGATES and self.punct('('):
+            path = None if self.punct(')') else self.name()
+            if path is not None:
+                self.expect(')')
+            key = f"{name.upper()}({path or ''})"
+            alias = f"expr{aggregate_index}"
+            kind, value = self.peek()
+            if kind == 'name' and value.upper() not in ('FROM',):
+                alias = self.name()
+            return {'aggregate': name.upper(), 'path': path, 'key': key, 'alias': alias}
+        alias = name.rsplit('.', 1)[-1]
+        kind, value = self.peek()
+        if kind == 'name' and value.upper() != 'FROM':
+            alias = self.name()
+        return {'aggregate': None, 'path': name, 'key': name, 'alias': alias}
+
+    def order_key(self) -> str:
+        name = self.name()
+        if name.upper() in AGGREGATES and self.punct('('):
+            path = None if self.punct(')') else self.name()
+            if path is not None:
+                self.expect(')')
+            return f"{name.upper()}({path or ''})"
+        return name
+
+    def condition(self):
+        terms = [self.conjunction()]
+        while self.keyword('OR'):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def conjunction(self):
+        factors = [self.factor()]
+        while self.keyword('AND'):
+            factors.append(self.factor())
+        return factors[0] if len(factors) == 1 else ('and', factors)
+
+    def factor(self):
+        if self.keyword('NOT'):
+            return ('not', self.factor())
+        if self.punct('('):
+            condition = self.condition()
+            if not self.punct(')'):
+                raise SoqlError('missing )')
+            return condition
+        path = self.name()
+        kind, value = self.peek()
+        if kind == 'op':
+            self.position += 1
+            return ('compare', path, '!=' if value == '<>' else value, self.value())
+        if self.keyword('LIKE'):
+            kind, pattern = self.next()
+            if kind != 'string':
+                raise SoqlError('LIKE needs a string pattern')
+            # \% and \_ match themselves; unescaped % and _ are wildcards
+            regex = ''.join(re.escape(escaped) if escaped else '.*' if c == '%' else '.' if c == '_' else re.escape(c)
+                            for escaped, c in re.findall(r"\\(.)|(.)", pattern[1:-1], re.S))
+            return ('like', path, re.compile(regex, re.I | re.S))
+        negate = self.keyword('NOT')
+        if self.keyword('IN'):
+            if not self.punct('('):
+                raise SoqlError('expected ( after IN')
+            if self.peek()[0] == 'name' and self.peek()[1].upper() == 'SELECT':
+                values = {'subquery': self.query()}
+            else:
+                values = [self.value()]
+                while self.punct(','):
+                    values.append(self.value())
+            if not self.punct(')'):
+                raise SoqlError('missing ) after IN list')
+            return ('in', path, values, negate)
+        raise SoqlError(f"unsupported condition on {path}")
+
+    def value(self):
+        kind, value = self.next()
+        if kind == 'string':
+            return re.sub(r"\\(.)", r"\1", value[1:-1])
+        if kind == 'number':
+            return float(value) if '.' in value else int(value)
+        if kind == 'name' and value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        if kind == 'name' and value.upper() == 'NULL':
+            return None
+        raise SoqlError(f"unsupported literal {value}")
+
+
+class _Projected:
+    """Query results projected on access, so an open cursor holds record references, not copies"""
+
+    def __init__(self, project, rows: List[Dict]):
+        self._project = project
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _Projected(self._project, self._rows[index])
+        return self._project(self._rows[index])
+
+    def __iter__(self):
+        return map(self._project, self._rows)
+
+
+def _field_type(name: str, value) -> Optional[str]:
+    """Describe type of a field holding ``value`` (None when it's null)"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, str) and _DATETIME.fullmatch(value):
+        return 'datetime'
+    return 'id' if name == 'Id' else 'string'
+
+
+def _fold(value):
+    """SOQL string comparisons are case-insensitive"""
+    return value.lower() if isinstance(value, str) else value
+
+
+class SoqlEngine:
+    """Evaluates parsed SOQL against in-memory object tables"""
+
+    def __init__(self, tables: Dict[str, List[Dict]], api_version: str = '59.0'):
+        self.tables = tables
+        self.api_version = api_version
+        self._by_id = {}
+        for object_type, records in tables.items():
+            for record in records:
+                self._by_id[record['Id']] = (object_type, record)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def related(self, record: Dict, name: str):
+        """(type, record) a relationship name points at, or (None, None)"""
+        if name.endswith('__r'):
+            target = record.get(name[:-3] + '__c')
+        else:
+            target = record.get(name + 'Id')
+        return self._by_id.get(target, (None, None))
+
+    def resolve(self, record: Dict, path: str):
+        *relationships, field = path.split('.')
+        for name in relationships:
+            _, record = self.related(record, name)
+            if record is None:
+                return None
+        return record.get(field)
+
+    def _index(self, object_type: str, path: str) -> Dict:
+        """Case-folded value -> records, built on first use of an equality filter"""
+        key = (object_type, path)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = {}
+                for record in self.tables.get(object_type, []):
+                    index.setdefault(_fold(self.resolve(record, path)), []).append(record)
+                self._indexes[key] = index
+        return index
+
+    def _candidates(self, object_type: str, where) -> List[Dict]:
+        """Narrow the scan with an index when the filter pins a field to values"""
+        conditions = where[1] if where and where[0] == 'and' else [where]
+        for condition in conditions:
+            if condition and condition[0] == 'compare' and condition[2] == '=' and condition[3] is not None:
+                return self._index(object_type, condition[1]).get(_fold(condition[3]), [])
+            if condition and condition[0] == 'in' and isinstance(condition[2], list) and not condition[3]:
+                index = self._index(object_type, condition[1])
+                return [r for value in dict.fromkeys(map(_fold, condition[2])) for r in index.get(value, [])]
+        return self.tables.get(object_type, [])
+
+    def _matches(self, record: Dict, condition) -> bool:
+        kind = condition[0]
+        if kind == 'and':
+            return all(self._matches(record, c) for c in condition[1])
+        if kind == 'or':
+            return any(self._matches(record, c) for c in condition[1])
+        if kind == 'not':
+            return not self._matches(record, condition[1])
+        value = _fold(self.resolve(record, condition[1]))
+        if kind == 'like':
+            return isinstance(value, str) and condition[2].fullmatch(value) is not None
+        if kind == 'in':
+            values = condition[2]
+            if isinstance(values, dict):
+                if 'set' not in values:
+                    subquery = values['subquery']
+                    rows = self._select(subquery)
+                    values['set'] = {_fold(self.resolve(r, subquery['fields'][0]['path'])) for r in rows}
+                found = value in values['set']
+            else:
+                found = value in {_fold(v) for v in values}
+            return found != condition[3]
+        _, _, op, expected = condition
+        expected = _fold(expected)
+        if op == '=':
+            return value == expected
+        if op == '!=':
+            return value != expected
+        if value is None or expected is None:
+            return False
+        return {'<': value < expected, '<=': value <= expected,
+                '>': value > expected, '>=': value >= expected}[op]
+
+    def _select(self, query: Dict) -> List[Dict]:
+        where = query['where']
+        candidates = self._candidates(query['object'], where)
+        if where is None:
+            return list(candidates)
+        return [r for r in candidates if self._matches(r, where)]
+
+    @staticmethod
+    def _sort(rows: List, order_by, value_of):
+        # Stable sorts from the last key to the first give a multi-key order
+        for key, descending, nulls_last in reversed(order_by):
+            def sort_key(row, key=key, descending=descending, nulls_last=nulls_last):
+                value = _fold(value_of(row, key))
+                # reverse=True flips the null flag too, so flip it back for DESC
+                after = ((value is None) == nulls_last) != descending
+                return after, value if value is not None else 0
+            rows.sort(key=sort_key, reverse=descending)
+        return rows
+
+    def _project(self, object_type: str, record: Dict, paths: List[str]) -> Dict:
+        out = {'attributes': {'type': object_type,
+                              'url': f"/services/data/v{self.api_version}/sobjects/{object_type}/{record['Id']}"}}
+        nested = {}
+        for path in paths:
+            head, _, rest = path.partition('.')
+            if rest:
+                nested.setdefault(head, []).append(rest)
+            else:
+                out[head] = record.get(head)
+        for name, rest in nested.items():
+            related_type, related = self.related(record, name)
+            out[name] = None if related is None else self._project(related_type, related, rest)
+        return out
+
+    def _aggregate(self, query: Dict, rows: List[Dict]) -> List[Dict]:
+        groups = {}
+        for row in rows:
+            key = tuple(_fold(self.resolve(row, path)) for path in query['group_by'])
+            groups.setdefault(key, []).append(row)
+        if not query['group_by'] and not groups:
+            groups[()] = []
+
+        results = []
+        for members in groups.values():
+            values = {}
+            for path in query['group_by']:
+                values[path] = self.resolve(members[0], path) if members else None
+            for field in query['fields']:
+                if field['aggregate'] is None:
+                    continue
+                column = [self.resolve(r, field['path']) for r in members] if field['path'] else members
+                present = [v for v in column if v is not None]
+                function = field['aggregate']
+                if function == 'COUNT':
+                    value = len(present)
+                elif function == 'COUNT_DISTINCT':
+                    value = len({_fold(v) for v in present})
+                elif not present:
+                    value = None
+                elif function == 'SUM':
+                    value = sum(present)
+                elif function == 'AVG':
+                    value = sum(present) / len(present)
+                else:
+                    value = (min if function == 'MIN' else max)(present, key=_fold)
+                values[field['key']] = value
+            results.append(values)
+
+        self._sort(results, query['order_by'], lambda values, key: values.get(key))
+        return [dict({'attributes': {'type': 'AggregateResult'}},
+                     **{field['alias']: values.get(field['key']) for field in query['fields']})
+                for values in results]
+
+    def describe(self, object_type: str) -> Dict:
+        """``sobjects/<type>/describe``, with each field's type inferred from its values"""
+        types = {}
+        for record in self.tables[object_type]:
+            for name, value in record.items():
+                kind = _field_type(name, value)
+                if types.get(name) is None or (types[name], kind) == ('int', 'double'):
+                    types[name] = kind
+        return {'name': object_type,
+                'fields': [{'name': name, 'type': kind or 'string'} for name, kind in types.items()]}
+
+    def bulk_rows(self, soql: str) -> Dict:
+        """``{'object', 'fields', 'rows'}`` for a Bulk API 2.0 query, rows as CSV strings
+
+        Like Salesforce, aggregates, GROUP BY, ORDER BY and OFFSET are refused.
+        """
+        parser = _Parser(soql)
+        query = parser.query()
+        if parser.peek()[0] is not None:
+            raise SoqlError(f"unexpected {parser.peek()[1]} after query")
+        if query['object'] not in self.tables:
+            raise SoqlError(f"sObject type '{query['object']}' is not supported")
+        if any(f['aggregate'] for f in query['fields']) or query['group_by'] or query['order_by'] or query['offset']:
+            raise SoqlError('Aggregate functions, GROUP BY, ORDER BY and OFFSET are not supported by Bulk API 2.0')
+
+        def csv_value(value):
+            if value is None:
+                return ''
+            if isinstance(value, bool):
+                return 'true' if value else 'false'
+            if isinstance(value, str) and _DATETIME.fullmatch(value):
+                return value.replace('+0000', 'Z')
+            return str(value)
+
+        rows = self._select(query)[:query['limit']]
+        paths = [f['path'] for f in query['fields']]
+        return {'object': query['object'], 'fields': paths,
+                'rows': [[csv_value(self.resolve(row, path)) for path in paths] for row in rows]}
+
+    def execute(self, soql: str) -> Dict:
+        """``{'records': [...], 'totalSize': n}`` for one SOQL statement (unpaginated)
+
+        Plain queries return their records as a sequence projected on access.
+        """
+        parser = _Parser(soql)
+        query = parser.query()
+        if parser.peek()[0] is not None:
+            raise SoqlError(f"unexpected {parser.peek()[1]} after query")
+        if query['object'] not in self.tables:
+            raise SoqlError(f"sObject type '{query['object']}' is not supported")
+
+        rows = self._select(query)
+        fields = query['fields']
+        if any(f['aggregate'] for f in fields) or query['group_by']:
+            if len(fields) == 1 and fields[0]['key'] == 'COUNT()' and not query['group_by']:
+                # Bare COUNT() reports the count as totalSize with no records
+                return {'records': [], 'totalSize': len(rows)}
+            records = self._aggregate(query, rows)
+        else:
+            self._sort(rows, query['order_by'], self.resolve)
+            paths = [f['path'] for f in fields]
+            records = _Projected(lambda record: self._project(query['object'], record, paths), rows)
+
+        end = None if query['limit'] is None else query['offset'] + query['limit']
+        records = records[query['offset']:end]
+        return {'records': records, 'totalSize': len(records)}
+
+
+class FakeSalesforce(BaseAdapter):
+    """requests transport adapter answering SOAP login and REST query calls
+
+    ``latency`` is added to every call and ``record_latency`` per record
+    returned, to model a remote org. ``requests`` counts calls by kind
+    (login, query, query_more), ``unmatched`` lists queries that neither a
+    recorded response nor the tables could answer and ``peak_in_flight`` is the
+    most calls answered at once.
+
+    As in Salesforce, a ``nextRecordsUrl`` ends in the offset of the page it
+    returns (``/query/01g...-2000``), and any page of a query can be fetched
+    until its locator is dropped: once every page has been read, or when more
+    than ``max_cursors`` are open (the oldest goes, with INVALID_QUERY_LOCATOR
+    for its remaining pages).
+    """
+
+    def __init__(self, fixture: Optional[Dict] = None, latency: float = 0.0, record_latency: float = 0.0,
+                 page_size: int = PAGE_SIZE, api_limit: int = 1000000, api_version: str = '59.0',
+                 bulk_page_size: int = BULK_PAGE_SIZE, bulk_polls: int = 1, max_cursors: int = MAX_LOCATORS):
+        super().__init__()
+        fixture = fixture or {}
+        self.engine = SoqlEngine(fixture.get('tables', {}), api_version)
+        self.responses = {normalize_soql(soql): records for soql, records in fixture.get('responses', {}).items()}
+        self.latency = latency
+        self.record_latency = record_latency
+        self.page_size = page_size
+        self.bulk_page_size = bulk_page_size
+        self.bulk_polls = bulk_polls
+        self.max_cursors = max_cursors
+        self.peak_open_cursors = 0
+        self.api_limit = api_limit
+        self.api_used = 0
+        self.requests = {}
+        self.unmatched = []
+        self.sessions = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._cursors = OrderedDict()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def session(self) -> requests.Session:
+        """A requests session whose Salesforce traffic goes to this fake"""
+        session = requests.Session()
+        session.mount('https://', self)
+        return session
+
+    def expire_sessions(self):
+        """Invalidate every session ID, as a Salesforce session timeout would"""
+        with self._lock:
+            self.sessions.clear()
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = {}
+            self.unmatched = []
+            self.peak_in_flight = self.in_flight
+            self.peak_open_cursors = len(self._cursors)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def _response(self, request, status: int, body, content_type: str = 'application/json'):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+                           500: 'Server Error'}.get(status, '')
+        response._content = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        # Also readable as a stream (iter_content), like a real response
+        response.raw = io.BytesIO(response._content)
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict({'Content-Type': content_type})
+        if '/services/data/' in request.url:
+            with self._lock:
+                self.api_used += 1
+                response.headers['Sforce-Limit-Info'] = f"api-usage={self.api_used}/{self.api_limit}"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def _login(self, request):
+        self._count('login')
+        session_id = f"00DFAKE!{uuid.uuid4().hex}"
+        with self._lock:
+            self.sessions.add(session_id)
+        version = request.url.rstrip('/').rsplit('/', 1)[-1]
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+            'xmlns="urn:partner.soap.sforce.com"><soapenv:Body><loginResponse><result>'
+            f'<serverUrl>https://{INSTANCE}/services/Soap/u/{version}/00DFAKE</serverUrl>'
+            f'<sessionId>{session_id}</sessionId>'
+            '</result></loginResponse></soapenv:Body></soapenv:Envelope>'
+        )
+        return self._response(request, 200, body, 'text/xml')
+
+    def _page(self, request, records: List[Dict], total: int, locator: Optional[str] = None, offset: int = 0):
+        page = list(records[offset:offset + self.page_size])
+        done = offset + len(page) >= len(records)
+        body = {'totalSize': total, 'done': done, 'records': page}
+        if not done:
+            if locator is None:
+                locator = f"01gFAKE{uuid.uuid4().hex[:12]}"
+                with self._lock:
+                    # The cursor stays open until each page after the first has been read
+                    self._cursors[locator] = (records, set(range(len(page), len(records), self.page_size)))
+                    self.peak_open_cursors = max(self.peak_open_cursors, len(self._cursors))
+                    while len(self._cursors) > self.max_cursors:
+                        self._cursors.popitem(last=False)
+            version = urlparse(request.url).path.split('/')[3]
+            body['nextRecordsUrl'] = f"/services/data/{version}/query/{locator}-{offset + len(page)}"
+        response = self._response(request, 200, body)
+        response.records_returned = len(page)
+        return response
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self._enter()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            response = self.handle(request)
+            if self.record_latency:
+                time.sleep(self.record_latency * getattr(response, 'records_returned', 0))
+            return response
+        finally:
+            self._exit()
+
+    def async_transport(self) -> httpx.AsyncBaseTransport:
+        """httpx transport answering like this adapter, with latency as non-blocking sleeps"""
+        return AsyncFakeTransport(self)
+
+    def handle(self, request):
+        """Answer one prepared request, without the injected latency"""
+        url = urlparse(request.url)
+
+        if '/services/Soap/u/' in url.path and request.method == 'POST':
+            return self._login(request)
+
+        session_id = (request.headers.get('Authorization') or '').replace('Bearer ', '', 1)
+        with self._lock:
+            valid = session_id in self.sessions
+        if not valid:
+            return self._response(request, 401, [{'message': 'Session expired or invalid',
+                                                  'errorCode': 'INVALID_SESSION_ID'}])
+
+        if re.fullmatch(r'/services/data/v[\d.]+/jobs/query(/.*)?', url.path):
+            return self._bulk(request, url)
+        match = re.fullmatch(r'/services/data/v[\d.]+/sobjects/(?P<type>\w+)/describe/?', url.path)
+        if match:
+            self._count('describe')
+            if match.group('type') not in self.engine.tables:
+                return self._response(request, 404, [{'message': f"sObject type '{match.group('type')}' is not supported",
+                                                      'errorCode': 'NOT_FOUND'}])
+            return self._response(request, 200, self.engine.describe(match.group('type')))
+
+        match = re.fullmatch(r'/services/data/v[\d.]+/query(?:All)?/?(?P<cursor>[^/]*)', url.path)
+        if not match:
+            return self._response(request, 404, [{'message': f'Unsupported resource {url.path}',
+                                                  'errorCode': 'NOT_FOUND'}])
+
+        if match.group('cursor'):
+            self._count('query_more')
+            locator, _, offset = match.group('cursor').rpartition('-')
+            with self._lock:
+                records, unread = self._cursors.get(locator, (None, None))
+                if records is not None and offset.isdigit():
+                    unread.discard(int(offset))
+                    if not unread:
+                        del self._cursors[locator]
+            if records is None or not offset.isdigit() or int(offset) >= len(records):
+                return self._response(request, 400, [{'message': 'invalid query locator',
+                                                      'errorCode': 'INVALID_QUERY_LOCATOR'}])
+            return self._page(request, records, len(records), locator, int(offset))
+
+        self._count('query')
+        soql = normalize_soql(parse_qs(url.query).get('q', [''])[0])
+        if soql in self.responses:
+            records = self.responses[soql]
+            return self._page(request, records, len(records))
+        try:
+            result = self.engine.execute(soql)
+        except SoqlError as e:
+            with self._lock:
+                self.unmatched.append(soql)
+            return self._response(request, 400, [{'message': str(e), 'errorCode': 'MALFORMED_QUERY'}])
+        return self._page(request, result['records'], result['totalSize'])
+
+    def _bulk(self, request, url):
+        """Bulk API 2.0 query jobs: create, status and CSV results"""
+        parts = url.path.rstrip('/').split('/jobs/query', 1)[1].strip('/').split('/')
+        job_id = parts[0] or None
+        if job_id is None and request.method == 'POST':
+            self._count('bulk_job')
+            spec = json.loads(request.body or b'{}')
+            if spec.get('operation') not in ('query', 'queryAll'):
+                return self._response(request, 400, [{'message': 'operation must be query or queryAll',
+                                                      'errorCode': 'INVALIDJOB'}])
+            try:
+                result = self.engine.bulk_rows(normalize_soql(spec.get('query', '')))
+            except SoqlError as e:
+                with self._lock:
+                    self.unmatched.append(spec.get('query'))
+                return self._response(request, 400, [{'message': str(e), 'errorCode': 'INVALIDJOB'}])
+            job_id = f"750FAKE{uuid.uuid4().hex[:11]}"
+            with self._lock:
+                self._jobs[job_id] = dict(result, polls=0)
+            return self._response(request, 200, {'id': job_id, 'operation': spec['operation'],
+                                                 'object': result['object'], 'state': 'UploadComplete'})
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._response(request, 404, [{'message': f'Job {job_id} not found', 'errorCode': 'NOT_FOUND'}])
+        complete = job['polls'] > self.bulk_polls
+        if len(parts) == 1 and request.method == 'GET':
+            self._count('bulk_status')
+            with self._lock:
+                job['polls'] += 1
+            complete = job['polls'] > self.bulk_polls
+            return self._response(request, 200, {'id': job_id, 'object': job['object'],
+                                                 'state': 'JobComplete' if complete else 'InProgress',
+                                                 'numberRecordsProcessed': len(job['rows']) if complete else 0})
+        if parts[1:] != ['results'] or request.method != 'GET':
+            return self._response(request, 404, [{'message': f'Unsupported resource {url.path}',
+                                                  'errorCode': 'NOT_FOUND'}])
+        self._count('bulk_results')
+        if not complete:
+            return self._response(request, 400, [{'message': 'The job is not complete', 'errorCode': 'API_ERROR'}])
+        query = parse_qs(url.query)
+        offset = int(query.get('locator', ['0'])[0] or 0)
+        page_size = int(query.get('maxRecords', [self.bulk_page_size])[0])
+        rows = job['rows'][offset:offset + page_size]
+        body = io.StringIO()
+        writer = csv.writer(body, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(job['fields'])
+        writer.writerows(rows)
+        response = self._response(request, 200, body.getvalue(), 'text/csv')
+        end = offset + len(rows)
+        response.headers['Sforce-Locator'] = str(end) if end < len(job['rows']) else 'null'
+        response.headers['Sforce-NumberOfRecords'] = str(len(rows))
+        response.records_returned = len(rows)
+        return response
+
+    def close(self):
+        pass
+
+
+class AsyncFakeTransport(httpx.AsyncBaseTransport):
+    """httpx side of a FakeSalesforce: requests are answered by ``FakeSalesforce.handle``"""
+
+    def __init__(self, fake: FakeSalesforce):
+        self.fake = fake
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        fake = self.fake
+        fake._enter()
+        try:
+            if fake.latency:
+                await asyncio.sleep(fake.latency)
+            prepared = requests.Request(request.method, str(request.url), headers=dict(request.headers),
+                                        data=await request.aread()).prepare()
+            response = fake.handle(prepared)
+            if fake.record_latency:
+                await asyncio.sleep(fake.record_latency * getattr(response, 'records_returned', 0))
+        finally:
+            fake._exit()
+        return httpx.Response(response.status_code, headers=dict(response.headers), content=response.content,
+                              request=request)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Passes requests through to Salesforce and keeps every query's records"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.responses = {}
+        self._pending = {}  # nextRecordsUrl -> SOQL it continues
+
+    def send(self, request, *args, **kwargs):
+        response = super().send(request, *args, **kwargs)
+        url = urlparse(request.url)
+        if response.status_code != 200 or '/query' not in url.path:
+            return response
+        body = response.json()
+        soql = parse_qs(url.query).get('q', [None])[0]
+        if soql is not None:
+            soql = normalize_soql(soql)
+            self.responses[soql] = list(body.get('records', []))
+        else:
+            soql = self._pending.pop(url.path, None)
+            if soql is None:
+                return response
+            self.responses[soql].extend(body.get('records', []))
+        if body.get('nextRecordsUrl'):
+            self._pending[body['nextRecordsUrl']] = soql
+        return response
+
+
+@click.command()
+@click.option('--retailer', '-r', 'retailers', multiple=True, required=True,
+              help='Retailer to record (repeatable)')
+@click.option('--search', 'searches', multiple=True, default=('',), show_default=True,
+              help='find_retailer terms to record (repeatable)')
+@click.option('--output', '-o', required=True, help='Fixture path (.json or .json.gz)')
+def main(retailers, searches, output):
+    """Record a fixture of real Salesforce responses for the given retailers"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from dotenv import load_dotenv
+    from rate_card_generator import RateCardGenerator
+
+    load_dotenv()
+    recorder = RecordingAdapter()
+    session = requests.Session()
+    session.mount('https://', recorder)
+    gen = RateCardGenerator(os.getenv('SF_USERNAME'), os.getenv('SF_PASSWORD'), os.getenv('SF_TOKEN'),
+                            os.getenv('SF_DOMAIN', 'login'), session=session)
+    for term in searches:
+        gen.find_retailer(term)
+    for retailer_name in retailers:
+        gen.get_data_fingerprint(retailer_name)
+        gen.process_rate_cards(retailer_name)
+    save_fixture(output, responses=recorder.responses)
+    click.echo(f"Recorded {len(recorder.responses)} queries to {output}")
+
+
+if __name__ == '__main__':
+    main()
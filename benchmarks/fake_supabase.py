@@ -0,0 +1,172 @@
+"""
+Local stand-in for the Supabase auth and REST endpoints used by supabase_client.
+
+Implements just enough of GoTrue (``/auth/v1/token``) and PostgREST
+(``/rest/v1/profiles``) for sign-in and profile lookups, with optional injected
+latency and a count of TCP connections so connection reuse can be measured.
+
+    server = FakeSupabase(latency=0.02)
+    server.start()
+    os.environ['SUPABASE_URL'] = server.url
+    ...
+    server.stop()
+"""
+import json
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+
+DEFAULT_JWT_SECRET = 'fake-supabase-jwt-secret-with-at-least-32-bytes'
+
+
+class FakeSupabase:
+    """In-process HTTP server answering Supabase auth and profiles requests"""
+
+    def __init__(self, latency: float = 0.0, jwt_secret: str = DEFAULT_JWT_SECRET, token_ttl: int = 3600):
+        self.latency = latency
+        self.jwt_secret = jwt_secret
+        self.token_ttl = token_ttl
+        self.users = {}       # email -> {'password', 'id'}
+        self.profiles = {}    # user id -> profile row
+        self.connections = 0
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def add_user(self, email: str, password: str, role: str = 'user', salesforce_id: str = None) -> str:
+        user_id = str(uuid.uuid4())
+        self.users[email] = {'password': password, 'id': user_id}
+        self.profiles[user_id] = {
+            'id': user_id,
+            'email': email,
+            'full_name': email.split('@')[0].replace('.', ' ').title(),
+            'role': role,
+            'salesforce_id': salesforce_id,
+        }
+        return user_id
+
+    def issue_session(self, user_id: str, email: str) -> dict:
+        now = int(time.time())
+        claims = {
+            'iss': f"{self.url}/auth/v1",
+            'sub': user_id,
+            'email': email,
+            'aud': 'authenticated',
+            'role': 'authenticated',
+            'iat': now,
+            'exp': now + self.token_ttl,
+            'session_id': str(uuid.uuid4()),
+        }
+        return {
+            'access_token': jwt.encode(claims, self.jwt_secret, algorithm='HS256'),
+            'token_type': 'bearer',
+            'expires_in': self.token_ttl,
+            'expires_at': now + self.token_ttl,
+            'refresh_token': f"{user_id}:{uuid.uuid4().hex}",
+            'user': {
+                'id': user_id,
+                'aud': 'authenticated',
+                'role': 'authenticated',
+                'email': email,
+                'created_at': '2025-01-01T00:00:00Z',
+                'app_metadata': {'provider': 'email'},
+                'user_metadata': {},
+            },
+        }
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, so reuse is visible
+
+            def setup(self):
+                super().setup()
+                # Headers and body are separate writes; don't let Nagle delay them
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def do_POST(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                body = self._read_json()
+
+                if url.path == '/auth/v1/token' and params.get('grant_type') == ['password']:
+                    fake._count('sign_in')
+                    user = fake.users.get(body.get('email'))
+                    if not user or user['password'] != body.get('password'):
+                        return self._send(400, {'code': 400, 'error_code': 'invalid_credentials',
+                                                'msg': 'Invalid login credentials'})
+                    return self._send(200, fake.issue_session(user['id'], body['email']))
+
+                if url.path == '/auth/v1/token' and params.get('grant_type') == ['refresh_token']:
+                    fake._count('refresh')
+                    user_id = (body.get('refresh_token') or '').split(':')[0]
+                    profile = fake.profiles.get(user_id)
+                    if not profile:
+                        return self._send(400, {'code': 400, 'error_code': 'refresh_token_not_found',
+                                                'msg': 'Invalid Refresh Token'})
+                    return self._send(200, fake.issue_session(user_id, profile['email']))
+
+                self._send(404, {'message': 'not found'})
+
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+
+                if url.path == '/rest/v1/profiles':
+                    fake._count('profile')
+                    user_id = (params.get('id') or [''])[0].replace('eq.', '', 1)
+                    profile = fake.profiles.get(user_id)
+                    return self._send(200, [profile] if profile else [])
+
+                self._send(404, {'message': 'not found'})
+
+        return Handler
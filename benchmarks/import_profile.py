@@ -0,0 +1,131 @@
+"""
+Import-time and cold-start profile for the web app.
+
+Runs each target in a fresh interpreter with ``python -X importtime`` and
+reports the cumulative cost of every top-level package it pulls in, then times
+a simulated serverless cold start (import web_app + first request) for the
+routes that should stay light.
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --output bench_output.json
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import cost we track between commits
+TARGETS = ['web_app', 'supabase_client', 'rate_card_generator', 'pdf_generator']
+
+# Routes that must not pull in pandas/reportlab/simple_salesforce on a cold start
+COLD_START_ROUTES = ['/login', '/dashboard']
+
+HEAVY_MODULES = ['pandas', 'openpyxl', 'simple_salesforce', 'reportlab', 'supabase']
+
+COLD_START_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import web_app
+imported = time.perf_counter()
+client = web_app.app.test_client()
+response = client.get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (done - imported) * 1000,
+    'status': response.status_code,
+    'heavy_modules_loaded': [m for m in sys.argv[2].split(',') if m in sys.modules],
+}))
+"""
+
+
+def profile_imports(module: str) -> dict:
+    """Import ``module`` in a clean interpreter and return per-package costs in ms"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    packages = {}
+    children = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, raw_name = line.split(':', 1)[1].split('|')
+        # Nesting is shown as two extra spaces per level after the "| " separator,
+        # and a module's own line is printed after all of its imports
+        level = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        name = raw_name.strip()
+        if level == 1:
+            top = name.split('.')[0]
+            children[top] = children.get(top, 0) + int(cumulative_us)
+        elif level == 0:
+            if name == module:
+                total_us = int(cumulative_us)
+                packages = children
+            children = {}
+
+    return {
+        'total_ms': round(total_us / 1000, 1),
+        'packages_ms': {k: round(v / 1000, 1) for k, v in
+                        sorted(packages.items(), key=lambda kv: kv[1], reverse=True)},
+    }
+
+
+def profile_cold_start(route: str) -> dict:
+    """Time importing web_app and serving one request in a fresh interpreter"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', COLD_START_SCRIPT, route, ','.join(HEAVY_MODULES)],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"cold start for {route} failed:\n{result.stderr[-2000:]}")
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats['process_wall_ms'] = round(wall_ms, 1)
+    stats['import_ms'] = round(stats['import_ms'], 1)
+    stats['first_request_ms'] = round(stats['first_request_ms'], 1)
+    return stats
+
+
+@click.command()
+@click.option('--output', '-o', help='Write the report as JSON to this path')
+@click.option('--top', default=8, help='Packages to show per module')
+def main(output, top):
+    """Profile import cost per module and cold-start time per light route"""
+    report = {'python': sys.version.split()[0], 'imports': {}, 'cold_start': {}}
+
+    for module in TARGETS:
+        stats = profile_imports(module)
+        report['imports'][module] = stats
+        click.echo(f"\n{module}: {stats['total_ms']} ms")
+        for package, ms in list(stats['packages_ms'].items())[:top]:
+            click.echo(f"  {package:<24} {ms:>8.1f} ms")
+
+    click.echo("\nCold start (import web_app + first request):")
+    for route in COLD_START_ROUTES:
+        stats = profile_cold_start(route)
+        report['cold_start'][route] = stats
+        heavy = ', '.join(stats['heavy_modules_loaded']) or 'none'
+        click.echo(f"  {route:<14} import {stats['import_ms']:>7.1f} ms, "
+                   f"request {stats['first_request_ms']:>6.1f} ms, "
+                   f"process {stats['process_wall_ms']:>7.1f} ms (heavy modules: {heavy})")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"\nReport written to {output}")
+
+
+if __name__ == '__main__':
+    main()
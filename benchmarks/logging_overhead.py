@@ -0,0 +1,149 @@
+"""
+Logging overhead of an in-process rate card build.
+
+Builds one rate card from synthetic Salesforce records (many opportunities,
+some line items missing their lender so the rate-limited warnings fire) with
+logging switched off, at INFO and at DEBUG, all through the queue handler from
+``log_config``. The difference to the "off" run is what logging costs a
+request. Output goes to /dev/null so terminal speed isn't measured.
+
+    python benchmarks/logging_overhead.py
+    python benchmarks/logging_overhead.py --opportunities 400 --output bench_output.json
+"""
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import time
+import timeit
+
+import click
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LENDERS = ['JN Bank', 'Novuna', 'Ikano', 'Omni Capital', 'Tandem']
+VERTICALS = ['Solar', 'Heat Pump', 'Windows', 'Kitchens']
+TERMS = (12, 24, 36, 60, 120)
+
+
+class SyntheticSalesforce:
+    """Answers the generator's queries from memory; stands in for simple_salesforce"""
+
+    opportunities = 100
+    missing_lender_every = 10
+
+    def __init__(self, session=None, **credentials):
+        self.session = session or requests.Session()
+
+    def _opportunity(self, index):
+        lender = None if index % self.missing_lender_every == 0 else LENDERS[index % len(LENDERS)]
+        return {
+            'Lender_Company__r': {'Name': lender} if lender else None,
+            'Approved_Product__r': {'Name': VERTICALS[index % len(VERTICALS)]},
+            'Shermin_Commission__c': 2.5,
+        }
+
+    def query(self, soql, **kwargs):
+        if 'FROM OpportunityLineItem' in soql:
+            return self.query_all(soql)
+        records = [{'RecordType': {'DeveloperName': 'Retailer'}, 'Parent': None}]
+        return {'records': records, 'totalSize': 1, 'done': True}
+
+    def query_all(self, soql, **kwargs):
+        if 'FROM Assigned_Rate_Card__c' in soql:
+            records = [{
+                'Id': f'a{index}',
+                'Name': f'ARC-{index}',
+                'Opportunity__c': f'006{index:06d}',
+                'Prime_SubPrime__c': 'Prime',
+                'Prime_Lender_Position__c': index % 5 + 1,
+                'Sub_Prime_Lender_Position__c': None,
+                'Opportunity__r': self._opportunity(index),
+            } for index in range(self.opportunities)]
+            return {'records': records, 'totalSize': len(records), 'done': True}
+
+        # Line items of the quoted opportunities, or of them all for account-wide queries
+        indexes = [int(index) for index in re.findall(r"'006(\d+)'", soql)] or range(self.opportunities)
+        if 'COUNT(Id)' in soql:
+            records = [{'OpportunityId': f'006{index:06d}', 'expr0': len(TERMS)} for index in indexes]
+            return {'records': records, 'totalSize': len(records), 'done': True}
+        records = [{
+            'OpportunityId': f'006{index:06d}',
+            'Opportunity': self._opportunity(index),
+            'Product2': {'Name': f'{term} month IFC', 'APR__c': 9.9, 'Term__c': term,
+                         'ProductCode': 'IFC', 'Deferred_Period__c': 0},
+            'Retailer_Subsidy__c': 1.5,
+            'Retailer_Commission__c': 0,
+        } for index in indexes for term in TERMS]
+        return {'records': records, 'totalSize': len(records), 'done': True}
+
+
+def build_once(gen, retailer_name):
+    start = time.perf_counter()
+    gen.process_rate_cards(retailer_name)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option('--opportunities', '-n', default=200, show_default=True, help='Synthetic opportunities per rate card')
+@click.option('--runs', '-r', default=7, show_default=True, help='Builds per logging level (median is reported)')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Also write the results as JSON')
+def main(opportunities, runs, output):
+    """Measure what logging costs a rate card build at each level"""
+    import rate_card_generator
+    from log_config import setup_logging, stop_logging
+
+    SyntheticSalesforce.opportunities = opportunities
+    rate_card_generator.Salesforce = SyntheticSalesforce
+    gen = rate_card_generator.RateCardGenerator('bench', 'bench', 'bench')
+
+    devnull = open(os.devnull, 'w')
+    setup_logging('INFO', stream=devnull)
+    build_once(gen, 'Benchmark Retailer')  # warm pandas up
+
+    # Levels take turns within each round so drift (CPU boost, GC) hits them equally
+    levels = ('off', 'INFO', 'DEBUG')
+    timings = {level: [] for level in levels}
+    for _ in range(runs):
+        for level in levels:
+            if level == 'off':
+                logging.disable(logging.CRITICAL)
+            else:
+                logging.disable(logging.NOTSET)
+                setup_logging(level)
+            timings[level].append(build_once(gen, 'Benchmark Retailer'))
+    logging.disable(logging.NOTSET)
+
+    results = {'opportunities': opportunities, 'line_items': opportunities * len(TERMS), 'runs': runs, 'levels': {
+        level: {'median_ms': statistics.median(t) * 1000, 'min_ms': min(t) * 1000} for level, t in timings.items()
+    }}
+
+    # Cost of a debug call that is filtered out, the common case in the hot loops
+    setup_logging('INFO')
+    logger = logging.getLogger('rate_card_generator')
+    calls = 200000
+    seconds = timeit.timeit(lambda: logger.debug("Opportunity %s: %d line items", '006000001', 5), number=calls)
+    results['suppressed_debug_call_ns'] = seconds / calls * 1e9
+    stop_logging()
+    devnull.close()
+
+    floor = results['levels']['off']['median_ms']
+    click.echo(f"Rate card with {opportunities} opportunities, {results['line_items']} line items, "
+               f"median of {runs} builds:")
+    for level, timing in results['levels'].items():
+        overhead = timing['median_ms'] - floor
+        click.echo(f"  {level:<6} {timing['median_ms']:8.1f} ms  ({overhead:+.1f} ms, {overhead / floor:+.1%})")
+    click.echo(f"Suppressed logger.debug() call: {results['suppressed_debug_call_ns']:.0f} ns")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Login latency benchmark against a local Supabase stand-in.
+
+Measures ``authenticate_user`` + ``get_user_profile`` (what /login does) in two
+modes:
+
+- ``cold``: clients rebuilt and profile cache cleared before every login,
+  which is what every login cost before clients were pooled
+- ``pooled``: long-lived clients with keep-alive connections and the profile cache
+
+    python benchmarks/login_latency.py --logins 200 --latency 0.02
+"""
+import json
+import os
+import statistics
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+def run_logins(supabase_client, users, logins: int, cold: bool) -> list:
+    timings = []
+    for i in range(logins):
+        email, password = users[i % len(users)]
+        if cold:
+            supabase_client.reset_clients()
+            supabase_client.invalidate_user_profile()
+
+        start = time.perf_counter()
+        response = supabase_client.authenticate_user(email, password)
+        profile = supabase_client.get_user_profile(response.user.id)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert profile and profile['email'] == email
+    return timings
+
+
+def summarise(timings: list) -> dict:
+    ordered = sorted(timings)
+    return {
+        'logins': len(ordered),
+        'mean_ms': round(statistics.mean(ordered), 2),
+        'p50_ms': round(ordered[len(ordered) // 2], 2),
+        'p95_ms': round(ordered[int(len(ordered) * 0.95) - 1], 2),
+        'max_ms': round(ordered[-1], 2),
+    }
+
+
+@click.command()
+@click.option('--logins', default=100, help='Logins per mode')
+@click.option('--users', 'user_count', default=10, help='Distinct users cycled through')
+@click.option('--latency', default=0.0, help='Injected server latency per request (seconds)')
+@click.option('--output', '-o', help='Write results as JSON to this path')
+def main(logins, user_count, latency, output):
+    """Compare per-login client construction with pooled clients + profile cache"""
+    server = FakeSupabase(latency=latency).start()
+    users = []
+    for i in range(user_count):
+        email = f"user{i}@example.com"
+        server.add_user(email, 'password', role='admin' if i == 0 else 'user')
+        users.append((email, 'password'))
+
+    os.environ['SUPABASE_URL'] = server.url
+    os.environ['SUPABASE_ANON_KEY'] = 'anon-key'
+    os.environ['SUPABASE_SERVICE_ROLE_KEY'] = 'service-key'
+    import supabase_client
+
+    results = {}
+    try:
+        for mode in ('cold', 'pooled'):
+            supabase_client.reset_clients()
+            supabase_client.invalidate_user_profile()
+            connections_before = server.connections
+            requests_before = dict(server.requests)
+
+            stats = summarise(run_logins(supabase_client, users, logins, cold=(mode == 'cold')))
+            stats['tcp_connections'] = server.connections - connections_before
+            stats['profile_requests'] = server.requests.get('profile', 0) - requests_before.get('profile', 0)
+            results[mode] = stats
+            click.echo(f"{mode:>7}: mean {stats['mean_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, "
+                       f"p95 {stats['p95_ms']:.2f} ms, {stats['tcp_connections']} connections, "
+                       f"{stats['profile_requests']} profile fetches")
+    finally:
+        supabase_client.reset_clients()
+        server.stop()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'latency_s': latency, 'results': results}, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
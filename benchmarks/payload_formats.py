@@ -0,0 +1,103 @@
+"""
+/generate-data payload size and serialization time: row JSON vs NDJSON vs columnar.
+
+Builds the rate cards of the benchmark retailers (``--profile``, see
+``salesforce_fixtures.PROFILES``) against the fake Salesforce, then serializes
+each one ``--repeat`` times the way /generate-data does:
+
+- json: ``df.to_dict('records')`` per vertical, dumped as one object
+- ndjson: one ``df.to_json(orient='records')`` line per vertical
+- columnar: ``columnar.dumps`` (schema header, per-column arrays,
+  dictionary-encoded repeated strings)
+
+Reported per format: bytes, gzipped bytes (level 6, as the columnar response is
+sent), and the best serialization and gzip times. The columnar payload is
+decoded again and must give the same rows as the JSON one.
+
+    python benchmarks/payload_formats.py
+    python benchmarks/payload_formats.py --profile huge --repeat 10 -o payload_formats.json
+"""
+import gzip
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce  # noqa: E402
+from salesforce_fixtures import PROFILES, build_tables, retailer_name  # noqa: E402
+
+
+def _best(function, repeat: int):
+    """(result, fastest seconds) over ``repeat`` calls"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _serializers():
+    import columnar
+
+    return {
+        'json': lambda data: json.dumps({vertical: df.to_dict('records') for vertical, df in data.items()}),
+        'ndjson': lambda data: ''.join('{"vertical": %s, "rows": %s}\n' % (json.dumps(vertical),
+                                                                           df.to_json(orient='records'))
+                                       for vertical, df in data.items()),
+        'columnar': columnar.dumps,
+    }
+
+
+@click.command()
+@click.option('--profile', 'profiles', multiple=True, type=click.Choice(list(PROFILES)),
+              help='Retailer size profiles (repeatable; default all)')
+@click.option('--repeat', default=5, show_default=True, help='Serializations per format; the fastest counts')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(profiles, repeat, output):
+    """Compare /generate-data payload formats on benchmark rate cards"""
+    import columnar
+    import rate_card_snapshots
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    rate_card_snapshots.snapshot_store = rate_card_snapshots.SnapshotStore(tempfile.mkdtemp())
+    profiles = list(profiles or PROFILES)
+    fake = FakeSalesforce({'tables': build_tables(profiles)})
+    gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+    results = {'repeat': repeat, 'profiles': {}}
+
+    for profile in profiles:
+        data = gen.process_rate_cards(retailer_name(profile))
+        rows = sum(len(df) for df in data.values())
+        result = results['profiles'][profile] = {'verticals': len(data), 'rows': rows, 'formats': {}}
+        click.echo(f"{profile}: {len(data)} verticals, {rows} rows")
+        for name, serialize in _serializers().items():
+            body, seconds = _best(lambda: serialize(data).encode('utf-8'), repeat)
+            compressed, gzip_seconds = _best(lambda: gzip.compress(body, compresslevel=6, mtime=0), repeat)
+            result['formats'][name] = {'bytes': len(body), 'gzip_bytes': len(compressed),
+                                       'serialize_ms': round(seconds * 1000, 2),
+                                       'gzip_ms': round(gzip_seconds * 1000, 2)}
+            click.echo(f"  {name:8s} {len(body):10,d} B  gzip {len(compressed):9,d} B  "
+                       f"serialize {seconds * 1000:8.2f} ms  gzip {gzip_seconds * 1000:7.2f} ms")
+            if name == 'columnar' and columnar.decode(json.loads(body)) != {
+                    vertical: df.to_dict('records') for vertical, df in data.items()}:
+                raise click.ClickException(f"The columnar payload for {profile} decodes to different rows")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+process_rate_cards at scale, straight from synthetic DataFrames.
+
+Generates a synthetic org (``salesforce_fixtures.generate_org``), builds the
+line-item DataFrame ``get_rate_card_items`` would return for retailers at
+several size percentiles, and times ``process_rate_cards`` on each with no
+Salesforce calls at all, so only the pandas work is measured.
+
+    python benchmarks/processing_scale.py
+    python benchmarks/processing_scale.py --retailers 3000 --lenders 400 --seed 7 --output bench_processing.json
+"""
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from salesforce_fixtures import DEFAULT_SHAPE, generate_org, rate_card_frame  # noqa: E402
+
+PERCENTILES = (50, 90, 99, 100)
+
+
+def pick_retailers(tables, percentiles=PERCENTILES) -> dict:
+    """Retailer at each percentile of live line-item count (100 is the largest)"""
+    items_per_opportunity = {}
+    for item in tables['OpportunityLineItem']:
+        if item['Active__c']:
+            items_per_opportunity[item['OpportunityId']] = items_per_opportunity.get(item['OpportunityId'], 0) + 1
+    sizes = {}
+    names = {a['Id']: a['Name'] for a in tables['Account']}
+    for opportunity in tables['Opportunity']:
+        if opportunity['StageName'] == 'Live':
+            name = names[opportunity['AccountId']]
+            sizes[name] = sizes.get(name, 0) + items_per_opportunity.get(opportunity['Id'], 0)
+    ranked = sorted(sizes, key=sizes.get)
+    return {f"p{p}": ranked[max(0, math.ceil(len(ranked) * p / 100) - 1)] for p in percentiles}
+
+
+@click.command()
+@click.option('--seed', default=0, show_default=True)
+@click.option('--retailers', default=DEFAULT_SHAPE['retailers'], show_default=True)
+@click.option('--lenders', default=DEFAULT_SHAPE['lenders'], show_default=True)
+@click.option('--runs', '-n', default=3, show_default=True, help='Timed runs per retailer')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(seed, retailers, lenders, runs, output):
+    """Time process_rate_cards on synthetic retailers of increasing size"""
+    import logging
+
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+
+    class FrameRateCardGenerator(RateCardGenerator):
+        """Reads line items from prebuilt DataFrames instead of Salesforce"""
+
+        def __init__(self, frames):
+            self.frames = frames
+            self.product_groupings = None
+
+        def iter_rate_card_items(self, retailer_name, progress=None):
+            for index, record in enumerate(self.frames[retailer_name].to_dict('records')):
+                yield (index, 0), record
+
+    start = time.perf_counter()
+    tables = generate_org(seed, retailers=retailers, lenders=lenders)
+    click.echo(f"Generated {len(tables['OpportunityLineItem'])} line items for {retailers} retailers "
+               f"in {time.perf_counter() - start:.1f}s (seed {seed})")
+
+    targets = pick_retailers(tables)
+    frames = {name: rate_card_frame(tables, name) for name in targets.values()}
+    gen = FrameRateCardGenerator(frames)
+    gen.process_rate_cards(targets['p50'])  # warm pandas up
+
+    results = {}
+    for label, name in targets.items():
+        timings = []
+        for _ in range(runs):
+            begin = time.perf_counter()
+            data = gen.process_rate_cards(name)
+            timings.append((time.perf_counter() - begin) * 1000)
+        median_ms = statistics.median(timings)
+        line_items = len(frames[name])
+        results[label] = {
+            'retailer': name,
+            'line_items': line_items,
+            'verticals': len(data),
+            'rate_card_rows': sum(len(df) for df in data.values()),
+            'median_ms': round(median_ms, 2),
+            'min_ms': round(min(timings), 2),
+            'line_items_per_second': round(line_items / (median_ms / 1000)) if median_ms else None,
+        }
+        click.echo(f"  {label:<5} {line_items:7d} line items, {results[label]['verticals']:2d} verticals: "
+                   f"median {median_ms:9.1f} ms ({results[label]['line_items_per_second'] or 0:,} items/s)")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'seed': seed, 'retailers': retailers, 'lenders': lenders, 'runs': runs, 'results': results},
+                      f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
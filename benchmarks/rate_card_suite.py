@@ -0,0 +1,206 @@
+"""
+End-to-end rate card benchmark suite against the fake Salesforce.
+
+Times ``find_retailer``, ``find_retailer_page``, ``process_rate_cards``, ``generate_excel`` and
+``generate_pdf`` for small, medium and huge retailers (see
+``salesforce_fixtures.PROFILES``) through the real simple_salesforce client,
+with optional injected network latency. Results are saved as JSON, and a
+previous run can be compared against to catch regressions between commits.
+
+    python benchmarks/rate_card_suite.py --output bench_rate_cards.json
+    python benchmarks/rate_card_suite.py --latency 0.05 --size small --size medium
+    python benchmarks/rate_card_suite.py --compare bench_rate_cards.json --fail-on-regression
+
+A recorded fixture (see ``fake_salesforce.py``) can replace the generated
+tables; name the retailers it holds with ``--retailer``.
+"""
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce, load_fixture  # noqa: E402
+from salesforce_fixtures import PROFILES, build_tables, retailer_name  # noqa: E402
+
+OPERATIONS = ('find_retailer', 'find_retailer_page', 'process_rate_cards', 'generate_excel', 'generate_pdf')
+
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {'commit': git('rev-parse', '--short', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '-uno'))}
+
+
+def summarise(timings: list) -> dict:
+    ordered = sorted(timings)
+    return {
+        'runs': len(ordered),
+        'median_ms': round(statistics.median(ordered), 2),
+        'p95_ms': round(ordered[math.ceil(len(ordered) * 0.95) - 1], 2),
+        'min_ms': round(ordered[0], 2),
+    }
+
+
+def time_operation(fake, runs: int, func) -> dict:
+    """Run ``func`` ``runs`` times; timings plus Salesforce calls per run"""
+    timings = []
+    fake.reset_counts()
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    stats = summarise(timings)
+    stats['salesforce_calls'] = sum(fake.requests.values()) // runs
+    return stats
+
+
+def benchmark_retailer(gen, pdf_gen, fake, name: str, runs: int, operations) -> dict:
+    results = {}
+    data = None
+    if 'find_retailer' in operations:
+        results['find_retailer'] = time_operation(fake, runs, lambda: gen.find_retailer(name))
+    if 'find_retailer_page' in operations:
+        results['find_retailer_page'] = time_operation(fake, runs, lambda: gen.find_retailer_page(name))
+    if 'process_rate_cards' in operations:
+        results['process_rate_cards'] = time_operation(fake, runs, lambda: gen.process_rate_cards(name))
+    if 'generate_excel' in operations or 'generate_pdf' in operations:
+        data = gen.process_rate_cards(name)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if 'generate_excel' in operations:
+            path = os.path.join(tmp, 'rate_card.xlsx')
+            results['generate_excel'] = time_operation(fake, runs, lambda: gen.generate_excel(name, data, path))
+            results['generate_excel']['bytes'] = os.path.getsize(path)
+        if 'generate_pdf' in operations:
+            path = os.path.join(tmp, 'rate_card.pdf')
+            results['generate_pdf'] = time_operation(fake, runs, lambda: pdf_gen.generate_pdf(name, data, path))
+            results['generate_pdf']['bytes'] = os.path.getsize(path)
+
+    if data is None:
+        data = gen.process_rate_cards(name)
+    results['shape'] = {'verticals': len(data), 'rows': sum(len(df) for df in data.values())}
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Print median changes against ``baseline``; returns the regressions"""
+    regressions = []
+    click.echo(f"\nCompared with {baseline['revision'].get('commit')} ({baseline['started_at']}):")
+    for setting in ('latency_s', 'record_latency_s', 'fixture'):
+        if baseline.get(setting) != current.get(setting):
+            click.echo(f"  note: {setting} differs ({baseline.get(setting)} -> {current.get(setting)})")
+    for size, operations in current['results'].items():
+        for operation, stats in operations.items():
+            before = baseline['results'].get(size, {}).get(operation)
+            if operation == 'shape' or not before:
+                continue
+            change = (stats['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append(f"{size}/{operation}")
+            click.echo(f"  {size:<8} {operation:<20} {before['median_ms']:10.1f} -> "
+                       f"{stats['median_ms']:10.1f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+@click.command()
+@click.option('--size', 'sizes', multiple=True, type=click.Choice(list(PROFILES)),
+              help='Retailer sizes to run (repeatable; default all)')
+@click.option('--operation', 'operations', multiple=True, type=click.Choice(OPERATIONS),
+              help='Operations to time (repeatable; default all)')
+@click.option('--runs', '-n', default=3, show_default=True, help='Timed runs per operation')
+@click.option('--latency', default=0.0, show_default=True, help='Injected latency per Salesforce call (seconds)')
+@click.option('--record-latency', default=0.0, show_default=True,
+              help='Injected latency per record returned (seconds)')
+@click.option('--fixture', type=click.Path(exists=True, dir_okay=False),
+              help='Recorded fixture to replay instead of the generated tables')
+@click.option('--retailer', 'retailers', multiple=True, help='Retailers in --fixture to benchmark (repeatable)')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Previous results JSON to compare against')
+@click.option('--threshold', default=0.10, show_default=True, help='Median slowdown counted as a regression')
+@click.option('--fail-on-regression', is_flag=True, help='Exit 1 if any operation regressed past --threshold')
+def main(sizes, operations, runs, latency, record_latency, fixture, retailers, output, baseline_path, threshold,
+         fail_on_regression):
+    """Benchmark rate card search, processing and rendering per retailer size"""
+    from pdf_generator import PDFGenerator
+    from rate_card_generator import RateCardGenerator
+
+    # Skipped-record warnings would otherwise be timed along with the work
+    logging.disable(logging.WARNING)
+
+    operations = operations or OPERATIONS
+    if fixture:
+        if not retailers:
+            raise click.UsageError('--fixture needs at least one --retailer')
+        targets = {name: name for name in retailers}
+        fake_fixture = load_fixture(fixture)
+    else:
+        sizes = sizes or tuple(PROFILES)
+        targets = {size: retailer_name(size) for size in sizes}
+        fake_fixture = {'tables': build_tables(sizes)}
+
+    fake = FakeSalesforce(fake_fixture, latency=latency, record_latency=record_latency)
+    gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+    pdf_gen = PDFGenerator()
+
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency_s': latency,
+        'record_latency_s': record_latency,
+        'fixture': os.path.basename(fixture) if fixture else 'generated',
+        'results': {},
+    }
+
+    # One untimed pass so imports and first-use setup don't land on the first size
+    gen.process_rate_cards(next(iter(targets.values())))
+
+    for label, name in targets.items():
+        click.echo(f"{label}: {name}")
+        results = benchmark_retailer(gen, pdf_gen, fake, name, runs, operations)
+        report['results'][label] = results
+        click.echo(f"  {results['shape']['verticals']} verticals, {results['shape']['rows']} rate card rows")
+        for operation in operations:
+            stats = results[operation]
+            click.echo(f"  {operation:<20} median {stats['median_ms']:10.1f} ms  p95 {stats['p95_ms']:10.1f} ms  "
+                       f"{stats['salesforce_calls']:5d} Salesforce calls")
+    if fake.unmatched:
+        click.echo(f"Warning: {len(fake.unmatched)} queries the fake could not answer, first: {fake.unmatched[0]}",
+                   err=True)
+
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(json.load(f), report, threshold)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+    if regressions and fail_on_regression:
+        click.echo(f"{len(regressions)} regression(s): {', '.join(regressions)}", err=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
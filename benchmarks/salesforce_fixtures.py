@@ -0,0 +1,339 @@
+"""
+Synthetic Salesforce data for benchmarks and scale testing.
+
+Builds the Accounts, Opportunities, Product2s, OpportunityLineItems and
+Assigned_Rate_Card__c records the rate card queries read, in the normalised
+form ``FakeSalesforce`` evaluates SOQL against. Everything is drawn from a
+seeded ``random.Random``, so the same seed and shape always give the same org.
+
+- ``build_tables(profiles)``: one retailer per size profile (``PROFILES``),
+  used by the benchmark suite
+- ``generate_org(seed, **shape)``: a whole org at production scale or beyond,
+  with the distributions in ``DEFAULT_SHAPE`` (retailers, branches, lender
+  panels, products per rate card, Prime/Sub-Prime split, deferred periods,
+  subsidies, commissions, inactive and incomplete records)
+- ``rate_card_frame(tables, retailer)``: the DataFrame ``get_rate_card_items``
+  would return for a retailer, for benchmarking ``process_rate_cards`` without
+  any Salesforce calls
+
+    python benchmarks/salesforce_fixtures.py --retailers 2000 --lenders 300 -o org.json.gz
+"""
+import os
+import random
+import sys
+from typing import Dict, Iterable, List, Optional
+
+import click
+
+# lenders x verticals live opportunities, each with `products` line items
+PROFILES = {
+    'small': {'lenders': 3, 'verticals': 2, 'products': 4, 'branches': 0},
+    'medium': {'lenders': 10, 'verticals': 4, 'products': 12, 'branches': 1},
+    'huge': {'lenders': 40, 'verticals': 8, 'products': 36, 'branches': 3},
+}
+
+# Distributions for generate_org. Ranges are inclusive (low, high) and drawn
+# with ``size_skew``: 0 is uniform, higher puts most retailers near the low end
+# with a long tail of large ones, as in production.
+DEFAULT_SHAPE = {
+    'retailers': 1000,
+    'lenders': 200,
+    'branches': (0, 6),
+    'verticals_per_retailer': (1, 5),
+    'panel_size': (2, 25),                # lenders per vertical on a retailer's rate card
+    'products_per_rate_card': (3, 40),    # line items per opportunity
+    'size_skew': 2.0,
+    'prime_share': 0.6,                   # share of a panel in Prime positions
+    'deferred_weights': {0: 0.7, 6: 0.15, 12: 0.15},
+    'subsidy_rate': 0.4,                  # line items with a retailer subsidy
+    'subsidy_range': (0.5, 9.9),
+    'retailer_commission_range': (0.0, 3.0),
+    'commission_range': (0.5, 6.0),
+    'apr_range': (0.0, 19.9),
+    'inactive_rate': 0.05,                # ARCs and line items with Active__c = false
+    'not_live_rate': 0.05,                # opportunities in a stage other than Live
+    'missing_lender_rate': 0.0,           # opportunities without a lender (skipped by the generator)
+}
+
+VERTICALS = ['Solar', 'Heat Pump', 'Windows', 'Kitchens', 'Bathrooms', 'Boilers', 'Batteries', 'EV Chargers',
+             'Roofing', 'Driveways', 'Conservatories', 'Flooring', 'Furniture', 'Hot Tubs', 'Garden Rooms']
+TERMS = [12, 24, 36, 48, 60, 84, 120, 180]
+PRODUCT_CODES = ['IFC', 'IBC', 'BNPL']
+NAME_WORDS = ['Acme', 'Bright', 'Cedar', 'Delta', 'Evergreen', 'Falcon', 'Granite', 'Harbour', 'Iris', 'Juniper',
+              'Kestrel', 'Linden', 'Maple', 'Northern', 'Oak', 'Pioneer', 'Quarry', 'Riverside', 'Summit', 'Thames',
+              'Union', 'Valley', 'Westfield', 'Yorkshire', 'Zenith']
+NAME_SUFFIXES = ['Home Improvements', 'Renewables', 'Energy', 'Installations', 'Interiors', 'Group', 'Solutions',
+                 'Windows & Doors', 'Heating', 'Living']
+STAGES = ['Live', 'Draft', 'Closed Lost', 'Suspended']
+MODSTAMP = '2025-01-01T00:00:00.000+0000'
+
+
+def retailer_name(profile: str) -> str:
+    return f"Bench {profile.title()} Retailer"
+
+
+class _Ids:
+    """Salesforce-looking record Ids with the real key prefix per object
+
+    18-character Ids, as the API returns them: 15 case-sensitive characters and
+    a checksum of them, so the 15-character forms are unique too, as in an org.
+    """
+
+    PREFIXES = {'Account': '001', 'Opportunity': '006', 'Product2': '01t', 'OpportunityLineItem': '00k',
+                'Assigned_Rate_Card__c': 'a0A', 'Approved_Product__c': 'a0B', 'RecordType': '012', 'User': '005'}
+
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, object_type: str) -> str:
+        self.counts[object_type] = self.counts.get(object_type, 0) + 1
+        return with_checksum(f"{self.PREFIXES[object_type]}{self.counts[object_type]:012d}")
+
+
+def with_checksum(id15: str) -> str:
+    """The 18-character form of a 15-character Salesforce Id"""
+    suffix = ''
+    for start in (0, 5, 10):
+        bits = sum(1 << i for i, char in enumerate(id15[start:start + 5]) if 'A' <= char <= 'Z')
+        suffix += 'ABCDEFGHIJKLMNOPQRSTUVWXYZ012345'[bits]
+    return id15 + suffix
+
+
+class OrgBuilder:
+    """Appends consistent, cross-referenced records to a set of fixture tables"""
+
+    def __init__(self, rng: random.Random, shape: Optional[Dict] = None):
+        self.rng = rng
+        self.shape = dict(DEFAULT_SHAPE, **(shape or {}))
+        self.new_id = _Ids()
+        self.tables = {name: [] for name in _Ids.PREFIXES}
+        self.record_types = {}
+        for sobject, developer_name in [('Account', 'Retailer'), ('Account', 'Retailer_Branch'),
+                                        ('Account', 'Lender'), ('Opportunity', 'Retailer_Rate_Card')]:
+            self.record_types[developer_name] = self._add('RecordType', DeveloperName=developer_name,
+                                                          SobjectType=sobject)
+        self.owners = [self._add('User', Name=f"Account Manager {index + 1}") for index in range(5)]
+        self.products = {}
+        self.lenders = []
+        self.catalogue = {}   # lender Id -> (Product2 Ids, weights by deferred period)
+
+    def _add(self, object_type: str, **fields) -> str:
+        record = dict(fields, Id=self.new_id(object_type))
+        self.tables[object_type].append(record)
+        return record['Id']
+
+    def uniform(self, bounds) -> float:
+        return round(self.rng.uniform(*bounds), 2)
+
+    def count(self, bounds) -> int:
+        """Integer in the inclusive range, skewed towards the low end by ``size_skew``"""
+        low, high = bounds
+        return low + int(self.rng.random() ** (1 + self.shape['size_skew']) * (high - low + 1))
+
+    def vertical(self, name: str) -> str:
+        if name not in self.products:
+            self.products[name] = self._add('Approved_Product__c', Name=name)
+        return self.products[name]
+
+    def add_lender(self, name: str) -> str:
+        lender_id = self._add('Account', Name=name, RecordTypeId=self.record_types['Lender'],
+                              OwnerId=self.owners[0], ParentId=None)
+        products, weights = self.catalogue[lender_id] = [], []
+        for term in TERMS:
+            for deferred, weight in self.shape['deferred_weights'].items():
+                for code in PRODUCT_CODES:
+                    products.append(self._add(
+                        'Product2', Name=f"{name} {code} {term}m" + (f" {deferred}m deferred" if deferred else ''),
+                        APR__c=round(self.rng.uniform(*self.shape['apr_range']), 1), Term__c=term,
+                        ProductCode=code, Deferred_Period__c=deferred, SystemModstamp=MODSTAMP))
+                    weights.append(weight)
+        self.lenders.append(lender_id)
+        return lender_id
+
+    def add_retailer(self, name: str, verticals: List[str], panel: Dict[str, List[str]], products: Dict,
+                     branches: int = 0) -> str:
+        """A retailer with ``panel[vertical]`` lenders per vertical, plus branches sharing its rate cards
+
+        ``products[vertical]`` is the number of line items per opportunity, or
+        a callable returning it.
+        """
+        shape = self.shape
+        owner = self.rng.choice(self.owners)
+        retailer_id = self._add('Account', Name=name, RecordTypeId=self.record_types['Retailer'],
+                                OwnerId=owner, ParentId=None)
+        accounts = [retailer_id] + [
+            self._add('Account', Name=f"{name} Branch {index + 1}", RecordTypeId=self.record_types['Retailer_Branch'],
+                      OwnerId=owner, ParentId=retailer_id)
+            for index in range(branches)]
+
+        for vertical in verticals:
+            lenders = panel[vertical]
+            prime_slots = max(1, round(len(lenders) * shape['prime_share']))
+            for position, lender_id in enumerate(lenders, 1):
+                missing_lender = self.rng.random() < shape['missing_lender_rate']
+                opportunity_id = self._add(
+                    'Opportunity', Name=f"{name} - {vertical} - {position}", AccountId=retailer_id,
+                    RecordTypeId=self.record_types['Retailer_Rate_Card'],
+                    StageName='Live' if self.rng.random() >= shape['not_live_rate'] else self.rng.choice(STAGES[1:]),
+                    Lender_Company__c=None if missing_lender else lender_id,
+                    Approved_Product__c=self.vertical(vertical),
+                    Shermin_Commission__c=self.uniform(shape['commission_range']), SystemModstamp=MODSTAMP)
+
+                count = products[vertical]() if callable(products[vertical]) else products[vertical]
+                catalogue, weights = self.catalogue[lender_id]
+                # Draw with replacement by deferral weight, then keep the first `count` distinct products
+                chosen = self.rng.choices(catalogue, weights=weights, k=min(count * 2, len(catalogue)))
+                for product in list(dict.fromkeys(chosen))[:count]:
+                    subsidised = self.rng.random() < shape['subsidy_rate']
+                    self._add('OpportunityLineItem', OpportunityId=opportunity_id, Product2Id=product,
+                              Active__c=self.rng.random() >= shape['inactive_rate'],
+                              Retailer_Subsidy__c=self.uniform(shape['subsidy_range']) if subsidised else 0,
+                              Retailer_Commission__c=0 if subsidised else self.uniform(
+                                  shape['retailer_commission_range']),
+                              SystemModstamp=MODSTAMP)
+
+                prime = position <= prime_slots
+                for account_id in accounts:
+                    self._add('Assigned_Rate_Card__c', Name=f"ARC {opportunity_id} {account_id}",
+                              Retailer__c=account_id, Opportunity__c=opportunity_id,
+                              Active__c=self.rng.random() >= shape['inactive_rate'],
+                              Prime_SubPrime__c='Prime' if prime else 'Sub-Prime',
+                              Prime_Lender_Position__c=position if prime else None,
+                              Sub_Prime_Lender_Position__c=None if prime else position - prime_slots,
+                              SystemModstamp=MODSTAMP)
+        return retailer_id
+
+    def finish(self) -> Dict:
+        return self.tables
+
+
+def build_tables(profiles: Iterable[str] = tuple(PROFILES), seed: int = 0) -> Dict:
+    """Fixture tables holding one retailer (plus branches) per profile
+
+    Exact sizes with every record active and live, so benchmark timings are
+    comparable between runs.
+    """
+    profiles = list(profiles)
+    builder = OrgBuilder(random.Random(seed), {'inactive_rate': 0, 'not_live_rate': 0, 'subsidy_range': (0, 8)})
+    for index in range(max(PROFILES[p]['lenders'] for p in profiles)):
+        builder.add_lender(f"Bench Lender {index + 1:03d}")
+    for profile in profiles:
+        shape = PROFILES[profile]
+        verticals = VERTICALS[:shape['verticals']]
+        builder.add_retailer(retailer_name(profile), verticals,
+                             {vertical: builder.lenders[:shape['lenders']] for vertical in verticals},
+                             {vertical: shape['products'] for vertical in verticals}, shape['branches'])
+    return builder.finish()
+
+
+def generate_org(seed: int = 0, **shape) -> Dict:
+    """Fixture tables for a whole synthetic org; keyword arguments override DEFAULT_SHAPE"""
+    rng = random.Random(seed)
+    builder = OrgBuilder(rng, shape)
+    shape = builder.shape
+
+    for index in range(shape['lenders']):
+        builder.add_lender(f"{rng.choice(NAME_WORDS)} Finance {index + 1:03d}")
+
+    for index in range(shape['retailers']):
+        name = f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_SUFFIXES)} {index + 1:04d}"
+        verticals = rng.sample(VERTICALS, min(builder.count(shape['verticals_per_retailer']), len(VERTICALS)))
+        panel = {vertical: rng.sample(builder.lenders, min(builder.count(shape['panel_size']), len(builder.lenders)))
+                 for vertical in verticals}
+        products = {vertical: (lambda: builder.count(shape['products_per_rate_card'])) for vertical in verticals}
+        builder.add_retailer(name, verticals, panel, products, builder.count(shape['branches']))
+    return builder.finish()
+
+
+def rate_card_frame(tables: Dict, retailer: str):
+    """What ``get_rate_card_items`` returns for ``retailer``, built without Salesforce
+
+    Applies the same filters (active ARCs and line items, live rate card
+    opportunities, a branch reads its parent's opportunities) and produces the
+    same columns and row order.
+    """
+    import pandas as pd
+
+    by_id = {record['Id']: record for records in tables.values() for record in records}
+    record_type = {r['Id']: r['DeveloperName'] for r in tables['RecordType']}
+    account = next((a for a in tables['Account'] if a['Name'] == retailer), None)
+    if account is None:
+        return pd.DataFrame()
+    owner_account = account
+    if record_type.get(account['RecordTypeId']) == 'Retailer_Branch' and account.get('ParentId'):
+        owner_account = by_id[account['ParentId']]
+
+    def name_of(record_id):
+        return by_id[record_id]['Name'] if record_id else None
+
+    arcs = []
+    for arc in tables['Assigned_Rate_Card__c']:
+        opportunity = by_id.get(arc['Opportunity__c'])
+        if (arc['Retailer__c'] == account['Id'] and arc['Active__c'] and opportunity
+                and opportunity['AccountId'] == owner_account['Id'] and opportunity['StageName'] == 'Live'
+                and record_type.get(opportunity['RecordTypeId']) == 'Retailer_Rate_Card'):
+            arcs.append((arc, opportunity))
+    arcs.sort(key=lambda pair: ((name_of(pair[1]['Lender_Company__c']) or '').lower(),
+                                name_of(pair[1]['Approved_Product__c']).lower()))
+
+    line_items = {}
+    for item in tables['OpportunityLineItem']:
+        if item['Active__c']:
+            line_items.setdefault(item['OpportunityId'], []).append(item)
+
+    rows = []
+    seen = set()
+    for arc, opportunity in arcs:
+        if opportunity['Id'] in seen:
+            continue
+        seen.add(opportunity['Id'])
+        lender = name_of(opportunity['Lender_Company__c'])
+        vertical = name_of(opportunity['Approved_Product__c'])
+        if not (lender and vertical):
+            continue
+        for item in line_items.get(opportunity['Id'], []):
+            product = by_id[item['Product2Id']]
+            rows.append({
+                'Opportunity_Id': opportunity['Id'],
+                'Lender_Name': lender,
+                'Product_Vertical': vertical,
+                'Commission': opportunity['Shermin_Commission__c'],
+                'Product_Name': product['Name'],
+                'APR': product['APR__c'],
+                'Term': product['Term__c'],
+                'Product_Code': product['ProductCode'],
+                'Deferred_Period': product['Deferred_Period__c'],
+                'Subsidy': item['Retailer_Subsidy__c'],
+                'Retailer_Commission': item['Retailer_Commission__c'],
+                'Prime_SubPrime': arc['Prime_SubPrime__c'],
+                'Prime_Position': arc['Prime_Lender_Position__c'],
+                'SubPrime_Position': arc['Sub_Prime_Lender_Position__c'],
+            })
+    return pd.DataFrame(rows)
+
+
+@click.command()
+@click.option('--seed', default=0, show_default=True, help='Random seed; the same seed gives the same org')
+@click.option('--retailers', default=DEFAULT_SHAPE['retailers'], show_default=True)
+@click.option('--lenders', default=DEFAULT_SHAPE['lenders'], show_default=True)
+@click.option('--panel-size', nargs=2, type=int, default=DEFAULT_SHAPE['panel_size'], show_default=True,
+              help='Lenders per vertical on a rate card (min max)')
+@click.option('--products', nargs=2, type=int, default=DEFAULT_SHAPE['products_per_rate_card'], show_default=True,
+              help='Line items per rate card opportunity (min max)')
+@click.option('--size-skew', default=DEFAULT_SHAPE['size_skew'], show_default=True,
+              help='0 draws sizes uniformly; higher makes most retailers small with a long tail')
+@click.option('--output', '-o', required=True, help='Fixture path for FakeSalesforce (.json or .json.gz)')
+def main(seed, retailers, lenders, panel_size, products, size_skew, output):
+    """Generate a synthetic org and save it as a fake Salesforce fixture"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fake_salesforce import save_fixture
+
+    tables = generate_org(seed, retailers=retailers, lenders=lenders, panel_size=tuple(panel_size),
+                          products_per_rate_card=tuple(products), size_skew=size_skew)
+    save_fixture(output, tables=tables)
+    counts = ', '.join(f"{len(records)} {name}" for name, records in tables.items())
+    click.echo(f"Wrote {output}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Rate card cache hit rates across worker processes, per-process vs shared.
+
+Forks ``--workers`` processes, as gunicorn/uwsgi would, each serving
+``--requests`` rate card requests (data fingerprint, then ``get_rate_cards``)
+for retailers of a synthetic org, most of them for a few popular retailers.
+Each worker has its own fake Salesforce with ``--latency`` seconds per call.
+The requests run twice:
+
+- memory: every worker has its own ``ResultCache``, so each one builds a
+  popular retailer's rate card before it can hit
+- sqlite: the workers share a ``SharedResultCache`` in a temporary SQLite file
+
+Reported per backend: wall time, rate cards built, cache hit rate and
+Salesforce calls over all workers.
+
+    python benchmarks/shared_cache_workers.py
+    python benchmarks/shared_cache_workers.py --workers 8 --requests 100 -o shared_cache.json
+"""
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce  # noqa: E402
+from salesforce_fixtures import generate_org  # noqa: E402
+
+BACKENDS = ('memory', 'sqlite')
+
+
+def _worker(worker, backend, tables, names, requests, latency, cache_path, snapshot_dir, start_at, results):
+    import rate_card_cache
+    import rate_card_snapshots
+    import shared_cache
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    if backend == 'sqlite':
+        rate_card_cache.result_cache = rate_card_cache.SharedResultCache(shared_cache.SqliteStore(cache_path))
+    else:
+        rate_card_cache.result_cache = rate_card_cache.ResultCache()
+    rate_card_snapshots.snapshot_store = rate_card_snapshots.SnapshotStore(snapshot_dir)
+    fake = FakeSalesforce({'tables': tables}, latency=latency)
+    gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+
+    # Popular retailers first: request i goes to names[k] with weight 1 / (k + 1)
+    rng = random.Random(worker)
+    picks = rng.choices(names, weights=[1 / (k + 1) for k in range(len(names))], k=requests)
+    time.sleep(max(0.0, start_at - time.time()))
+    fake.reset_counts()
+    for name in picks:
+        rate_card_cache.get_rate_cards(gen, name, rate_card_cache.data_fingerprint(gen, name))
+    stats = rate_card_cache.result_cache.stats()
+    results.put({'hits': stats['hits'], 'misses': stats['misses'], 'calls': sum(fake.requests.values())})
+
+
+def _run(backend, tables, names, workers, requests, latency) -> dict:
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        start_at = time.time() + 0.5
+        processes = [context.Process(target=_worker, args=(
+            worker, backend, tables, names, requests, latency, os.path.join(directory, 'cache.sqlite3'),
+            os.path.join(directory, 'snapshots'), start_at, results)) for worker in range(workers)]
+        for process in processes:
+            process.start()
+        counts = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        seconds = time.time() - start_at
+    hits = sum(c['hits'] for c in counts)
+    misses = sum(c['misses'] for c in counts)
+    return {'seconds': round(seconds, 2), 'built': misses, 'hit_rate': round(hits / max(1, hits + misses), 3),
+            'calls': sum(c['calls'] for c in counts)}
+
+
+@click.command()
+@click.option('--workers', default=4, show_default=True, help='Worker processes')
+@click.option('--requests', 'requests_', default=40, show_default=True, help='Rate card requests per worker')
+@click.option('--retailers', default=20, show_default=True, help='Retailers in the synthetic org')
+@click.option('--latency', default=0.02, show_default=True, help='Seconds added to every Salesforce call')
+@click.option('--seed', default=0, show_default=True, help='Synthetic org seed')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(workers, requests_, retailers, latency, seed, output):
+    """Compare per-process and shared rate card caches across forked workers"""
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    tables = generate_org(seed, retailers=retailers, lenders=40)
+    fake = FakeSalesforce({'tables': tables})
+    names = [r['Name'] for r in RateCardGenerator('bench@example.com', 'password', 'token',
+                                                  session=fake.session()).find_retailer('')]
+    random.Random(seed).shuffle(names)
+    results = {'workers': workers, 'requests_per_worker': requests_, 'retailers': len(names),
+               'latency': latency, 'backends': {}}
+    for backend in BACKENDS:
+        result = results['backends'][backend] = _run(backend, tables, names, workers, requests_, latency)
+        click.echo(f"{backend:7s} {result['seconds']:7.2f}s  built {result['built']:4d}  "
+                   f"hit rate {result['hit_rate']:.0%}  Salesforce calls {result['calls']}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
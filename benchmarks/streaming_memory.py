@@ -0,0 +1,137 @@
+"""
+Peak memory of a rate card Excel export, materialised vs streamed.
+
+Builds one retailer per size in a synthetic org (8 verticals x 36 line items
+per opportunity, ``--lenders`` opportunities per vertical) and, optionally,
+``--copies`` line items behind every rate card row, as multi-branch accounts
+carrying the same products on several opportunities have. Each export runs
+through the fake Salesforce in a forked child process, and its peak resident
+memory above the parent's is reported (Unix only):
+
+- materialised: the line item DataFrame from ``get_rate_card_items``, a copy
+  per vertical, every processed table, then ``generate_excel``
+- streaming: ``generate_excel`` fed straight from ``iter_rate_cards``
+
+Streaming peak memory should follow the rows of the rate card, not the line
+items behind them. Either way one page of records (decoded by simple_salesforce
+and, here, also encoded by the in-process fake) sets a floor of 10-20 MB.
+
+    python benchmarks/streaming_memory.py
+    python benchmarks/streaming_memory.py --lenders 10 --lenders 40 --lenders 160 --copies 1 --copies 8
+"""
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_salesforce import FakeSalesforce  # noqa: E402
+from salesforce_fixtures import VERTICALS, OrgBuilder  # noqa: E402
+
+MODES = ('materialised', 'streaming')
+
+
+def build_org(lenders: int, copies: int, seed: int = 0) -> dict:
+    """One retailer with ``lenders`` opportunities per vertical and ``copies`` line items per product"""
+    builder = OrgBuilder(random.Random(seed), {'inactive_rate': 0, 'not_live_rate': 0, 'missing_lender_rate': 0})
+    for index in range(lenders):
+        builder.add_lender(f"Memory Lender {index + 1:03d}")
+    verticals = VERTICALS[:8]
+    builder.add_retailer('Memory Retailer', verticals, {vertical: builder.lenders for vertical in verticals},
+                         {vertical: 36 for vertical in verticals})
+    tables = builder.finish()
+    line_items = tables['OpportunityLineItem']
+    tables['OpportunityLineItem'] = [dict(item, Id=f"{item['Id']}x{copy}") if copy else item
+                                     for item in line_items for copy in range(copies)]
+    return tables
+
+
+def materialised_export(gen, retailer_name: str, path: str):
+    items_df = gen.get_rate_card_items(retailer_name)
+    data = {}
+    for vertical in items_df['Product_Vertical'].unique():
+        data[vertical] = gen._process_vertical(vertical, items_df[items_df['Product_Vertical'] == vertical].copy())
+    gen.generate_excel(retailer_name, data, path)
+
+
+def streaming_export(gen, retailer_name: str, path: str):
+    gen.generate_excel(retailer_name, gen.iter_rate_cards(retailer_name), path)
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+def _run_child(results, func, args):
+    # A forked child starts with its high-water mark at the parent's current size
+    baseline = _max_rss_mb()
+    start = time.perf_counter()
+    func(*args)
+    results.put({'peak_mb': round(_max_rss_mb() - baseline, 1), 'seconds': round(time.perf_counter() - start, 3)})
+
+
+def measure(func, *args) -> dict:
+    """Peak memory growth (MB) and wall time of one call, run in a forked child"""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=_run_child, args=(results, func, args))
+    child.start()
+    result = results.get()
+    child.join()
+    return result
+
+
+@click.command()
+@click.option('--lenders', 'lender_counts', multiple=True, type=int,
+              help='Opportunities per vertical (repeatable; default 10, 40)')
+@click.option('--copies', 'copy_counts', multiple=True, type=int,
+              help='Line items per rate card row (repeatable; default 1, 4)')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write results as JSON to this path')
+def main(lender_counts, copy_counts, output):
+    """Compare peak memory of materialised and streamed Excel exports"""
+    from rate_card_generator import RateCardGenerator
+
+    logging.disable(logging.WARNING)
+    lender_counts = lender_counts or (10, 40)
+    copy_counts = copy_counts or (1, 4)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'rate_card.xlsx')
+        for lenders in lender_counts:
+            for copies in copy_counts:
+                fake = FakeSalesforce({'tables': build_org(lenders, copies)})
+                gen = RateCardGenerator('bench@example.com', 'password', 'token', session=fake.session())
+                streaming_export(gen, 'Memory Retailer', path)  # warm up imports and the fake's indexes
+
+                result = {'lenders': lenders, 'copies': copies,
+                          'line_items': len(fake.engine.tables['OpportunityLineItem']),
+                          'rate_card_rows': sum(len(df) for _, df in gen.iter_rate_cards('Memory Retailer'))}
+                for mode in MODES:
+                    export = materialised_export if mode == 'materialised' else streaming_export
+                    result[mode] = measure(export, gen, 'Memory Retailer', path)
+                results.append(result)
+                click.echo(f"{result['line_items']:8d} line items, {result['rate_card_rows']:6d} rows: "
+                           + '  '.join(f"{mode} {result[mode]['peak_mb']:7.1f} MB / {result[mode]['seconds']:5.2f}s"
+                                       for mode in MODES))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+"""
+Full-org extracts through Bulk API 2.0
+
+A full refresh (every live rate card, e.g. ``precompute.py --bulk``) through
+REST costs several queries per retailer, each paged 2,000 records at a time.
+An extract runs one Bulk API 2.0 query job per object instead -
+Assigned_Rate_Card__c, OpportunityLineItem, Opportunity, Product2 and Account,
+limited to what live rate cards read - polls until they complete and streams
+the CSV results straight into columns: one list per field, typed from the
+object's describe, with no dict per record.
+
+``OrgExtract`` then answers what the generator would otherwise ask Salesforce
+for each retailer. With ``RateCardGenerator.use_extract(extract)`` the
+retailer list, data fingerprints and rate card items all come from it, so
+batch builds and the snapshots they record run locally; the fingerprints
+match the REST ones, so artifacts built this way are served as usual.
+
+    extract = gen.extract_org()
+    gen.use_extract(extract)
+"""
+import codecs
+import csv
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+import circuit_breaker
+from circuit_breaker import SalesforceUnavailable
+from instrumentation import stage
+from retailer_search import same_salesforce_id
+
+# First wait between job status checks; it grows by half each check up to BULK_POLL_MAX_INTERVAL
+BULK_POLL_INTERVAL = float(os.getenv('BULK_POLL_INTERVAL', '1'))
+BULK_POLL_MAX_INTERVAL = float(os.getenv('BULK_POLL_MAX_INTERVAL', '10'))
+# Longest wait for every job of an extract to complete
+BULK_JOB_TIMEOUT = float(os.getenv('BULK_JOB_TIMEOUT', '900'))
+# Records per results request (maxRecords)
+BULK_RESULT_PAGE_SIZE = int(os.getenv('BULK_RESULT_PAGE_SIZE', '50000'))
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+NUMBER_TYPES = {'int', 'long', 'double', 'currency', 'percent'}
+
+_LIVE_OPPORTUNITY = "RecordType.DeveloperName = 'Retailer_Rate_Card' AND StageName = 'Live'"
+_ARC_FILTER = ("Active__c = true AND Opportunity__r.RecordType.DeveloperName = 'Retailer_Rate_Card' "
+               "AND Opportunity__r.StageName = 'Live'")
+_LINE_ITEM_FILTER = ("Active__c = true AND Opportunity.RecordType.DeveloperName = 'Retailer_Rate_Card' "
+                     "AND Opportunity.StageName = 'Live'")
+
+# Object -> (fields, filter) of its extract job
+JOBS = {
+    'Assigned_Rate_Card__c': (
+        ['Id', 'SystemModstamp', 'Retailer__c', 'Retailer__r.Name', 'Opportunity__c', 'Prime_SubPrime__c',
+         'Prime_Lender_Position__c', 'Sub_Prime_Lender_Position__c'],
+        _ARC_FILTER,
+    ),
+    'Opportunity': (
+        ['Id', 'SystemModstamp', 'Account.Name', 'Lender_Company__r.Name', 'Approved_Product__r.Name',
+         'Shermin_Commission__c'],
+        _LIVE_OPPORTUNITY,
+    ),
+    'OpportunityLineItem': (
+        ['Id', 'SystemModstamp', 'OpportunityId', 'Product2Id', 'Retailer_Subsidy__c', 'Retailer_Commission__c'],
+        _LINE_ITEM_FILTER,
+    ),
+    'Product2': (
+        ['Id', 'SystemModstamp', 'Name', 'APR__c', 'Term__c', 'ProductCode', 'Deferred_Period__c'],
+        f"Id IN (SELECT Product2Id FROM OpportunityLineItem WHERE {_LINE_ITEM_FILTER})",
+    ),
+    'Account': (
+        ['Id', 'Name', 'RecordType.DeveloperName', 'Parent.Name', 'OwnerId', 'Owner.Name'],
+        f"Id IN (SELECT Retailer__c FROM Assigned_Rate_Card__c WHERE {_ARC_FILTER})",
+    ),
+}
+
+
+class BulkJobError(RuntimeError):
+    """A Bulk API 2.0 job was refused, failed, was aborted or didn't finish in time"""
+
+
+def _number(value: str):
+    # As JSON numbers decode, so values match what REST queries return
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _datetime(value: str) -> str:
+    # Bulk CSV writes UTC as 'Z'; REST (and so the fingerprints) as '+0000'
+    return value[:-1] + '+0000' if value.endswith('Z') else value
+
+
+def converters(describe: Dict) -> Dict[str, Callable]:
+    """Parser per field of an object's describe, for fields that aren't text"""
+    parsers = {}
+    for field in describe.get('fields', []):
+        if field['type'] in NUMBER_TYPES:
+            parsers[field['name']] = _number
+        elif field['type'] == 'boolean':
+            parsers[field['name']] = lambda value: value == 'true'
+        elif field['type'] == 'datetime':
+            parsers[field['name']] = _datetime
+    return parsers
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Decoded lines (with their line endings) from a stream of byte chunks"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+class Table:
+    """One object's extract as columns, one list of values per field"""
+
+    def __init__(self, fields: List[str], parsers: Optional[Dict[str, Callable]] = None):
+        self.columns = {field: [] for field in fields}
+        self.parsers = parsers or {}
+        self._indexes = {}
+
+    def __len__(self) -> int:
+        return len(self.columns['Id'])
+
+    def read_csv(self, lines: Iterable[str]) -> int:
+        """Append the rows of one CSV results page; returns how many were read"""
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        try:
+            columns = [self.columns[name] for name in header]
+        except KeyError as e:
+            raise BulkJobError(f"Unexpected column {e} in bulk results") from None
+        parsers = [self.parsers.get(name) for name in header]
+        count = 0
+        for row in reader:
+            for column, parse, value in zip(columns, parsers, row):
+                # Bulk CSV has no null: an empty value is one
+                column.append(None if value == '' else parse(value) if parse else value)
+            count += 1
+        return count
+
+    def index(self, field: str = 'Id') -> Dict:
+        """Value -> first row holding it"""
+        index = self._indexes.get(field)
+        if index is None:
+            index = {}
+            for row, value in enumerate(self.columns[field]):
+                index.setdefault(value, row)
+            self._indexes[field] = index
+        return index
+
+    def groups(self, field: str) -> Dict:
+        """Value -> every row holding it, in extract order"""
+        key = ('groups', field)
+        groups = self._indexes.get(key)
+        if groups is None:
+            groups = {}
+            for row, value in enumerate(self.columns[field]):
+                groups.setdefault(value, []).append(row)
+            self._indexes[key] = groups
+        return groups
+
+    def value(self, field: str, row: Optional[int]):
+        return None if row is None else self.columns[field][row]
+
+
+def _fold(value):
+    # SOQL compares and sorts text case-insensitively
+    return value.lower() if isinstance(value, str) else value
+
+
+class OrgExtract:
+    """Every live rate card's records, answering per retailer as the REST queries would
+
+    Built once and then only read, so one extract can serve any number of
+    threads and generators.
+    """
+
+    def __init__(self, tables: Dict[str, Table]):
+        self.tables = tables
+        self.extracted_at = time.time()
+        arcs = tables['Assigned_Rate_Card__c']
+        opportunities = tables['Opportunity']
+        # ARC rows per folded retailer name, and the Account.Name of each ARC's opportunity
+        self._arcs_by_retailer = {}
+        for row, name in enumerate(arcs.columns['Retailer__r.Name']):
+            self._arcs_by_retailer.setdefault(_fold(name), []).append(row)
+        opportunity_row = opportunities.index()
+        # Build the lookups now, so concurrent readers never do
+        tables['Product2'].index()
+        tables['Account'].index()
+        tables['OpportunityLineItem'].groups('OpportunityId')
+        self._arc_account = [_fold(opportunities.value('Account.Name', opportunity_row.get(opportunity_id)))
+                             for opportunity_id in arcs.columns['Opportunity__c']]
+
+    def stats(self) -> Dict:
+        return {name: len(table) for name, table in self.tables.items()}
+
+    def retailers(self, salesforce_user_id: str = None) -> List[Dict]:
+        """``find_retailer('')``: retailers and branches with live rate cards, by name"""
+        accounts = self.tables['Account']
+        account_row = accounts.index()
+        rows = []
+        for retailer_id in dict.fromkeys(self.tables['Assigned_Rate_Card__c'].columns['Retailer__c']):
+            row = account_row.get(retailer_id)
+            if (row is None or accounts.value('Name', row) is None
+                    or accounts.value('RecordType.DeveloperName', row) not in ('Retailer', 'Retailer_Branch')
+                    or (salesforce_user_id
+                        and not same_salesforce_id(accounts.value('OwnerId', row), salesforce_user_id))):
+                continue
+            rows.append({
+                'Name': accounts.value('Name', row),
+                'Id': retailer_id,
+                'RecordType': {'DeveloperName': accounts.value('RecordType.DeveloperName', row)},
+                'OwnerId': accounts.value('OwnerId', row),
+                'Owner': {'Name': accounts.value('Owner.Name', row)},
+            })
+        # The aggregate query's order (by name, then Id), then find_retailer's sort by name
+        rows.sort(key=lambda retailer: (_fold(retailer['Name']), retailer['Id']))
+        rows.sort(key=lambda retailer: retailer['Name'] or '')
+        return rows
+
+    def account_records(self, retailer_name: str) -> List[Dict]:
+        """What the account query returns for the retailer (its first Account by that name)"""
+        accounts = self.tables['Account']
+        for row, name in enumerate(accounts.columns['Name']):
+            if _fold(name) == _fold(retailer_name):
+                parent = accounts.value('Parent.Name', row)
+                return [{'Name': name,
+                         'RecordType': {'DeveloperName': accounts.value('RecordType.DeveloperName', row)},
+                         'Parent': {'Name': parent} if parent is not None else None}]
+        return []
+
+    def assigned_rate_cards(self, retailer_name: str, opportunity_account_name: str) -> List[Dict]:
+        """The retailer's live assigned rate cards, ordered as ``_arc_query`` orders them"""
+        arcs = self.tables['Assigned_Rate_Card__c']
+        opportunities = self.tables['Opportunity']
+        opportunity_row = opportunities.index()
+        records = []
+        for row in self._arcs_by_retailer.get(_fold(retailer_name), []):
+            if self._arc_account[row] != _fold(opportunity_account_name):
+                continue
+            opportunity = opportunity_row.get(arcs.value('Opportunity__c', row))
+            lender = opportunities.value('Lender_Company__r.Name', opportunity)
+            product = opportunities.value('Approved_Product__r.Name', opportunity)
+            records.append({
+                'Id': arcs.value('Id', row),
+                'SystemModstamp': arcs.value('SystemModstamp', row),
+                'Opportunity__c': arcs.value('Opportunity__c', row),
+                'Prime_SubPrime__c': arcs.value('Prime_SubPrime__c', row),
+                'Prime_Lender_Position__c': arcs.value('Prime_Lender_Position__c', row),
+                'Sub_Prime_Lender_Position__c': arcs.value('Sub_Prime_Lender_Position__c', row),
+                'Opportunity__r': {
+                    'Lender_Company__r': {'Name': lender} if lender is not None else None,
+                    'Approved_Product__r': {'Name': product} if product is not None else None,
+                    'Shermin_Commission__c': opportunities.value('Shermin_Commission__c', opportunity),
+                },
+            })
+        # ORDER BY lender, product: case-insensitive, nulls first, stable
+        records.sort(key=lambda record: tuple(
+            (value is not None, _fold(value) if value is not None else '')
+            for value in ((record['Opportunity__r']['Lender_Company__r'] or {}).get('Name'),
+                          (record['Opportunity__r']['Approved_Product__r'] or {}).get('Name'))))
+        return records
+
+    def fingerprint_inputs(self, retailer_name: str, opportunity_account_name: str) -> Tuple[List, List]:
+        """The ARC and line item records ``RateCardGenerator._fingerprint`` hashes"""
+        arc_records = self.assigned_rate_cards(retailer_name, opportunity_account_name)
+        return arc_records, list(self.line_items(record['Opportunity__c'] for record in arc_records))
+
+    def line_items(self, opportunity_ids: Iterable[str]) -> Iterator[Dict]:
+        """The active line items of ``opportunity_ids``, shaped like ``_line_item_query`` records"""
+        line_items = self.tables['OpportunityLineItem']
+        opportunities = self.tables['Opportunity']
+        products = self.tables['Product2']
+        opportunity_row = opportunities.index()
+        product_row = products.index()
+        by_opportunity = line_items.groups('OpportunityId')
+        rows = sorted(row for opportunity_id in set(opportunity_ids) for row in by_opportunity.get(opportunity_id, []))
+        for row in rows:
+            opportunity_id = line_items.value('OpportunityId', row)
+            opportunity = opportunity_row.get(opportunity_id)
+            product = product_row.get(line_items.value('Product2Id', row))
+            lender = opportunities.value('Lender_Company__r.Name', opportunity)
+            vertical = opportunities.value('Approved_Product__r.Name', opportunity)
+            yield {
+                'Id': line_items.value('Id', row),
+                'SystemModstamp': line_items.value('SystemModstamp', row),
+                'OpportunityId': opportunity_id,
+                'Opportunity': None if opportunity is None else {
+                    'SystemModstamp': opportunities.value('SystemModstamp', opportunity),
+                    'Lender_Company__r': {'Name': lender} if lender is not None else None,
+                    'Approved_Product__r': {'Name': vertical} if vertical is not None else None,
+                    'Shermin_Commission__c': opportunities.value('Shermin_Commission__c', opportunity),
+                },
+                'Product2': None if product is None else {
+                    field: products.value(field, product)
+                    for field in ('SystemModstamp', 'Name', 'APR__c', 'Term__c', 'ProductCode', 'Deferred_Period__c')
+                },
+                'Retailer_Subsidy__c': line_items.value('Retailer_Subsidy__c', row),
+                'Retailer_Commission__c': line_items.value('Retailer_Commission__c', row),
+            }
+
+
+class BulkClient:
+    """Bulk API 2.0 query jobs on a generator's Salesforce session
+
+    Every request runs through the ``bulk_extract`` circuit breaker with the
+    usual timeouts, and logs in again once if the session has expired.
+    """
+
+    def __init__(self, gen, poll_interval: float = BULK_POLL_INTERVAL, timeout: float = BULK_JOB_TIMEOUT,
+                 page_size: int = BULK_RESULT_PAGE_SIZE):
+        self.gen = gen
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.page_size = page_size
+
+    def _send(self, method: str, path: str, **kwargs) -> requests.Response:
+        breaker = circuit_breaker.breakers.get('bulk_extract')
+        breaker.before_call()
+        kwargs.setdefault('timeout', circuit_breaker.timeouts())
+        try:
+            for attempt in range(2):
+                sf = self.gen.sf
+                response = sf.session.request(method, sf.base_url + path, headers=dict(sf.headers), **kwargs)
+                if response.status_code != 401 or attempt:
+                    break
+                logger.warning("Salesforce session expired, logging in again")
+                response.close()
+                self.gen._login()
+                self.gen.relogins += 1
+        except Exception as e:
+            if circuit_breaker.is_outage(e):
+                breaker.record_failure()
+                raise SalesforceUnavailable(f"Salesforce bulk request failed: {e}") from e
+            breaker.release()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+            raise SalesforceUnavailable(f"Salesforce bulk request failed with {response.status_code}")
+        breaker.record_success()
+        if response.status_code >= 400:
+            raise BulkJobError(f"{method} {path} failed with {response.status_code}: {response.text[:500]}")
+        return response
+
+    def describe(self, object_name: str) -> Dict:
+        return self._send('GET', f"sobjects/{object_name}/describe").json()
+
+    def submit(self, soql: str) -> str:
+        """Create a query job; returns its ID"""
+        job = self._send('POST', 'jobs/query', json={'operation': 'query', 'query': soql,
+                                                     'contentType': 'CSV', 'columnDelimiter': 'COMMA',
+                                                     'lineEnding': 'LF'}).json()
+        return job['id']
+
+    def wait(self, job_ids: List[str], progress: Optional[Callable] = None):
+        """Poll until every job is complete, raising BulkJobError if one fails or time runs out"""
+        pending = list(job_ids)
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.timeout
+        while True:
+            for job_id in list(pending):
+                job = self._send('GET', f"jobs/query/{job_id}").json()
+                if job['state'] == 'JobComplete':
+                    pending.remove(job_id)
+                    self.gen._report(progress, 'bulk_job', job=job_id, object=job.get('object'),
+                                     records=job.get('numberRecordsProcessed'))
+                elif job['state'] in ('Failed', 'Aborted'):
+                    raise BulkJobError(f"Bulk job {job_id} ({job.get('object')}) {job['state'].lower()}: "
+                                       f"{job.get('errorMessage')}")
+            if not pending:
+                return
+            if time.monotonic() + interval > deadline:
+                raise BulkJobError(f"Bulk jobs {', '.join(pending)} didn't complete in {self.timeout:g}s")
+            time.sleep(interval)
+            interval = min(interval * 1.5, BULK_POLL_MAX_INTERVAL)
+
+    def read_results(self, job_id: str, table: Table) -> int:
+        """Stream every results page of a completed job into ``table``"""
+        locator = None
+        total = 0
+        while True:
+            params = {'maxRecords': self.page_size}
+            if locator:
+                params['locator'] = locator
+            response = self._send('GET', f"jobs/query/{job_id}/results", params=params, stream=True)
+            try:
+                total += table.read_csv(iter_lines(response.iter_content(CHUNK_SIZE)))
+            finally:
+                response.close()
+            locator = response.headers.get('Sforce-Locator')
+            if not locator or locator == 'null':
+                return total
+
+
+def extract(gen, progress: Optional[Callable] = None, client: Optional[BulkClient] = None) -> OrgExtract:
+    """Run the extract jobs on ``gen``'s session and load their results
+
+    Sends ``bulk_job`` progress events (job, object, records) as jobs complete.
+    """
+    client = client or BulkClient(gen)
+    with stage('bulk_extract', step='submit'):
+        parsers = {name: converters(client.describe(name)) for name in JOBS}
+        jobs = {name: client.submit(f"SELECT {', '.join(fields)} FROM {name} WHERE {where}")
+                for name, (fields, where) in JOBS.items()}
+    with stage('bulk_extract', step='wait'):
+        client.wait(list(jobs.values()), progress)
+    tables = {}
+    for name, job_id in jobs.items():
+        tables[name] = Table(JOBS[name][0], parsers[name])
+        with stage('bulk_extract', step='results', object=name) as timing:
+            timing['records'] = client.read_results(job_id, tables[name])
+        logger.info("Extracted %d %s records", len(tables[name]), name)
+    return OrgExtract(tables)
@@ -0,0 +1,421 @@
+"""
+Cache invalidation driven by Salesforce change notifications
+
+``/webhooks/salesforce-changes`` accepts Outbound Messages (SOAP) and Change
+Data Capture events (JSON, as relayed by a Pub/Sub API subscriber or a local
+stand-in) for the four objects a rate card is built from:
+Assigned_Rate_Card__c, Opportunity, OpportunityLineItem and Product2. Each
+changed record is mapped to the retailers whose rate cards read it, and only
+their cached rate cards and fingerprints are dropped (or rebuilt, with the
+``refresh`` action), instead of every card waiting out a TTL.
+
+The mapping uses a reverse index of every rate card ARC, kept in memory:
+ARC -> retailer, Opportunity -> retailers, and branch -> parent account.
+Line items and products are first mapped to their Opportunities, from the
+notification's fields when it carries them, else with one query. A change that
+can't be mapped (a CDC gap event, an unknown object) drops everything.
+Precomputed artifacts need no invalidation, as they are only served while their
+fingerprint matches; ``refresh`` rebuilds the affected ones in the background.
+"""
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import rate_card_cache
+from precompute import artifact_store, precompute_all
+
+# Token the webhook must present, as "Authorization: Bearer <secret>" or "?token=<secret>"
+# (Outbound Messages can't set headers); the endpoint is disabled without one
+CHANGE_WEBHOOK_SECRET = os.getenv('CHANGE_WEBHOOK_SECRET')
+# 'invalidate' drops the affected cards; 'refresh' also rebuilds them (and their artifacts) in the background
+CHANGE_EVENT_ACTION = os.getenv('CHANGE_EVENT_ACTION', 'invalidate')
+# Seconds before the reverse index is reloaded, to catch changes whose notifications were lost
+CHANGE_INDEX_TTL = float(os.getenv('CHANGE_INDEX_TTL', '3600'))
+
+ACTIONS = ('invalidate', 'refresh')
+OBJECTS = ('Assigned_Rate_Card__c', 'Opportunity', 'OpportunityLineItem', 'Product2')
+# Records per IN (...) list, keeping query URLs well under Salesforce's limit
+ID_BATCH = 200
+SALESFORCE_ID = re.compile(r'[a-zA-Z0-9]{15}(?:[a-zA-Z0-9]{3})?')
+
+OUTBOUND_NS = 'http://soap.sforce.com/2005/09/outbound'
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+OUTBOUND_ACK = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+    f'<notificationsResponse xmlns="{OUTBOUND_NS}"><Ack>true</Ack></notificationsResponse>'
+    '</soapenv:Body></soapenv:Envelope>'
+)
+
+logger = logging.getLogger(__name__)
+
+
+def authorized(authorization: Optional[str], token: Optional[str]) -> bool:
+    """True if the request carries CHANGE_WEBHOOK_SECRET in its Authorization header or token parameter"""
+    if not CHANGE_WEBHOOK_SECRET:
+        return False
+    if authorization and authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    return bool(token) and hmac.compare_digest(token.encode('utf-8'), CHANGE_WEBHOOK_SECRET.encode('utf-8'))
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_outbound_message(body: bytes) -> List[Dict]:
+    """Changes in a SOAP Outbound Message, one per notification"""
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError as e:
+        raise ValueError(f"Malformed outbound message: {e}")
+    changes = []
+    for notification in root.iter(f'{{{OUTBOUND_NS}}}Notification'):
+        sobject = notification.find(f'{{{OUTBOUND_NS}}}sObject')
+        if sobject is None:
+            continue
+        fields = {_local(child.tag): child.text for child in sobject}
+        changes.append({
+            'object': (sobject.get(XSI_TYPE) or '').split(':')[-1],
+            'type': 'UPDATE',
+            'ids': [fields.pop('Id')] if fields.get('Id') else [],
+            'fields': fields,
+        })
+    return changes
+
+
+def parse_change_events(payload) -> List[Dict]:
+    """Changes in CDC events: one event, a list of them, or ``{"events": [...]}``
+
+    Events may be bare payloads or wrapped as ``{"data": {"payload": ...}}``
+    (CometD streaming).
+    """
+    if isinstance(payload, dict) and 'events' in payload:
+        payload = payload['events']
+    events = payload if isinstance(payload, list) else [payload]
+    changes = []
+    for event in events:
+        if isinstance(event, dict) and isinstance(event.get('data'), dict):
+            event = event['data'].get('payload', event)
+        header = event.get('ChangeEventHeader') if isinstance(event, dict) else None
+        if not isinstance(header, dict):
+            raise ValueError('Change event without a ChangeEventHeader')
+        changes.append({
+            'object': header.get('entityName') or '',
+            'type': header.get('changeType') or 'UPDATE',
+            'ids': list(header.get('recordIds') or []),
+            'fields': {key: value for key, value in event.items() if key != 'ChangeEventHeader'},
+        })
+    return changes
+
+
+def parse_notification(body: bytes, content_type: Optional[str], payload=None) -> Tuple[List[Dict], bool]:
+    """``(changes, outbound)``: the changes in a webhook body, and whether it was an Outbound Message
+
+    Each change is ``{'object', 'type', 'ids', 'fields'}``. ``payload`` is the
+    already decoded JSON body, if any. Raises ValueError for bodies that are
+    neither.
+    """
+    if 'xml' in (content_type or '') or body.lstrip().startswith(b'<'):
+        return parse_outbound_message(body), True
+    if payload is None:
+        raise ValueError('Expected an Outbound Message or JSON change events')
+    return parse_change_events(payload), False
+
+
+def _batches(ids: Iterable[str]) -> Iterable[List[str]]:
+    ids = sorted(ids)
+    for start in range(0, len(ids), ID_BATCH):
+        yield ids[start:start + ID_BATCH]
+
+
+def _id_list(ids: Iterable[str]) -> str:
+    return ', '.join(f"'{record_id}'" for record_id in ids)
+
+
+class ReverseIndex:
+    """Which retailers read each rate card record, from every Retailer_Rate_Card ARC
+
+    ARCs are indexed whether or not they are active or their Opportunity is
+    Live, so a change that makes one count maps to its retailer too.
+    """
+
+    def __init__(self, ttl: float = CHANGE_INDEX_TTL):
+        self.ttl = ttl
+        self.arc_retailer = {}           # ARC Id -> retailer Account Id
+        self.opportunity_retailers = {}  # Opportunity Id -> retailer Account Ids
+        self.names = {}                  # retailer Account Id -> Name
+        self.branches = {}               # parent Account Id -> branch Account Ids
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self) -> bool:
+        with self._lock:
+            return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def load(self, gen):
+        arcs = gen._query_all("""
+        SELECT Id, Opportunity__c, Retailer__c, Retailer__r.Name
+        FROM Assigned_Rate_Card__c
+        WHERE Opportunity__r.RecordType.DeveloperName = 'Retailer_Rate_Card'
+        """, 'change_index')['records']
+        branches = gen._query_all("""
+        SELECT Id, ParentId
+        FROM Account
+        WHERE RecordType.DeveloperName = 'Retailer_Branch' AND ParentId != null
+        """, 'change_index_branches')['records']
+        with self._lock:
+            self.arc_retailer, self.opportunity_retailers, self.names, self.branches = {}, {}, {}, {}
+            for arc in arcs:
+                self._add_arc(arc)
+            for branch in branches:
+                self.branches.setdefault(branch['ParentId'], set()).add(branch['Id'])
+            self._loaded_at = time.monotonic()
+        logger.info("Loaded change event index: %d assigned rate cards, %d opportunities, %d retailers",
+                    len(self.arc_retailer), len(self.opportunity_retailers), len(self.names))
+
+    def _add_arc(self, arc: Dict):
+        retailer_id = arc.get('Retailer__c')
+        if not retailer_id:
+            return
+        self.arc_retailer[arc['Id']] = retailer_id
+        if arc.get('Opportunity__c'):
+            self.opportunity_retailers.setdefault(arc['Opportunity__c'], set()).add(retailer_id)
+        name = (arc.get('Retailer__r') or {}).get('Name')
+        if name:
+            self.names[retailer_id] = name
+
+    def add_arcs(self, arcs: List[Dict]):
+        """Index ARCs created since the last load"""
+        with self._lock:
+            for arc in arcs:
+                self._add_arc(arc)
+
+    def retailers_of_arcs(self, arc_ids: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        """``(retailer Ids, ARC Ids not in the index)``"""
+        with self._lock:
+            found = {arc_id: self.arc_retailer.get(arc_id) for arc_id in arc_ids}
+        return {r for r in found.values() if r}, {arc_id for arc_id, r in found.items() if not r}
+
+    def retailers_of_opportunities(self, opportunity_ids: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        """``(retailer Ids, Opportunity Ids no indexed ARC points at)``"""
+        retailers, unknown = set(), set()
+        with self._lock:
+            for opportunity_id in opportunity_ids:
+                if opportunity_id in self.opportunity_retailers:
+                    retailers |= self.opportunity_retailers[opportunity_id]
+                else:
+                    unknown.add(opportunity_id)
+        return retailers, unknown
+
+    def with_branches(self, account_ids: Iterable[str]) -> Set[str]:
+        """The accounts plus their branches, which read their parent's rate card Opportunities"""
+        accounts = set(account_ids)
+        with self._lock:
+            for account_id in list(accounts):
+                accounts |= self.branches.get(account_id, set())
+        return accounts
+
+    def name(self, retailer_id: str) -> Optional[str]:
+        with self._lock:
+            return self.names.get(retailer_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'assigned_rate_cards': len(self.arc_retailer),
+                'opportunities': len(self.opportunity_retailers),
+                'retailers': len(self.names),
+                'age_seconds': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+            }
+
+
+class Resolver:
+    """Maps a batch of changes to retailer names, querying Salesforce only for what the index can't answer
+
+    ``checkout`` lends a ``RateCardGenerator`` for a with block; it is only
+    used when a query is needed. Salesforce outages raise
+    ``SalesforceUnavailable``, so the notification isn't acknowledged and is
+    delivered again.
+    """
+
+    def __init__(self, index: ReverseIndex, checkout: Callable):
+        self.index = index
+        self.checkout = checkout
+        self.retailer_ids = set()
+        self.everything = False
+        self.search = False
+        self.unresolved = []
+        self.queries = 0
+
+    def _query(self, gen, soql: str, label: str) -> List[Dict]:
+        self.queries += 1
+        # queryAll, so deleted records still say which Opportunity or retailer they belonged to
+        return gen._call('query_all', soql, label, include_deleted=True)['records']
+
+    def resolve(self, changes: List[Dict]) -> Dict:
+        by_object = {name: {'ids': set(), 'fields': {}} for name in OBJECTS}
+        for change in changes:
+            ids = [record_id for record_id in change['ids'] if SALESFORCE_ID.fullmatch(record_id or '')]
+            if change['object'] not in by_object:
+                logger.debug("Ignoring change notification for %s", change['object'])
+                continue
+            if not ids or change['type'].startswith('GAP_'):
+                # Gap events and notifications without usable Ids can't be traced to records
+                self._everything(f"{change['type']} {change['object']} change without record Ids")
+                continue
+            by_object[change['object']]['ids'].update(ids)
+            for record_id in ids:
+                by_object[change['object']]['fields'][record_id] = change['fields']
+        if self.everything or not any(changed['ids'] for changed in by_object.values()):
+            return self.result()
+
+        with self.checkout() as gen:
+            if not self.index.is_fresh():
+                self.index.load(gen)
+                self.queries += 2
+            opportunity_ids = set(by_object['Opportunity']['ids'])
+            opportunity_ids |= self._line_item_opportunities(gen, by_object['OpportunityLineItem'])
+            opportunity_ids |= self._product_opportunities(gen, by_object['Product2']['ids'])
+            self._arcs(gen, by_object['Assigned_Rate_Card__c'])
+            self._opportunities(gen, opportunity_ids, by_object['Opportunity']['fields'])
+            # ARCs and Opportunities decide which retailers have live rate cards at all
+            self.search = bool(by_object['Assigned_Rate_Card__c']['ids'] or by_object['Opportunity']['ids'])
+            names = self._names(gen)
+        return self.result(names)
+
+    def _everything(self, reason: str):
+        self.everything = True
+        self.unresolved.append(reason)
+
+    def _line_item_opportunities(self, gen, line_items: Dict) -> Set[str]:
+        opportunity_ids, missing = set(), set()
+        for record_id in line_items['ids']:
+            opportunity_id = line_items['fields'][record_id].get('OpportunityId')
+            if opportunity_id:
+                opportunity_ids.add(opportunity_id)
+            else:
+                missing.add(record_id)
+        for batch in _batches(missing):
+            opportunity_ids |= {record['OpportunityId'] for record in self._query(gen, f"""
+            SELECT Id, OpportunityId FROM OpportunityLineItem WHERE Id IN ({_id_list(batch)})
+            """, 'change_line_items')}
+        return opportunity_ids
+
+    def _product_opportunities(self, gen, product_ids: Set[str]) -> Set[str]:
+        # Only Opportunities that already have rate cards: a product on anything else affects no card
+        opportunity_ids = set()
+        for batch in _batches(product_ids):
+            records = gen._query_all(f"""
+            SELECT OpportunityId FROM OpportunityLineItem
+            WHERE Product2Id IN ({_id_list(batch)}) AND Active__c = true
+            """, 'change_products')['records']
+            self.queries += 1
+            opportunity_ids |= {record['OpportunityId'] for record in records}
+        return opportunity_ids - self.index.retailers_of_opportunities(opportunity_ids)[1]
+
+    def _arcs(self, gen, arcs: Dict):
+        retailer_ids, unknown = self.index.retailers_of_arcs(arcs['ids'])
+        self.retailer_ids |= retailer_ids
+        # A reassigned ARC also changes the card of the retailer it now points at
+        self.retailer_ids |= {arcs['fields'][arc_id]['Retailer__c'] for arc_id in arcs['ids']
+                              if arcs['fields'][arc_id].get('Retailer__c')}
+        for batch in _batches(unknown):
+            records = self._query(gen, f"""
+            SELECT Id, Opportunity__c, Retailer__c, Retailer__r.Name
+            FROM Assigned_Rate_Card__c
+            WHERE Id IN ({_id_list(batch)})
+            """, 'change_arcs')
+            self.index.add_arcs(records)
+            self.retailer_ids |= {record['Retailer__c'] for record in records if record.get('Retailer__c')}
+
+    def _opportunities(self, gen, opportunity_ids: Set[str], fields: Dict):
+        retailer_ids, unknown = self.index.retailers_of_opportunities(opportunity_ids)
+        self.retailer_ids |= retailer_ids
+        # No ARC indexed yet (its own notification may still be on its way): the Opportunity's
+        # account and that account's branches are the only retailers that can read it
+        accounts = {fields[opportunity_id]['AccountId'] for opportunity_id in unknown
+                    if (fields.get(opportunity_id) or {}).get('AccountId')}
+        missing = {opportunity_id for opportunity_id in unknown if not (fields.get(opportunity_id) or {}).get('AccountId')}
+        for batch in _batches(missing):
+            accounts |= {record['AccountId'] for record in self._query(gen, f"""
+            SELECT Id, AccountId FROM Opportunity
+            WHERE Id IN ({_id_list(batch)}) AND RecordType.DeveloperName = 'Retailer_Rate_Card'
+            """, 'change_opportunities') if record.get('AccountId')}
+        self.retailer_ids |= self.index.with_branches(accounts)
+
+    def _names(self, gen) -> Set[str]:
+        names, missing = set(), set()
+        for retailer_id in self.retailer_ids:
+            name = self.index.name(retailer_id)
+            if name:
+                names.add(name)
+            elif SALESFORCE_ID.fullmatch(retailer_id):
+                missing.add(retailer_id)
+        for batch in _batches(missing):
+            names |= {record['Name'] for record in self._query(gen, f"""
+            SELECT Id, Name FROM Account WHERE Id IN ({_id_list(batch)})
+            """, 'change_accounts') if record.get('Name')}
+        return names
+
+    def result(self, names: Optional[Set[str]] = None) -> Dict:
+        return {
+            'retailers': sorted(names or ()),
+            'everything': self.everything,
+            'search_index': self.search or self.everything,
+            'unresolved': self.unresolved,
+            'salesforce_queries': self.queries,
+        }
+
+
+reverse_index = ReverseIndex()
+_artifact_lock = threading.Lock()
+
+
+def refresh_artifacts(get_pool: Callable, retailer_names: List[str]):
+    """Rebuild the precomputed artifacts of those retailers that have some, on a background thread"""
+    retailers = [name for name in retailer_names if name in artifact_store.load_manifest()['retailers']]
+    if not retailers:
+        return
+
+    def rebuild():
+        # One rebuild at a time, as each rewrites the manifest
+        with _artifact_lock:
+            try:
+                summary = precompute_all(get_pool(), artifact_store.directory, workers=1, retailers=retailers)
+                logger.info("Rebuilt artifacts after change notifications: %s", summary)
+            except Exception as e:
+                logger.warning("Rebuilding artifacts for %s failed: %s", ', '.join(retailers), e)
+
+    threading.Thread(target=rebuild, daemon=True, name='refresh-artifacts').start()
+
+
+def apply(changes: List[Dict], get_pool: Callable, action: str = CHANGE_EVENT_ACTION) -> Dict:
+    """Drop (and with ``refresh``, rebuild) the cached rate cards these changes affect; returns what was done"""
+    start = time.monotonic()
+    result = Resolver(reverse_index, lambda: get_pool().checkout()).resolve(changes)
+    retailers = result['retailers']
+    if result['everything']:
+        logger.warning("Invalidating every cached rate card: %s", '; '.join(result['unresolved']))
+        rate_card_cache.result_cache.invalidate()
+        rate_card_cache.fingerprint_cache.invalidate()
+    for name in retailers:
+        rate_card_cache.result_cache.invalidate(name)
+        rate_card_cache.fingerprint_cache.invalidate(name)
+    if result['search_index']:
+        rate_card_cache.retailer_index.invalidate()
+
+    result['refreshed'] = []
+    if action == 'refresh':
+        result['refreshed'] = [name for name in retailers if rate_card_cache.refresher.start(get_pool, name)]
+        refresh_artifacts(get_pool, retailers)
+    result['changes'] = len(changes)
+    result['seconds'] = round(time.monotonic() - start, 3)
+    logger.info("Change notifications: %d changes -> %d retailers%s", len(changes), len(retailers),
+                ' (everything)' if result['everything'] else '')
+    return result
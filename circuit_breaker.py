@@ -0,0 +1,143 @@
+"""
+Circuit breakers and timeouts around Salesforce queries
+
+Every query ``RateCardGenerator._call`` (or ``AsyncSalesforce.query``) makes has
+a connect and read timeout (``SF_CONNECT_TIMEOUT`` / ``SF_QUERY_TIMEOUT``) and
+goes through the breaker for its query type (the ``_call`` label). ``SF_BREAKER_FAILURES`` outages in a row -
+timeouts, dropped connections or 5xx responses - open the breaker: calls of that
+type then fail at once with ``CircuitOpenError`` instead of adding load to a
+struggling API. After ``SF_BREAKER_RESET_SECONDS`` a single trial call is let
+through; its success closes the breaker, its failure opens it again.
+
+Outages reach callers as ``SalesforceUnavailable`` (``CircuitOpenError`` is one),
+which the web routes answer with the last good rate card, marked stale.
+"""
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+from instrumentation import registry
+
+SF_CONNECT_TIMEOUT = float(os.getenv('SF_CONNECT_TIMEOUT', '5'))
+# Longest wait for any single read from Salesforce, not for a whole query
+SF_QUERY_TIMEOUT = float(os.getenv('SF_QUERY_TIMEOUT', '30'))
+SF_BREAKER_FAILURES = int(os.getenv('SF_BREAKER_FAILURES', '5'))
+SF_BREAKER_RESET_SECONDS = float(os.getenv('SF_BREAKER_RESET_SECONDS', '30'))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+registry.describe('circuit_breaker_opened_total', 'Times a Salesforce circuit breaker opened, by query type')
+registry.describe('circuit_breaker_rejected_total', 'Salesforce queries refused by an open circuit breaker')
+
+
+class SalesforceUnavailable(RuntimeError):
+    """Salesforce timed out, dropped the connection, failed with a 5xx or its breaker is open"""
+
+
+class CircuitOpenError(SalesforceUnavailable):
+    """The breaker for this query type is open, so the query wasn't sent"""
+
+
+def timeouts() -> Tuple[float, float]:
+    """(connect, read) timeouts for a Salesforce request"""
+    return SF_CONNECT_TIMEOUT, SF_QUERY_TIMEOUT
+
+
+def is_outage(error: Exception) -> bool:
+    """Whether ``error`` says Salesforce is down or overloaded rather than the query being wrong"""
+    # Imported here so importing this module (web_app does at start-up) doesn't load the HTTP clients
+    import httpx
+    import requests
+    from simple_salesforce.exceptions import SalesforceError
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError,
+                          httpx.TransportError)):
+        return True
+    return isinstance(error, SalesforceError) and (error.status or 0) >= 500
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open trial after a cool-down"""
+
+    def __init__(self, name: str, failures: int = SF_BREAKER_FAILURES,
+                 reset_seconds: float = SF_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be made now"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trial_running):
+                self._stats['rejected'] += 1
+                retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+                registry.inc('circuit_breaker_rejected_total', query=self.name)
+                raise CircuitOpenError(f"Salesforce {self.name} queries are failing; "
+                                       f"not retrying for another {retry_in:.0f}s")
+            if self.state == HALF_OPEN:
+                self._trial_running = True
+            self._stats['calls'] += 1
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._consecutive = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._consecutive += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self._consecutive >= self.failures:
+                if self.state != OPEN:
+                    self._stats['opened'] += 1
+                    registry.inc('circuit_breaker_opened_total', query=self.name)
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that neither succeeded nor failed for the breaker (e.g. a malformed query)"""
+        with self._lock:
+            self._trial_running = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, state=self.state, consecutive_failures=self._consecutive)
+
+
+class BreakerRegistry:
+    """One CircuitBreaker per query type, created on first use"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name)
+            return breaker
+
+    def open_count(self) -> int:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return sum(1 for breaker in breakers if breaker.state != CLOSED)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.stats() for name, breaker in sorted(breakers.items())}
+
+
+breakers = BreakerRegistry()
@@ -0,0 +1,95 @@
+"""
+Columnar encoding of processed rate cards
+
+``/generate-data?format=columnar`` returns the same rows as the plain JSON
+response, with column names written once in a schema header instead of in
+every row and each column's values in one array per vertical. Columns that
+repeat a small set of values (lender names, positions, terms, product types,
+deferred periods) are dictionary-encoded: the distinct values are listed once
+for the whole rate card and the rows hold indexes into that list.
+
+    {"format": "rate-card-columnar/1",
+     "columns": [{"name": "Lender_Name", "dictionary": true}, {"name": "APR_Range", "dictionary": false}],
+     "dictionaries": {"Lender_Name": ["Acme Finance", "Bright Lending"]},
+     "verticals": [{"name": "Solar", "rows": 3, "data": [[0, 0, 1], ["8.4%", "9.9%", "8.4%"]]}]}
+
+Missing values are ``null`` (in a dictionary, or in a plain column). The
+browser decodes it in ``decodeColumnar`` (static/js/rate_card_generator.js).
+"""
+import json
+from typing import Dict, List
+
+FORMAT = 'rate-card-columnar/1'
+MIMETYPE = 'application/json'
+# A column is dictionary-encoded when its distinct values are at most this share of the card's rows
+DICTIONARY_MAX_RATIO = 0.5
+
+
+def _column(df, column):
+    """A column's values as an object array with None for missing ones (a column of Nones if absent)"""
+    import numpy as np
+
+    if column not in df.columns:
+        return np.full(len(df), None, dtype=object)
+    return df[column].to_numpy(dtype=object, na_value=None)
+
+
+def encode(data: Dict) -> Dict:
+    """Columnar payload for ``{vertical: DataFrame}``, verticals in their given order"""
+    import numpy as np
+    import pandas as pd
+
+    frames = list(data.items())
+    columns = list(dict.fromkeys(column for _, df in frames for column in df.columns))
+    total = sum(len(df) for _, df in frames)
+    schema, dictionaries = [], {}
+    encoded = [[] for _ in frames]
+
+    for column in columns:
+        values = np.concatenate([_column(df, column) for _, df in frames])
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        dictionary = total > 0 and len(uniques) <= total * DICTIONARY_MAX_RATIO
+        if dictionary:
+            # factorize turns None into NaN, which isn't JSON
+            dictionaries[column] = [None if value != value else value for value in uniques.tolist()]
+            column_values = codes.tolist()
+        else:
+            column_values = values.tolist()
+        schema.append({'name': column, 'dictionary': dictionary})
+
+        start = 0
+        for index, (_, df) in enumerate(frames):
+            encoded[index].append(column_values[start:start + len(df)])
+            start += len(df)
+
+    return {
+        'format': FORMAT,
+        'columns': schema,
+        'dictionaries': dictionaries,
+        'verticals': [{'name': vertical, 'rows': len(df), 'data': encoded[index]}
+                      for index, (vertical, df) in enumerate(frames)],
+    }
+
+
+def dumps(data: Dict) -> str:
+    """``encode(data)`` serialized without whitespace"""
+    return json.dumps(encode(data), separators=(',', ':'), ensure_ascii=False)
+
+
+def decode(payload: Dict) -> Dict[str, List[Dict]]:
+    """``{vertical: [row dicts]}`` from a columnar payload: ``df.to_dict('records')``, with None for missing values"""
+    if payload.get('format') != FORMAT:
+        raise ValueError(f"Not a {FORMAT} payload")
+    columns = payload['columns']
+    rate_cards = {}
+    for vertical in payload['verticals']:
+        decoded = []
+        for column, values in zip(columns, vertical['data']):
+            if column['dictionary']:
+                dictionary = payload['dictionaries'][column['name']]
+                values = [dictionary[code] for code in values]
+            decoded.append(values)
+        names = [column['name'] for column in columns]
+        rate_cards[vertical['name']] = [dict(zip(names, row)) for row in zip(*decoded)] if decoded else (
+            [{} for _ in range(vertical['rows'])])
+    return rate_cards
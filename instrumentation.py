@@ -0,0 +1,226 @@
+"""
+Lightweight stage timing and Prometheus metrics
+
+Wrap a unit of work in ``stage()`` to time it:
+
+    with stage('soql', query='arc') as timing:
+        result = sf.query_all(soql)
+        timing['records'] = len(result['records'])
+
+Every stage feeds a process-wide histogram (exported at ``/metrics`` in the
+Prometheus text format) and, inside a Flask request, that request's
+``Server-Timing`` header. Stages on threads without a request (background
+workers, the CLI) are still counted in the histograms.
+"""
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Seconds; covers a cached lookup up to a slow multi-query rate card
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = 'rate_card_'
+
+# Per-request stage totals: Server-Timing name -> [seconds, calls, records]
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram for one label set"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Thread-safe store of histograms and counters keyed by name and labels"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self, gauges: Optional[Dict] = None) -> str:
+        """Prometheus text exposition format (version 0.0.4)
+
+        ``gauges`` maps a metric name to ``(help, value)`` for point-in-time
+        values that are read at scrape time, such as pool sizes.
+        """
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {full_name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{full_name}{_format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {full_name} histogram")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+registry = Registry()
+registry.describe('stage_duration_seconds', 'Time spent per stage of rate card generation')
+registry.describe('salesforce_records_total', 'Records returned by Salesforce queries')
+registry.describe('salesforce_api_calls_total', 'Salesforce REST API calls, by the user they were made for')
+registry.describe('http_request_duration_seconds', 'Time from request start until the response was fully sent')
+
+
+def _server_timing_name(name: str, labels: Dict) -> str:
+    """Server-Timing metric names are HTTP tokens: no spaces or separators"""
+    parts = [name] + [str(value) for value in labels.values()]
+    return re.sub(r'[^A-Za-z0-9_.\-]+', '_', '.'.join(parts))
+
+
+def record(name: str, seconds: float, records: Optional[int] = None, **labels):
+    """Record a completed stage (for work timed without ``stage()``)"""
+    registry.observe('stage_duration_seconds', seconds, stage=name, **labels)
+    if records is not None:
+        registry.inc('salesforce_records_total', records, **labels)
+
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(_server_timing_name(name, labels), [0.0, 0, None])
+        entry[0] += seconds
+        entry[1] += 1
+        if records is not None:
+            entry[2] = (entry[2] or 0) + records
+
+
+@contextmanager
+def stage(name: str, **labels):
+    """Time the enclosed block as ``name``; set ``timing['records']`` to count records"""
+    timing = {}
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        record(name, time.perf_counter() - start, timing.get('records'), **labels)
+
+
+def server_timing_header(total: Optional[float] = None) -> str:
+    """Server-Timing value for the stages recorded in the current request"""
+    entries = []
+    for key, (seconds, calls, records) in (_request_timings.get() or {}).items():
+        desc = []
+        if calls > 1:
+            desc.append(f"{calls} calls")
+        if records is not None:
+            desc.append(f"{records} records")
+        entry = f"{key};dur={seconds * 1000:.1f}"
+        if desc:
+            entry += f';desc="{", ".join(desc)}"'
+        entries.append(entry)
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def init_app(app):
+    """Time every request, add Server-Timing headers and record request histograms"""
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timing():
+        g.request_started = time.perf_counter()
+        g.request_timings_token = _request_timings.set({})
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        handled = time.perf_counter()
+        response.headers['Server-Timing'] = server_timing_header(handled - started)
+
+        endpoint = request.endpoint or 'unknown'
+        method = request.method
+        status = str(response.status_code)
+
+        def finished():
+            # Runs once the body has been sent (streams and files included)
+            done = time.perf_counter()
+            registry.observe('stage_duration_seconds', done - handled, stage='response_send')
+            registry.observe('http_request_duration_seconds', done - started,
+                             endpoint=endpoint, method=method, status=status)
+        response.call_on_close(finished)
+        return response
+
+    @app.teardown_request
+    def end_request_timing(exc):
+        token = g.pop('request_timings_token', None)
+        if token is not None:
+            try:
+                _request_timings.reset(token)
+            except ValueError:
+                # Token belongs to another context (e.g. the view ran elsewhere)
+                _request_timings.set(None)
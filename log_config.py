@@ -0,0 +1,165 @@
+"""
+Application logging: levels, lazy formatting, rate limiting and a queue handler
+
+Modules log through ``logging.getLogger(__name__)`` with %-style arguments, so
+a message below the configured level costs one cached level check and nothing
+is formatted. ``setup_logging()`` routes every record through a
+``QueueHandler``; a background ``QueueListener`` thread does the formatting and
+the stream writes, so request threads never block on stderr. A process forked
+after setup (gunicorn ``--preload`` workers) starts its own listener thread,
+since threads don't survive a fork.
+
+Per-record warnings (one per skipped Salesforce record, say) are marked with
+``extra=RATE_LIMITED``: at most ``LOG_RATE_LIMIT_BURST`` of each message
+template are written per ``LOG_RATE_LIMIT_WINDOW`` seconds, and the number
+suppressed is reported when the window rolls over.
+
+    LOG_LEVEL=DEBUG LOG_FORMAT=json python web_app.py
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# "text" for people, "json" for log aggregators
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_RATE_LIMIT_BURST = int(os.getenv('LOG_RATE_LIMIT_BURST', '5'))
+LOG_RATE_LIMIT_WINDOW = float(os.getenv('LOG_RATE_LIMIT_WINDOW', '60'))
+
+# Pass as ``extra=`` to rate-limit a message by its template
+RATE_LIMITED = {'rate_limited': True}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'rate_limited'}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Pass at most ``burst`` records per message template per ``window`` seconds
+
+    Only records logged with ``extra=RATE_LIMITED`` are limited. The first
+    record after a window with suppressions notes how many were dropped.
+    """
+
+    def __init__(self, burst: int = LOG_RATE_LIMIT_BURST, window: float = LOG_RATE_LIMIT_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'rate_limited', False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                if suppressed:
+                    record.msg = f"{record.msg} (suppressed {suppressed} similar messages in the last {self.window:.0f}s)"
+                started, passed, suppressed = now, 0, 0
+            if passed >= self.burst:
+                self._windows[key] = (started, passed, suppressed + 1)
+                return False
+            self._windows[key] = (started, passed + 1, suppressed)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any ``extra=`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock ``prepare()`` formats every message on the thread that logged it.
+    Here the arguments are only merged into the message by the listener, so
+    don't log objects that are mutated right after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks reference frames that may be gone by the time the listener runs
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, stream=None) -> logging.Logger:
+    """Configure the root logger once per process; later calls only change the level"""
+    global _listener
+    root = logging.getLogger()
+    with _setup_lock:
+        root.setLevel(level)
+        if _listener is not None:
+            return root
+
+        output = logging.StreamHandler(stream)
+        output.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        handler = _QueueHandler(log_queue)
+        handler.addFilter(RateLimitFilter())
+        root.handlers[:] = [handler]
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    return root
+
+
+def _restart_after_fork():
+    """In a forked child: the listener thread wasn't copied, so start a new one on a fresh queue
+
+    Records the parent had queued are left to the parent to write.
+    """
+    global _listener, _setup_lock
+    # Another thread may have held it at the fork
+    _setup_lock = threading.Lock()
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, _QueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
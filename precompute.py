@@ -0,0 +1,294 @@
+"""
+Precomputed rate card artifacts
+
+``python precompute.py`` builds every live rate card ahead of demand: the
+processed data (JSON, NDJSON and columnar JSON, as served by /generate-data),
+the changes since the previous card (as served by /generate-changes) and the
+XLSX and PDF downloads with and without commissions. Files are written per retailer to
+``RATE_CARD_ARTIFACT_DIR`` together with a ``manifest.json`` recording the data
+fingerprint each retailer's files were built from. The web routes serve an
+artifact directly while its fingerprint still matches Salesforce.
+
+    python precompute.py --workers 4          # nightly, e.g. from cron
+    python precompute.py --retailer "Acme"    # rebuild one retailer
+    python precompute.py --bulk               # read the whole org with Bulk API 2.0 first
+
+With ``--bulk`` the org's live rate card records are extracted once (see
+bulk_extract) and every retailer is fingerprinted and built from the extract,
+so a full refresh costs a handful of API calls rather than several per retailer.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+
+import click
+
+RATE_CARD_ARTIFACT_DIR = os.getenv(
+    'RATE_CARD_ARTIFACT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_card_artifacts'),
+)
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 2
+
+# Artifact name -> file name inside the retailer's directory
+ARTIFACT_FILES = {
+    'json': 'data.json',
+    'ndjson': 'data.ndjson',
+    'columnar': 'data.columnar.json',
+    'changes': 'changes.json',
+    'changes_hidden': 'changes_no_commission.json',
+    'xlsx': 'rate_card.xlsx',
+    'xlsx_hidden': 'rate_card_no_commission.xlsx',
+    'pdf': 'rate_card.pdf',
+    'pdf_hidden': 'rate_card_no_commission.pdf',
+}
+
+
+def retailer_slug(retailer_name: str) -> str:
+    """Filesystem-safe, collision-free directory name for a retailer"""
+    readable = re.sub(r'[^A-Za-z0-9]+', '-', retailer_name).strip('-').lower()[:40]
+    digest = hashlib.sha256(retailer_name.encode('utf-8')).hexdigest()[:8]
+    return f"{readable}-{digest}" if readable else digest
+
+
+def _write_atomic(path: str, write):
+    """Write via a temp file and rename, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_text(path: str, text: str):
+    """Write ``text`` to ``path`` atomically (readers never see a partial file)"""
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    _write_atomic(path, write)
+
+
+class ArtifactStore:
+    """Reads (and, for the precompute command, writes) the artifact directory
+
+    The manifest is re-read whenever its mtime changes, so a precompute run in
+    another process is picked up without a restart.
+    """
+
+    def __init__(self, directory: str = RATE_CARD_ARTIFACT_DIR):
+        self.directory = directory
+        self._manifest = None
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def load_manifest(self) -> Dict:
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return {'version': MANIFEST_VERSION, 'retailers': {}}
+        with self._lock:
+            if self._manifest is None or mtime != self._manifest_mtime:
+                try:
+                    with open(self.manifest_path, encoding='utf-8') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning("Could not read artifact manifest: %s", e)
+                    return {'version': MANIFEST_VERSION, 'retailers': {}}
+                if manifest.get('version') != MANIFEST_VERSION:
+                    manifest = {'version': MANIFEST_VERSION, 'retailers': {}}
+                self._manifest = manifest
+                self._manifest_mtime = mtime
+            return self._manifest
+
+    def save_manifest(self, manifest: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        write_text(self.manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+
+    def fresh_path(self, retailer_name: str, fingerprint: Optional[str], artifact: str) -> Optional[str]:
+        """Path of a precomputed artifact built from ``fingerprint``, or None"""
+        if fingerprint is None:
+            return None
+        entry = self.load_manifest()['retailers'].get(retailer_name)
+        if not entry or entry.get('fingerprint') != fingerprint or artifact not in entry.get('files', {}):
+            return None
+        path = os.path.join(self.directory, entry['slug'], entry['files'][artifact])
+        return path if os.path.isfile(path) else None
+
+    def latest_path(self, retailer_name: str, artifact: str) -> Optional[str]:
+        """Path of the last precomputed artifact whatever its fingerprint, or None"""
+        entry = self.load_manifest()['retailers'].get(retailer_name)
+        if not entry or artifact not in entry.get('files', {}):
+            return None
+        path = os.path.join(self.directory, entry['slug'], entry['files'][artifact])
+        return path if os.path.isfile(path) else None
+
+
+artifact_store = ArtifactStore()
+
+
+def write_artifacts(gen, retailer_name: str, fingerprint: str, directory: str) -> Dict:
+    """Build every artifact for one retailer and return its manifest entry"""
+    import columnar
+    from pdf_generator import PDFGenerator
+    from rate_card_snapshots import build_rate_cards, snapshot_store
+
+    slug = retailer_slug(retailer_name)
+    retailer_dir = os.path.join(directory, slug)
+    os.makedirs(retailer_dir, exist_ok=True)
+
+    start = time.monotonic()
+    data = build_rate_cards(gen, retailer_name)
+    fetched = time.monotonic()
+
+    # Same shapes as /generate-data: verticals in key order, as jsonify sorts them
+    rows = {vertical: df.to_json(orient='records') for vertical, df in data.items()}
+    write_text(os.path.join(retailer_dir, ARTIFACT_FILES['json']),
+               '{%s}' % ', '.join(f"{json.dumps(v)}: {rows[v]}" for v in sorted(rows)))
+    write_text(os.path.join(retailer_dir, ARTIFACT_FILES['ndjson']),
+               ''.join('{"vertical": %s, "rows": %s}\n' % (json.dumps(v), r) for v, r in rows.items()))
+    write_text(os.path.join(retailer_dir, ARTIFACT_FILES['columnar']), columnar.dumps(data))
+
+    pdf_gen = PDFGenerator()
+    for hide_commissions in (False, True):
+        suffix = '_hidden' if hide_commissions else ''
+        changes = snapshot_store.changes(retailer_name, data, hide_commissions)
+        write_text(os.path.join(retailer_dir, ARTIFACT_FILES['changes' + suffix]),
+                   json.dumps(changes, sort_keys=True))
+        _write_atomic(os.path.join(retailer_dir, ARTIFACT_FILES['xlsx' + suffix]),
+                      lambda path: gen.generate_excel(retailer_name, data, path, hide_commissions, changes))
+        _write_atomic(os.path.join(retailer_dir, ARTIFACT_FILES['pdf' + suffix]),
+                      lambda path: pdf_gen.generate_pdf(retailer_name, data, path, hide_commissions))
+
+    return {
+        'fingerprint': fingerprint,
+        'slug': slug,
+        'files': dict(ARTIFACT_FILES),
+        'verticals': len(data),
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'fetch_seconds': round(fetched - start, 3),
+        'render_seconds': round(time.monotonic() - fetched, 3),
+    }
+
+
+def precompute_all(pool, directory: str = RATE_CARD_ARTIFACT_DIR, workers: int = 4,
+                   retailers=None, force: bool = False, prune: bool = False, bulk: bool = False) -> Dict:
+    """Build artifacts for every live retailer (or just ``retailers``) in parallel
+
+    Retailers whose fingerprint matches the manifest are skipped unless ``force``.
+    With ``bulk`` every retailer is read from one Bulk API 2.0 extract of the org.
+    Returns a summary with built/skipped/failed counts.
+    """
+    store = ArtifactStore(directory)
+    manifest = store.load_manifest()
+    entries = dict(manifest['retailers'])
+
+    extract = None
+    if bulk:
+        with pool.checkout() as gen:
+            extract = gen.extract_org()
+        click.echo("Extracted " + ', '.join(f"{count} {name}" for name, count in extract.stats().items()))
+
+    if retailers is None:
+        with pool.checkout() as gen:
+            gen.use_extract(extract)
+            try:
+                retailers = [r['Name'] for r in gen.find_retailer('') if r['Name']]
+            finally:
+                gen.use_extract(None)
+        live = set(retailers)
+    else:
+        live = None
+
+    summary = {'retailers': len(retailers), 'built': 0, 'skipped': 0, 'failed': {}, 'pruned': 0}
+    lock = threading.Lock()
+
+    def build(retailer_name):
+        with pool.checkout() as gen:
+            gen.use_extract(extract)
+            try:
+                fingerprint = gen.get_data_fingerprint(retailer_name)
+                entry = entries.get(retailer_name)
+                if not force and entry and entry['fingerprint'] == fingerprint and all(
+                        os.path.isfile(os.path.join(directory, entry['slug'], name))
+                        for name in entry['files'].values()):
+                    return retailer_name, None
+                return retailer_name, write_artifacts(gen, retailer_name, fingerprint, directory)
+            finally:
+                gen.use_extract(None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build, name): name for name in retailers}
+        for future in as_completed(futures):
+            retailer_name = futures[future]
+            try:
+                _, entry = future.result()
+            except Exception as e:
+                summary['failed'][retailer_name] = str(e)
+                click.echo(f"  ✗ {retailer_name}: {e}", err=True)
+                continue
+            with lock:
+                if entry is None:
+                    summary['skipped'] += 1
+                else:
+                    entries[retailer_name] = entry
+                    summary['built'] += 1
+                    click.echo(f"  ✓ {retailer_name} ({entry['fetch_seconds']:.1f}s fetch, "
+                               f"{entry['render_seconds']:.1f}s render)")
+
+    if prune and live is not None:
+        # Leave the files in place; they are simply no longer served
+        for retailer_name in [name for name in entries if name not in live]:
+            del entries[retailer_name]
+            summary['pruned'] += 1
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'retailers': entries,
+    }
+    store.save_manifest(manifest)
+    return summary
+
+
+@click.command()
+@click.option('--output-dir', '-o', default=RATE_CARD_ARTIFACT_DIR, show_default=True,
+              help='Artifact directory (RATE_CARD_ARTIFACT_DIR)')
+@click.option('--workers', '-w', default=4, show_default=True, help='Retailers built in parallel')
+@click.option('--retailer', '-r', 'retailers', multiple=True, help='Only build these retailers (repeatable)')
+@click.option('--force', is_flag=True, help='Rebuild even if the fingerprint is unchanged')
+@click.option('--prune', is_flag=True, help='Drop retailers that no longer have live rate cards from the manifest')
+@click.option('--bulk', is_flag=True, help='Read the org with one Bulk API 2.0 extract instead of per-retailer queries')
+def main(output_dir, workers, retailers, force, prune, bulk):
+    """Precompute rate card data, XLSX and PDF files for every live retailer"""
+    from log_config import setup_logging
+    from salesforce_pool import SalesforcePool
+
+    setup_logging()
+
+    pool = SalesforcePool.from_env(size=workers)
+    start = time.monotonic()
+    click.echo(f"Precomputing rate cards into {output_dir} with {workers} workers...")
+    summary = precompute_all(pool, output_dir, workers, list(retailers) or None, force, prune, bulk)
+    click.echo(f"\n{summary['built']} built, {summary['skipped']} unchanged, {len(summary['failed'])} failed, "
+               f"{summary['pruned']} pruned of {summary['retailers']} retailers in {time.monotonic() - start:.1f}s")
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Query planning for the OpportunityLineItem fetch behind a rate card
+
+Line items can be fetched three ways, and which is cheapest depends on the
+retailer:
+
+- ``per_opportunity``: one query per assigned opportunity. Fetches exactly the
+  rows needed, but costs a call per opportunity.
+- ``batched``: ``OpportunityId IN (...)`` queries of ``SF_PLAN_BATCH_SIZE``
+  opportunities each. Exact rows, a fraction of the calls.
+- ``account_wide``: one query for every live line item of the account that
+  owns the rate cards, filtered locally. Fewest calls, but over-fetches when
+  a retailer (typically a branch) is assigned only some of the account's
+  opportunities.
+
+The plan with the lowest estimated cost (calls x ``SF_PLAN_CALL_COST_MS`` +
+rows x ``SF_PLAN_ROW_COST_MS``) wins. While the assigned opportunities fit in
+one batch an exact fetch can't lose to the account-wide one, so only larger
+retailers pay for a pre-count: one grouped COUNT query giving the line items
+per opportunity of the account. Account-wide fetches are capped at
+``SF_PLAN_MAX_OVERFETCH`` times the rows needed.
+"""
+import math
+import os
+import threading
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from instrumentation import registry
+
+# Opportunity IDs per IN (...) query; 18-character IDs keep 200 well under the URI limit
+SF_PLAN_BATCH_SIZE = int(os.getenv('SF_PLAN_BATCH_SIZE', '200'))
+# Largest account-wide fetch allowed, as a multiple of the line items actually needed
+SF_PLAN_MAX_OVERFETCH = float(os.getenv('SF_PLAN_MAX_OVERFETCH', '1.5'))
+# Cost model: round trip per API call, and transfer/parsing per record
+SF_PLAN_CALL_COST_MS = float(os.getenv('SF_PLAN_CALL_COST_MS', '150'))
+SF_PLAN_ROW_COST_MS = float(os.getenv('SF_PLAN_ROW_COST_MS', '0.2'))
+
+STRATEGIES = ('per_opportunity', 'batched', 'account_wide')
+PAGE_SIZE = 2000  # records per query page
+
+registry.describe('query_plans_total', 'Line item fetch plans chosen, by strategy')
+
+
+def _pages(rows: int) -> int:
+    return max(1, math.ceil(rows / PAGE_SIZE))
+
+
+def estimate(strategy: str, opportunities: int, needed_rows: int, account_rows: int,
+             batch_size: int = SF_PLAN_BATCH_SIZE) -> Dict:
+    """Estimated API calls, rows fetched and cost (ms) of one strategy"""
+    if strategy == 'per_opportunity':
+        # Pages only add calls for opportunities with over 2,000 line items
+        calls, rows = max(opportunities, _pages(needed_rows)), needed_rows
+    elif strategy == 'batched':
+        batches = math.ceil(opportunities / batch_size)
+        calls, rows = batches * _pages(needed_rows / batches), needed_rows
+    else:
+        calls, rows = _pages(account_rows), account_rows
+    return {'calls': calls, 'rows': rows,
+            'cost_ms': round(calls * SF_PLAN_CALL_COST_MS + rows * SF_PLAN_ROW_COST_MS, 1)}
+
+
+def needs_counts(opportunities: int, batch_size: int = SF_PLAN_BATCH_SIZE) -> bool:
+    """Whether a line item pre-count could change the plan"""
+    return opportunities > batch_size
+
+
+def choose(opportunities: int, needed_rows: Optional[int] = None, account_rows: Optional[int] = None,
+           batch_size: int = SF_PLAN_BATCH_SIZE) -> Dict:
+    """Pick a strategy from the pre-counts (None when they weren't taken)
+
+    Returns the plan: strategy, the inputs and every candidate's estimate.
+    """
+    plan = {'opportunities': opportunities, 'needed_rows': needed_rows, 'account_rows': account_rows,
+            'batch_size': batch_size}
+    if needed_rows is None:
+        # Not counted (or the count failed): only the exact strategies are safe,
+        # and as they fetch the same rows the number of calls decides
+        candidates = ('per_opportunity', 'batched')
+        estimates = {s: estimate(s, opportunities, 0, 0, batch_size) for s in candidates}
+    else:
+        estimates = {s: estimate(s, opportunities, needed_rows, account_rows or needed_rows, batch_size)
+                     for s in STRATEGIES}
+        candidates = [s for s in STRATEGIES
+                      if s != 'account_wide' or (account_rows or 0) <= max(needed_rows, 1) * SF_PLAN_MAX_OVERFETCH]
+    # Ties go to the earlier, more exact strategy
+    plan.update(strategy=min(candidates, key=lambda s: estimates[s]['cost_ms']), estimates=estimates)
+    return plan
+
+
+class PlanLog:
+    """Counts of the strategies chosen and the most recent plans with their actual cost"""
+
+    def __init__(self, keep: int = 20):
+        self._recent = deque(maxlen=keep)
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, retailer_name: str, plan: Dict):
+        registry.inc('query_plans_total', strategy=plan['strategy'])
+        with self._lock:
+            self._counts[plan['strategy']] += 1
+            self._recent.append(dict(plan, retailer=retailer_name))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'counts': dict(self._counts), 'recent': list(self._recent)}
+
+
+plan_log = PlanLog()
@@ -0,0 +1,523 @@
+"""
+In-process caches for processed rate cards and the retailer search index
+
+Processed rate cards are stored with the data fingerprint they were built from
+(see ``RateCardGenerator.get_data_fingerprint``), so an entry is only reused
+while the underlying Salesforce records are unchanged. The retailer index holds
+every searchable retailer so ``/search`` can filter locally instead of running
+a SOQL ``LIKE`` per keystroke. Both are filled on demand and by ``warmup``.
+With ``FINGERPRINT_CACHE_TTL`` the fingerprints themselves are reused too, and
+change notifications (``change_events``) drop the ones whose records changed.
+With ``CACHE_BACKEND=sqlite`` both live in the shared store (see ``shared_cache``),
+so every worker process on the host reads what any of them built.
+With ``SEARCH_MODE=aggregate`` a cold index isn't loaded for a search; the page
+comes from a grouped SOQL query instead (``RateCardGenerator.find_retailer_page``).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import api_budget
+import rate_card_snapshots
+import retailer_search
+import shared_cache
+from circuit_breaker import SalesforceUnavailable
+
+RATE_CARD_CACHE_TTL = float(os.getenv('RATE_CARD_CACHE_TTL', '3600'))
+RATE_CARD_CACHE_SIZE = int(os.getenv('RATE_CARD_CACHE_SIZE', '50'))
+# New retailers show up in search within this many seconds
+RETAILER_INDEX_TTL = float(os.getenv('RETAILER_INDEX_TTL', '600'))
+# How /search answers when the index is cold: 'index' loads every retailer, 'aggregate' queries one page
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'index')
+# Seconds a data fingerprint is reused without asking Salesforce; 0 checks every request. Only
+# safe when change notifications reach /webhooks/salesforce-changes (see change_events)
+FINGERPRINT_CACHE_TTL = float(os.getenv('FINGERPRINT_CACHE_TTL', '0'))
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Thread-safe TTL + LRU cache of processed rate cards keyed by retailer name
+
+    Cached DataFrames are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, ttl: float = RATE_CARD_CACHE_TTL, max_size: int = RATE_CARD_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, retailer_name: str, fingerprint: Optional[str]) -> Optional[Dict]:
+        """Rate card data built from ``fingerprint``, or None if absent, stale or expired"""
+        with self._lock:
+            entry = self._entries.get(retailer_name)
+            if (entry is None or fingerprint is None or entry['fingerprint'] != fingerprint
+                    or entry['expires'] < time.monotonic()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(retailer_name)
+            self.hits += 1
+            return entry['data']
+
+    def set(self, retailer_name: str, fingerprint: Optional[str], data: Dict):
+        # Without a fingerprint there is no way to tell when the entry goes stale
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._entries[retailer_name] = {
+                'fingerprint': fingerprint,
+                'data': data,
+                'built': time.monotonic(),
+                'expires': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(retailer_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_stale(self, retailer_name: str) -> Optional[Dict]:
+        """Whatever is cached for the retailer, however old (for when Salesforce can't be asked)"""
+        with self._lock:
+            entry = self._entries.get(retailer_name)
+            return entry['data'] if entry is not None else None
+
+    def age(self, retailer_name: str) -> Optional[float]:
+        """Seconds since the retailer's cached rate card was built"""
+        with self._lock:
+            entry = self._entries.get(retailer_name)
+            return time.monotonic() - entry['built'] if entry is not None else None
+
+    def invalidate(self, retailer_name: Optional[str] = None):
+        """Drop one retailer's rate cards, or everything when no name is given"""
+        with self._lock:
+            if retailer_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(retailer_name, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class SharedResultCache:
+    """``ResultCache`` kept in a ``SqliteStore``, shared by every worker process
+
+    The rate cards this process last read stay unpickled in memory and are
+    reused for as long as the shared entry is unchanged. Hits and misses are
+    counted per process.
+    """
+
+    NAMESPACE = 'rate_cards'
+
+    def __init__(self, store: shared_cache.SqliteStore, ttl: float = RATE_CARD_CACHE_TTL,
+                 max_size: int = RATE_CARD_CACHE_SIZE):
+        self.store = store
+        self.ttl = ttl
+        self.max_size = max_size
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _keep(self, retailer_name: str, created: float, data: Dict):
+        with self._lock:
+            self._local[retailer_name] = (created, data)
+            self._local.move_to_end(retailer_name)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def _read(self, retailer_name: str, allow_expired: bool = False) -> Optional[Dict]:
+        with self._lock:
+            known = self._local.get(retailer_name)
+        entry = self.store.get(self.NAMESPACE, retailer_name, allow_expired, known[0] if known else None)
+        if entry is None:
+            return None
+        if entry.get('unchanged'):
+            entry['value'] = known[1]
+        else:
+            self._keep(retailer_name, entry['created'], entry['value'])
+        return entry
+
+    def get(self, retailer_name: str, fingerprint: Optional[str]) -> Optional[Dict]:
+        """Rate card data built from ``fingerprint``, or None if absent, stale or expired"""
+        entry = self._read(retailer_name) if fingerprint is not None else None
+        with self._lock:
+            if entry is None or entry['fingerprint'] != fingerprint:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry['value']
+
+    def set(self, retailer_name: str, fingerprint: Optional[str], data: Dict):
+        if fingerprint is None:
+            return
+        created = self.store.set(self.NAMESPACE, retailer_name, data, self.ttl, fingerprint, self.max_size)
+        if created is not None:
+            self._keep(retailer_name, created, data)
+
+    def get_stale(self, retailer_name: str) -> Optional[Dict]:
+        """Whatever is cached for the retailer, however old (for when Salesforce can't be asked)"""
+        entry = self._read(retailer_name, allow_expired=True)
+        return entry['value'] if entry is not None else None
+
+    def age(self, retailer_name: str) -> Optional[float]:
+        """Seconds since the retailer's cached rate card was built"""
+        entry = self._read(retailer_name, allow_expired=True)
+        return time.time() - entry['created'] if entry is not None else None
+
+    def invalidate(self, retailer_name: Optional[str] = None):
+        """Drop one retailer's rate cards, or everything when no name is given, in every process"""
+        self.store.delete(self.NAMESPACE, retailer_name)
+        with self._lock:
+            if retailer_name is None:
+                self._local.clear()
+            else:
+                self._local.pop(retailer_name, None)
+
+    def stats(self) -> Dict:
+        stored = self.store.stats(self.NAMESPACE)
+        with self._lock:
+            return {'entries': stored['entries'], 'bytes': stored['bytes'], 'hits': self.hits, 'misses': self.misses}
+
+
+class RetailerIndex:
+    """Every retailer with a live rate card, as returned by ``find_retailer('')``"""
+
+    def __init__(self, ttl: float = RETAILER_INDEX_TTL):
+        self.ttl = ttl
+        self._retailers = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, retailers: List[Dict]):
+        # Kept in search order, so a page stops scanning once it's full
+        retailers = sorted(retailers, key=retailer_search.order_key)
+        with self._lock:
+            self._retailers = retailers
+            self._loaded_at = time.monotonic()
+
+    def is_fresh(self) -> bool:
+        with self._lock:
+            return self._retailers is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def search_page(self, partial_name: str, salesforce_user_id: str = None, limit: int = 20,
+                    cursor: Optional[str] = None, allow_stale: bool = False) -> Optional[Dict]:
+        """Same page as ``find_retailer_page``, or None when the index needs (re)loading
+
+        SOQL ``LIKE`` is case-insensitive, so a lower-cased substring match is equivalent.
+        With ``allow_stale`` an expired index is still searched.
+        """
+        retailers = self._retailers
+        if retailers is None or not (allow_stale or self.is_fresh()):
+            return None
+        if salesforce_user_id is not None:
+            retailers = [retailer for retailer in retailers
+                         if retailer_search.same_salesforce_id(retailer['OwnerId'], salesforce_user_id)]
+        return retailer_search.search_sorted(retailers, partial_name, limit, cursor)
+
+    def invalidate(self):
+        """Expire the index, so the next search reloads it (the old copy still serves stale searches)"""
+        with self._lock:
+            self._loaded_at = float('-inf')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'retailers': len(self._retailers) if self._retailers is not None else None,
+                'age_seconds': (round(time.monotonic() - self._loaded_at, 1)
+                                if self._retailers is not None and self._loaded_at > float('-inf') else None),
+            }
+
+
+class SharedRetailerIndex(RetailerIndex):
+    """``RetailerIndex`` whose loads are published to a ``SqliteStore``
+
+    A process whose own copy has expired takes the newest one any process
+    loaded, as long as that is still fresh, before asking Salesforce.
+    """
+
+    NAMESPACE = 'retailer_index'
+    KEY = 'retailers'
+
+    def __init__(self, store: shared_cache.SqliteStore, ttl: float = RETAILER_INDEX_TTL):
+        super().__init__(ttl)
+        self.store = store
+        self._created = None
+
+    def load(self, retailers: List[Dict]):
+        super().load(retailers)
+        created = self.store.set(self.NAMESPACE, self.KEY, self._retailers, self.ttl)
+        with self._lock:
+            self._created = created
+
+    def _adopt_shared(self, allow_expired: bool = False):
+        """Replace this process's copy with a newer one from the store, if there is one"""
+        entry = self.store.get(self.NAMESPACE, self.KEY, allow_expired, self._created)
+        if entry is None or entry.get('unchanged'):
+            return
+        with self._lock:
+            self._retailers = entry['value']
+            self._created = entry['created']
+            self._loaded_at = time.monotonic() - max(0.0, time.time() - entry['created'])
+
+    def is_fresh(self) -> bool:
+        if not super().is_fresh():
+            self._adopt_shared()
+        return super().is_fresh()
+
+    def invalidate(self):
+        """Expire the index in every process"""
+        self.store.delete(self.NAMESPACE, self.KEY)
+        super().invalidate()
+
+    def search_page(self, partial_name: str, salesforce_user_id: str = None, limit: int = 20,
+                    cursor: Optional[str] = None, allow_stale: bool = False) -> Optional[Dict]:
+        if self._retailers is None or (allow_stale and not super().is_fresh()):
+            self._adopt_shared(allow_expired=allow_stale)
+        return super().search_page(partial_name, salesforce_user_id, limit, cursor, allow_stale)
+
+
+class FingerprintCache:
+    """Data fingerprints reused for ``ttl`` seconds, or until a change notification drops them
+
+    Kept in the shared store when there is one, so a notification handled by
+    one worker process reaches all of them. Dropping a fingerprint leaves a
+    marker, so a fingerprint that was being computed while the records changed
+    isn't stored afterwards. A ``ttl`` of 0 disables the cache.
+    """
+
+    NAMESPACE = 'fingerprints'
+    EVERYTHING = '*'
+
+    def __init__(self, ttl: float = FINGERPRINT_CACHE_TTL, store: Optional[shared_cache.SqliteStore] = None):
+        self.ttl = ttl
+        self.store = store
+        self._entries = {}   # retailer -> (fingerprint or None when dropped, time.time() stored, expires)
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def _entry(self, key: str):
+        if self.store is not None:
+            entry = self.store.get(self.NAMESPACE, key)
+            return (entry['value'], entry['created']) if entry is not None else None
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[:2] if entry is not None and entry[2] > time.time() else None
+
+    def get(self, retailer_name: str) -> Optional[str]:
+        if self.ttl <= 0:
+            return None
+        entry = self._entry(retailer_name)
+        if entry is None or entry[0] is None:
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry[0]
+
+    def set(self, retailer_name: str, fingerprint: Optional[str], started: float):
+        """Keep a fingerprint computed from ``started``, unless it has been dropped since"""
+        if self.ttl <= 0 or fingerprint is None:
+            return
+        for key in (self.EVERYTHING, retailer_name):
+            entry = self._entry(key)
+            if entry is not None and entry[0] is None and entry[1] >= started:
+                return
+        self._put(retailer_name, fingerprint)
+
+    def _put(self, key: str, fingerprint: Optional[str]):
+        if self.store is not None:
+            self.store.set(self.NAMESPACE, key, fingerprint, self.ttl)
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (fingerprint, now, now + self.ttl)
+
+    def invalidate(self, retailer_name: Optional[str] = None):
+        """Drop one retailer's fingerprint, or every one when no name is given"""
+        if self.ttl <= 0:
+            return
+        if retailer_name is None:
+            if self.store is not None:
+                self.store.delete(self.NAMESPACE)
+            else:
+                with self._lock:
+                    self._entries.clear()
+        self._put(retailer_name or self.EVERYTHING, None)
+
+    def stats(self) -> Dict:
+        if self.store is not None:
+            entries = self.store.stats(self.NAMESPACE)['entries']
+        else:
+            with self._lock:
+                entries = len(self._entries)
+        return {'ttl': self.ttl, 'entries': entries, 'hits': self.hits}
+
+
+class RequestCounter:
+    """How often each retailer's rate card has been requested by this process"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, retailer_name: str):
+        if retailer_name:
+            with self._lock:
+                self._counts[retailer_name] += 1
+
+    def most_common(self, n: int) -> List[str]:
+        with self._lock:
+            return [name for name, _ in self._counts.most_common(n)]
+
+
+class BackgroundRefresher:
+    """Rebuilds rate cards off the request path, one refresh per retailer at a time
+
+    Used while stale rate cards are being served: requests don't wait for
+    Salesforce, and a burst of them for one retailer starts a single rebuild.
+    """
+
+    def __init__(self):
+        self._running = set()
+        self._lock = threading.Lock()
+        self.started = 0
+
+    def start(self, get_pool: Callable, retailer_name: str) -> bool:
+        """Start a refresh unless one is already running; True if started"""
+        with self._lock:
+            if retailer_name in self._running:
+                return False
+            self._running.add(retailer_name)
+            self.started += 1
+        threading.Thread(target=self._refresh, args=(get_pool, retailer_name), daemon=True,
+                         name=f"refresh-{retailer_name}").start()
+        return True
+
+    def _refresh(self, get_pool: Callable, retailer_name: str):
+        try:
+            budget_problem = api_budget.governor.check()
+            if budget_problem:
+                logger.info("Skipping background refresh of %s: %s", retailer_name, budget_problem)
+                return
+            with get_pool().checkout() as gen:
+                get_rate_cards(gen, retailer_name, data_fingerprint(gen, retailer_name))
+            logger.info("Refreshed rate card for %s in the background", retailer_name)
+        except Exception as e:
+            logger.warning("Background refresh of %s failed: %s", retailer_name, e)
+        finally:
+            with self._lock:
+                self._running.discard(retailer_name)
+
+    def running(self) -> List[str]:
+        with self._lock:
+            return sorted(self._running)
+
+
+if shared_cache.store is not None:
+    result_cache = SharedResultCache(shared_cache.store)
+    retailer_index = SharedRetailerIndex(shared_cache.store)
+else:
+    result_cache = ResultCache()
+    retailer_index = RetailerIndex()
+fingerprint_cache = FingerprintCache(store=shared_cache.store)
+request_counter = RequestCounter()
+refresher = BackgroundRefresher()
+
+
+def data_fingerprint(gen, retailer_name: str) -> Optional[str]:
+    """The retailer's data fingerprint, or None if it can't be built (outages still raise)"""
+    fingerprint = fingerprint_cache.get(retailer_name)
+    if fingerprint is not None:
+        return fingerprint
+    started = time.time()
+    try:
+        fingerprint = gen.get_data_fingerprint(retailer_name)
+    except SalesforceUnavailable:
+        raise
+    except Exception as e:
+        logger.warning("Could not fingerprint rate card data for %s: %s", retailer_name, e)
+        return None
+    fingerprint_cache.set(retailer_name, fingerprint, started)
+    return fingerprint
+
+
+def get_rate_cards(gen, retailer_name: str, fingerprint: Optional[str],
+                   progress: Optional[Callable] = None) -> Dict:
+    """Processed rate cards from the cache, or built (cached and snapshotted) with ``gen``
+
+    A cache hit replays the render events, so progress listeners still receive
+    one ``vertical`` event per product vertical.
+    """
+    data = result_cache.get(retailer_name, fingerprint)
+    if data is not None:
+        rows = sum(len(df) for df in data.values())
+        gen._report(progress, 'render_started', verticals=len(data), rows=rows, cached=True)
+        for processed, (vertical, df) in enumerate(data.items(), 1):
+            gen._report(progress, 'vertical', vertical=vertical, data=df, processed=processed, total=len(data))
+        gen._report(progress, 'render_finished', verticals=len(data), rows=rows)
+        return data
+
+    data = rate_card_snapshots.build_rate_cards(gen, retailer_name, progress)
+    result_cache.set(retailer_name, fingerprint, data)
+    return data
+
+
+async def data_fingerprint_async(gen, retailer_name: str) -> Optional[str]:
+    """``data_fingerprint`` for an ``AsyncRateCardGenerator``, with the cache calls off the event loop"""
+    fingerprint = await asyncio.to_thread(fingerprint_cache.get, retailer_name)
+    if fingerprint is not None:
+        return fingerprint
+    started = time.time()
+    try:
+        fingerprint = await gen.get_data_fingerprint(retailer_name)
+    except SalesforceUnavailable:
+        raise
+    except Exception as e:
+        logger.warning("Could not fingerprint rate card data for %s: %s", retailer_name, e)
+        return None
+    await asyncio.to_thread(fingerprint_cache.set, retailer_name, fingerprint, started)
+    return fingerprint
+
+
+async def get_rate_cards_async(gen, retailer_name: str, fingerprint: Optional[str]) -> Dict:
+    """``get_rate_cards`` for an ``AsyncRateCardGenerator`` (without progress events)
+
+    The cache calls run on a thread: with ``CACHE_BACKEND=sqlite`` they wait on the
+    file's write lock and (un)pickle whole rate cards.
+    """
+    data = await asyncio.to_thread(result_cache.get, retailer_name, fingerprint)
+    if data is None:
+        data = await rate_card_snapshots.build_rate_cards_async(gen, retailer_name)
+        await asyncio.to_thread(result_cache.set, retailer_name, fingerprint, data)
+    return data
+
+
+def search_retailer_page(gen, partial_name: str, salesforce_user_id: str = None, limit: int = 20,
+                         cursor: Optional[str] = None) -> Dict:
+    """One page of search results from the index, or from Salesforce when it has expired (see SEARCH_MODE)"""
+    page = retailer_index.search_page(partial_name, salesforce_user_id, limit, cursor)
+    if page is None:
+        if SEARCH_MODE == 'aggregate':
+            return gen.find_retailer_page(partial_name, salesforce_user_id, limit, cursor)
+        retailer_index.load(gen.find_retailer(''))
+        page = retailer_index.search_page(partial_name, salesforce_user_id, limit, cursor)
+    return page
+
+
+async def search_retailer_page_async(gen, partial_name: str, salesforce_user_id: str = None, limit: int = 20,
+                                     cursor: Optional[str] = None) -> Dict:
+    """``search_retailer_page`` for an ``AsyncRateCardGenerator``, with the index calls off the event loop"""
+    page = await asyncio.to_thread(retailer_index.search_page, partial_name, salesforce_user_id, limit, cursor)
+    if page is None:
+        if SEARCH_MODE == 'aggregate':
+            return await gen.find_retailer_page(partial_name, salesforce_user_id, limit, cursor)
+        await asyncio.to_thread(retailer_index.load, await gen.find_retailer(''))
+        page = await asyncio.to_thread(retailer_index.search_page, partial_name, salesforce_user_id, limit, cursor)
+    return page
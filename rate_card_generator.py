@@ -1,27 +1,124 @@
 import os
+import logging
 from datetime import datetime
 from simple_salesforce import Salesforce
+from simple_salesforce.exceptions import SalesforceExpiredSession
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
 import click
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import json
+import hashlib
+import time
+import circuit_breaker
+import query_planner
+import rate_card_snapshots
+import retailer_search
+from instrumentation import stage
+from api_budget import install_hook
+from circuit_breaker import SalesforceUnavailable
+from log_config import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Most rows an aggregate query returns; they can't be continued with queryMore
+AGGREGATE_ROW_LIMIT = 2000
+
+def _soql_escape(value: str) -> str:
+    """Escape a value for use inside a quoted SOQL string"""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+def _like_escape(value: str) -> str:
+    """Escape a value for a SOQL LIKE pattern, so % and _ match themselves"""
+    return _soql_escape(value).replace('%', '\\%').replace('_', '\\_')
 
 class RateCardGenerator:
-    def __init__(self, username: str, password: str, security_token: str, domain: str = 'login'):
-        """Initialize Salesforce connection"""
-        self.sf = Salesforce(
-            username=username,
-            password=password,
-            security_token=security_token,
-            domain=domain
-        )
+    def __init__(self, username: str, password: str, security_token: str, domain: str = 'login', session=None):
+        """Initialize Salesforce connection
+        
+        Args:
+            session: Optional ``requests.Session`` used for every Salesforce call,
+                     e.g. one with a tuned connection pool (see salesforce_pool)
+        """
+        self._credentials = {
+            'username': username,
+            'password': password,
+            'security_token': security_token,
+            'domain': domain
+        }
+        self.session = session
+        self.relogins = 0
+        # Line item fetch plan of the last rate card, with its actual cost
+        self.last_plan = None
+        # Bulk extract answering instead of Salesforce (see use_extract)
+        self.extract = None
+        self._login()
         
         # Remove product groupings - process each vertical separately
         self.product_groupings = None
     
+    def _login(self):
+        """(Re)authenticate and replace the Salesforce client"""
+        with stage('salesforce_login'):
+            self.sf = Salesforce(session=self.session, **self._credentials)
+        # Count API calls (and read the org's remaining allocation) for the budget governor
+        install_hook(self.sf.session)
+    
+    def _call(self, method: str, soql: str, label: str, **kwargs) -> Dict:
+        """Run a Salesforce query, logging in again once if the session has expired
+        
+        Timed as the ``soql`` stage, labelled with ``label`` and the record count.
+        Runs with bounded timeouts through the circuit breaker for ``label``; an
+        outage is raised as ``SalesforceUnavailable`` (see circuit_breaker).
+        """
+        breaker = circuit_breaker.breakers.get(label)
+        breaker.before_call()
+        kwargs.setdefault('timeout', circuit_breaker.timeouts())
+        try:
+            with stage('soql', query=label) as timing:
+                try:
+                    result = getattr(self.sf, method)(soql, **kwargs)
+                except SalesforceExpiredSession:
+                    logger.warning("Salesforce session expired, logging in again")
+                    self._login()
+                    self.relogins += 1
+                    result = getattr(self.sf, method)(soql, **kwargs)
+                timing['records'] = len(result.get('records', []))
+        except Exception as e:
+            if circuit_breaker.is_outage(e):
+                breaker.record_failure()
+                raise SalesforceUnavailable(f"Salesforce {label} query failed: {e}") from e
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+    
+    def _query(self, soql: str, label: str = 'query') -> Dict:
+        return self._call('query', soql, label)
+    
+    def _query_all(self, soql: str, label: str = 'query') -> Dict:
+        return self._call('query_all', soql, label)
+    
+    def _query_pages(self, soql: str, label: str = 'query') -> Iterator[List[Dict]]:
+        """Yield a query's records one page (up to 2,000) at a time
+        
+        Like ``query_all_iter``, but each page goes through ``_call``, so it is
+        timed and survives an expired session (query locators outlive sessions).
+        """
+        result = self._call('query', soql, label)
+        yield result['records']
+        while not result.get('done', True):
+            result = self._call('query_more', result['nextRecordsUrl'], label, identifier_is_url=True)
+            yield result['records']
+    
+    def extract_org(self, progress: Optional[Callable] = None):
+        """Bulk API 2.0 extract of every live rate card's records (see bulk_extract)"""
+        import bulk_extract
+        return bulk_extract.extract(self, progress)
+    
+    def use_extract(self, extract):
+        """Answer the retailer list, fingerprints and rate card items from ``extract`` (None: from Salesforce)"""
+        self.extract = extract
+    
     def find_retailer(self, partial_name: str, salesforce_user_id: str = None) -> List[Dict]:
         """Find retailers and retailer branches matching partial name
         Only returns accounts that have live rate cards with active assigned rate cards
@@ -30,75 +127,147 @@ class RateCardGenerator:
             partial_name: Partial retailer name to search for
             salesforce_user_id: If provided, filter to only accounts owned by this user
         """
+        if self.extract is not None and not partial_name:
+            return self.extract.retailers(salesforce_user_id)
+        
+        # One aggregate row per retailer rather than one row per assigned rate card,
+        # read in keyset pages as aggregate queries can't use queryMore
+        name_filter = f"Retailer__r.Name LIKE '%{_like_escape(partial_name)}%'"
+        combined_results = []
+        after = None
+        while True:
+            page = self._query_retailers(name_filter, salesforce_user_id, after, AGGREGATE_ROW_LIMIT, 'find_retailer')
+            combined_results.extend(page)
+            if len(page) < AGGREGATE_ROW_LIMIT:
+                break
+            after = (page[-1]['Name'], page[-1]['Id'])
+        
+        # Sort by name
+        combined_results.sort(key=lambda x: x['Name'] or '')
+        
+        return combined_results
+    
+    def find_retailer_page(self, partial_name: str, salesforce_user_id: str = None, limit: int = 20,
+                           cursor: Optional[str] = None) -> Dict:
+        """One page of retailers matching partial name, prefix matches first (see retailer_search)
+        
+        Each ranking tier is an aggregate query with ``LIMIT limit + 1``, so the
+        payload and the work Salesforce does follow the page size, not the
+        number of matching assigned rate cards.
+        
+        Returns:
+            ``{'retailers': [...], 'next_cursor': str or None}``, retailers in the
+            format of ``find_retailer``
+        """
+        after = retailer_search.decode_cursor(cursor)
+        ranked = []
+        for tier, name_filter in self._retailer_name_filters(partial_name).items():
+            if after and tier < after[0]:
+                continue
+            start = after[1:] if after and tier == after[0] else None
+            rows = self._query_retailers(name_filter, salesforce_user_id, start, limit + 1 - len(ranked),
+                                         'find_retailer_page')
+            ranked.extend((tier, retailer) for retailer in rows)
+            if len(ranked) > limit or not partial_name:
+                break
+        return retailer_search.make_page(ranked, limit)
+    
+    def _retailer_name_filters(self, partial_name: str) -> Dict[int, str]:
+        """Name filter per search ranking tier (see retailer_search)"""
+        term = _like_escape(partial_name)
+        return {
+            retailer_search.PREFIX: f"Retailer__r.Name LIKE '{term}%'",
+            retailer_search.SUBSTRING: f"Retailer__r.Name LIKE '%{term}%' AND (NOT Retailer__r.Name LIKE '{term}%')",
+        }
+    
+    def _query_retailers(self, name_filter: str, salesforce_user_id: Optional[str], after: Optional[Tuple[str, str]],
+                         limit: int, label: str) -> List[Dict]:
+        """Retailers with live rate cards matching ``name_filter``, by name then Id, after ``(name, Id)``"""
+        return self._retailer_rows(self._query(self._retailer_query(name_filter, salesforce_user_id, after, limit),
+                                               label)['records'])
+    
+    def _retailer_query(self, name_filter: str, salesforce_user_id: Optional[str], after: Optional[Tuple[str, str]],
+                        limit: int) -> str:
+        """Aggregate SOQL for ``_query_retailers``: one row per retailer"""
         # Build owner filter clause for relationship field
         owner_filter = f" AND Retailer__r.OwnerId = '{salesforce_user_id}'" if salesforce_user_id else ""
+        keyset_filter = ""
+        if after:
+            name, retailer_id = _soql_escape(after[0]), _soql_escape(after[1])
+            keyset_filter = (f" AND (Retailer__r.Name > '{name}'"
+                             f" OR (Retailer__r.Name = '{name}' AND Retailer__c > '{retailer_id}'))")
         
-        # Single query using relationship fields to avoid nested semi-joins
-        # Query from Assigned_Rate_Card__c and get retailer information via relationships
-        query = f"""
-        SELECT 
+        # Aggregate results key fields by their last name, so the owner's name needs an alias
+        return f"""
+        SELECT
+            Retailer__c,
             Retailer__r.Name,
-            Retailer__r.Id, 
             Retailer__r.RecordType.DeveloperName,
             Retailer__r.OwnerId,
-            Retailer__r.Owner.Name
+            Retailer__r.Owner.Name OwnerName
         FROM Assigned_Rate_Card__c
-        WHERE 
-            Retailer__r.Name LIKE '%{partial_name}%'
+        WHERE
+            {name_filter}
             AND Retailer__r.RecordType.DeveloperName IN ('Retailer', 'Retailer_Branch')
             AND Active__c = true
             AND Opportunity__r.RecordType.DeveloperName = 'Retailer_Rate_Card'
             AND Opportunity__r.StageName = 'Live'
-            {owner_filter}
+            {owner_filter}{keyset_filter}
+        GROUP BY Retailer__c, Retailer__r.Name, Retailer__r.RecordType.DeveloperName,
+            Retailer__r.OwnerId, Retailer__r.Owner.Name
+        ORDER BY Retailer__r.Name, Retailer__c
+        LIMIT {limit}
         """.strip()
-        
-        # Execute query
-        results = self.sf.query_all(query)['records']
-        
-        # Transform to match expected format and deduplicate
-        seen_ids = set()
-        combined_results = []
-        
-        for record in results:
-            retailer_data = record.get('Retailer__r', {})
-            retailer_id = retailer_data.get('Id')
-            
-            if retailer_id and retailer_id not in seen_ids:
-                seen_ids.add(retailer_id)
-                # Restructure to match original format
-                formatted_record = {
-                    'Name': retailer_data.get('Name'),
-                    'Id': retailer_id,
-                    'RecordType': {'DeveloperName': retailer_data.get('RecordType', {}).get('DeveloperName')},
-                    'OwnerId': retailer_data.get('OwnerId'),
-                    'Owner': {'Name': retailer_data.get('Owner', {}).get('Name')}
-                }
-                combined_results.append(formatted_record)
-        
-        # Sort by name
-        combined_results.sort(key=lambda x: x['Name'] or '')
-        
-        return combined_results
     
-    def get_rate_card_items(self, retailer_name: str) -> pd.DataFrame:
-        """Get rate card items with position data using two-step approach"""
+    def _retailer_rows(self, records: List[Dict]) -> List[Dict]:
+        """Aggregate rows restructured to match the original find_retailer format"""
+        return [{
+            'Name': row.get('Name'),
+            'Id': row.get('Retailer__c'),
+            'RecordType': {'DeveloperName': row.get('DeveloperName')},
+            'OwnerId': row.get('OwnerId'),
+            'Owner': {'Name': row.get('OwnerName')}
+        } for row in records if row.get('Retailer__c')]
+    
+    def _report(self, progress: Optional[Callable], stage: str, **data):
+        """Send a progress event to the caller's callback, if one was given"""
+        if progress is None:
+            return
+        try:
+            progress(stage, **data)
+        except Exception as e:
+            # A broken listener must never abort generation
+            logger.error("Progress callback failed at stage %s: %s", stage, e)
+    
+    def _resolve_opportunity_account(self, retailer_name: str) -> str:
+        """Return the account that owns the retailer's rate card Opportunities
+        
+        Branches hold no Opportunities of their own, so their parent account is used.
+        """
+        if self.extract is not None:
+            return self._opportunity_account(retailer_name, self.extract.account_records(retailer_name))
         # First check if this is a retailer branch and get parent account if needed
-        account_query = f"""
+        account_result = self._query(self._account_query(retailer_name), 'account')
+        return self._opportunity_account(retailer_name, account_result['records'])
+    
+    def _account_query(self, retailer_name: str) -> str:
+        return f"""
         SELECT Name, RecordType.DeveloperName, Parent.Name
         FROM Account
         WHERE Name = '{retailer_name}'
         LIMIT 1
         """
-        account_result = self.sf.query(account_query)
-        
+    
+    def _opportunity_account(self, retailer_name: str, account_records: List[Dict]) -> str:
+        """The account name to query Opportunities by, given the retailer's Account records"""
         # Determine which account name to use for the Opportunity query
-        if account_result['records']:
-            account = account_result['records'][0]
+        if account_records:
+            account = account_records[0]
             if (account['RecordType']['DeveloperName'] == 'Retailer_Branch' and 
                 account.get('Parent') and account['Parent'].get('Name')):
                 # Use parent account name for branches
                 opportunity_account_name = account['Parent']['Name']
-                print(f"[DEBUG] Branch detected, using parent account: {opportunity_account_name}")
+                logger.debug("Branch detected, using parent account: %s", opportunity_account_name)
             else:
                 # Use retailer name as-is for regular retailers
                 opportunity_account_name = retailer_name
@@ -106,8 +275,156 @@ class RateCardGenerator:
             # Fallback to retailer name if account not found
             opportunity_account_name = retailer_name
         
-        # Step 1: Query Assigned_Rate_Card__c records to get positions and opportunity IDs
+        return opportunity_account_name
+    
+    def get_data_fingerprint(self, retailer_name: str) -> str:
+        """Return a strong validator for the Salesforce data behind a rate card
+        
+        Hashes the Id and SystemModstamp of every live Assigned_Rate_Card__c and
+        active OpportunityLineItem for the retailer, plus the SystemModstamp of the
+        Opportunity and Product2 each line item reads from. Any edit, addition or
+        removal of those records changes the fingerprint. It costs two light
+        queries instead of the full per-opportunity fetch.
+        """
+        opportunity_account_name = self._resolve_opportunity_account(retailer_name)
+        if self.extract is not None:
+            return self._fingerprint(retailer_name, opportunity_account_name,
+                                     *self.extract.fingerprint_inputs(retailer_name, opportunity_account_name))
+        arc_query, oli_query = self._fingerprint_queries(retailer_name, opportunity_account_name)
+        return self._fingerprint(retailer_name, opportunity_account_name,
+                                 self._query_all(arc_query, 'fingerprint_arc')['records'],
+                                 self._query_all(oli_query, 'fingerprint_oli')['records'])
+    
+    def _fingerprint_queries(self, retailer_name: str, opportunity_account_name: str) -> Tuple[str, str]:
+        """SOQL for the Id and SystemModstamps of the assigned rate cards and of their line items"""
+        arc_filter = f"""
+            Retailer__r.Name = '{retailer_name}'
+            AND Active__c = true
+            AND Opportunity__r.Account.Name = '{opportunity_account_name}'
+            AND Opportunity__r.RecordType.DeveloperName = 'Retailer_Rate_Card'
+            AND Opportunity__r.StageName = 'Live'
+        """
         arc_query = f"""
+        SELECT Id, SystemModstamp
+        FROM Assigned_Rate_Card__c
+        WHERE {arc_filter}
+        """
+        oli_query = f"""
+        SELECT Id, SystemModstamp, Opportunity.SystemModstamp, Product2.SystemModstamp
+        FROM OpportunityLineItem
+        WHERE
+            OpportunityId IN (SELECT Opportunity__c FROM Assigned_Rate_Card__c WHERE {arc_filter})
+            AND Active__c = true
+        """
+        return arc_query, oli_query
+    
+    def _fingerprint(self, retailer_name: str, opportunity_account_name: str, arc_records: List[Dict],
+                     oli_records: List[Dict]) -> str:
+        parts = [retailer_name, opportunity_account_name]
+        for record in arc_records:
+            parts.append(f"arc:{record.get('Id')}:{record.get('SystemModstamp')}")
+        for record in oli_records:
+            opportunity = record.get('Opportunity') or {}
+            product = record.get('Product2') or {}
+            parts.append(f"oli:{record.get('Id')}:{record.get('SystemModstamp')}:"
+                         f"{opportunity.get('SystemModstamp')}:{product.get('SystemModstamp')}")
+        
+        # Sort so the fingerprint doesn't depend on query result order
+        return hashlib.sha256('\n'.join(sorted(parts)).encode('utf-8')).hexdigest()
+    
+    def get_rate_card_items(self, retailer_name: str, progress: Optional[Callable] = None) -> pd.DataFrame:
+        """Get rate card items with position data using two-step approach
+        
+        Args:
+            retailer_name: Exact retailer account name
+            progress: Optional callback ``progress(stage, **data)`` notified as each
+                      Salesforce step completes (account_resolved, arc_count, oli_batch)
+        """
+        items = sorted(self.iter_rate_card_items(retailer_name, progress), key=lambda item: item[0])
+        logger.debug("Total flattened records: %d", len(items))
+        return pd.DataFrame([flat_record for _, flat_record in items])
+    
+    def iter_rate_card_items(self, retailer_name: str, progress: Optional[Callable] = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """Yield ``(order, flat_record)`` for each rate card item as its query page arrives
+        
+        Items come in fetch order, which depends on the query plan; sorting by
+        ``order`` gives assigned rate card order, as get_rate_card_items returns.
+        Only one page of Salesforce records is held at a time.
+        """
+        opportunity_account_name = self._resolve_opportunity_account(retailer_name)
+        
+        self._report(progress, 'account_resolved',
+                     retailer=retailer_name,
+                     account=opportunity_account_name,
+                     is_branch=opportunity_account_name != retailer_name)
+        
+        if self.extract is not None:
+            yield from self._iter_extract_items(retailer_name, opportunity_account_name, progress)
+            return
+        
+        # Step 1: Query Assigned_Rate_Card__c records to get positions and opportunity IDs
+        try:
+            arc_results = self._query_all(self._arc_query(retailer_name, opportunity_account_name),
+                                          'assigned_rate_cards')
+            logger.debug("Found %d assigned rate card records", len(arc_results['records']))
+        except SalesforceUnavailable:
+            # An outage would only fail the heavier fallback queries too
+            raise
+        except Exception as e:
+            logger.error("Assigned rate card query failed: %s", e)
+            fallback_df = self._get_rate_card_items_fallback(retailer_name, opportunity_account_name)
+            for index, flat_record in enumerate(fallback_df.to_dict('records')):
+                yield (index, 0), flat_record
+            return
+        
+        opportunity_ids = {r.get('Opportunity__c') for r in arc_results['records']}
+        self._report(progress, 'arc_count',
+                     count=len(arc_results['records']),
+                     opportunities=len(opportunity_ids))
+        
+        if not arc_results['records']:
+            logger.warning("No assigned rate cards found for %s", retailer_name)
+            return
+        
+        # Step 2: Fetch the OpportunityLineItem records of every assigned opportunity,
+        # using the first ARC record of each opportunity for its position data
+        arc_by_opportunity = self._arc_by_opportunity(arc_results['records'])
+        opportunity_ids = list(arc_by_opportunity)
+        arc_order = {opportunity_id: index for index, opportunity_id in enumerate(opportunity_ids)}
+        
+        plan = self._plan_line_items(opportunity_account_name, opportunity_ids)
+        with stage('line_items', plan=plan['strategy']):
+            line_items = self._iter_line_items(plan, opportunity_account_name, opportunity_ids, progress)
+            for sequence, oli_record in enumerate(line_items):
+                opportunity_id = oli_record['OpportunityId']
+                flat_record = self._flatten_line_item(oli_record, arc_by_opportunity[opportunity_id])
+                if flat_record is not None:
+                    yield (arc_order[opportunity_id], sequence), flat_record
+        self._finish_plan(retailer_name, plan)
+    
+    def _iter_extract_items(self, retailer_name: str, opportunity_account_name: str,
+                            progress: Optional[Callable] = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """``iter_rate_card_items`` answered from the bulk extract, in the same order"""
+        arc_records = self.extract.assigned_rate_cards(retailer_name, opportunity_account_name)
+        self._report(progress, 'arc_count',
+                     count=len(arc_records),
+                     opportunities=len({r.get('Opportunity__c') for r in arc_records}))
+        if not arc_records:
+            logger.warning("No assigned rate cards found for %s", retailer_name)
+            return
+        
+        arc_by_opportunity = self._arc_by_opportunity(arc_records)
+        arc_order = {opportunity_id: index for index, opportunity_id in enumerate(arc_by_opportunity)}
+        with stage('line_items', plan='bulk_extract'):
+            for sequence, oli_record in enumerate(self.extract.line_items(arc_by_opportunity)):
+                opportunity_id = oli_record['OpportunityId']
+                flat_record = self._flatten_line_item(oli_record, arc_by_opportunity[opportunity_id])
+                if flat_record is not None:
+                    yield (arc_order[opportunity_id], sequence), flat_record
+    
+    def _arc_query(self, retailer_name: str, opportunity_account_name: str) -> str:
+        """SOQL for the retailer's live assigned rate cards with their positions"""
+        return f"""
         SELECT
             Id,
             Opportunity__c,
@@ -128,88 +445,191 @@ class RateCardGenerator:
             Opportunity__r.Lender_Company__r.Name,
             Opportunity__r.Approved_Product__r.Name
         """
+    
+    def _arc_by_opportunity(self, arc_records: List[Dict]) -> Dict[str, Dict]:
+        """The first ARC record of each opportunity, in ARC order"""
+        arc_by_opportunity = {}
+        for arc_record in arc_records:
+            arc_by_opportunity.setdefault(arc_record.get('Opportunity__c'), arc_record)
+        return arc_by_opportunity
+    
+    def _finish_plan(self, retailer_name: str, plan: Dict):
+        self.last_plan = plan
+        query_planner.plan_log.record(retailer_name, plan)
+        logger.debug("Line item plan for %s: %s, %s", retailer_name, plan['strategy'], plan['actual'])
+    
+    def _flatten_line_item(self, oli_record: Dict, arc_record: Dict) -> Optional[Dict]:
+        """One rate card item from a line item and its ARC record, or None if it must be skipped"""
+        try:
+            flat_record = {
+                'Opportunity_Id': oli_record.get('OpportunityId'),
+                'Lender_Name': oli_record['Opportunity']['Lender_Company__r']['Name'] if oli_record.get('Opportunity') and oli_record['Opportunity'].get('Lender_Company__r') else None,
+                'Product_Vertical': oli_record['Opportunity']['Approved_Product__r']['Name'] if oli_record.get('Opportunity') and oli_record['Opportunity'].get('Approved_Product__r') else None,
+                'Commission': oli_record['Opportunity']['Shermin_Commission__c'] if oli_record.get('Opportunity') else None,
+                'Product_Name': oli_record['Product2']['Name'] if oli_record.get('Product2') else None,
+                'APR': oli_record['Product2']['APR__c'] if oli_record.get('Product2') else None,
+                'Term': oli_record['Product2']['Term__c'] if oli_record.get('Product2') else None,
+                'Product_Code': oli_record['Product2']['ProductCode'] if oli_record.get('Product2') else None,
+                'Deferred_Period': oli_record['Product2']['Deferred_Period__c'] if oli_record.get('Product2') else None,
+                'Subsidy': oli_record.get('Retailer_Subsidy__c', 0),
+                'Retailer_Commission': oli_record.get('Retailer_Commission__c', 0),
+                # Attach position data from the corresponding Assigned_Rate_Card__c record
+                'Prime_SubPrime': arc_record.get('Prime_SubPrime__c'),
+                'Prime_Position': arc_record.get('Prime_Lender_Position__c'),
+                'SubPrime_Position': arc_record.get('Sub_Prime_Lender_Position__c')
+            }
+        except Exception as e:
+            logger.error("Failed to process line item: %s (record: %s)", e, oli_record, extra=RATE_LIMITED)
+            return None
+        
+        # Only keep records that have essential data
+        if flat_record['Lender_Name'] and flat_record['Product_Vertical']:
+            return flat_record
+        logger.warning("Skipping record with missing lender or product vertical: %s", flat_record,
+                       extra=RATE_LIMITED)
+        return None
+    
+    def _line_item_query(self, where: str) -> str:
+        """SOQL for the OpportunityLineItem fields a rate card reads"""
+        return f"""
+        SELECT
+            Id,
+            OpportunityId,
+            Opportunity.Lender_Company__r.Name,
+            Opportunity.Approved_Product__r.Name,
+            Opportunity.Shermin_Commission__c,
+            Product2.Name,
+            Product2.APR__c,
+            Product2.Term__c,
+            Product2.ProductCode,
+            Product2.Deferred_Period__c,
+            Retailer_Subsidy__c,
+            Retailer_Commission__c
+        FROM OpportunityLineItem
+        WHERE
+            {where}
+            AND Active__c = true
+        """
+    
+    def _account_line_item_filter(self, opportunity_account_name: str) -> str:
+        return f"""Opportunity.Account.Name = '{opportunity_account_name}'
+            AND Opportunity.RecordType.DeveloperName = 'Retailer_Rate_Card'
+            AND Opportunity.StageName = 'Live'"""
+    
+    def _plan_line_items(self, opportunity_account_name: str, opportunity_ids: List[str]) -> Dict:
+        """Choose how to fetch line items (see query_planner), pre-counting them if it's worth it"""
+        if not query_planner.needs_counts(len(opportunity_ids)):
+            return query_planner.choose(len(opportunity_ids))
         
         try:
-            arc_results = self.sf.query_all(arc_query)
-            print(f"[DEBUG] Found {len(arc_results['records'])} assigned rate card records")
+            counts = self._query(self._line_item_count_query(opportunity_account_name), 'line_item_counts')['records']
+        except SalesforceUnavailable:
+            raise
         except Exception as e:
-            print(f"[ERROR] Assigned rate card query failed: {e}")
-            return self._get_rate_card_items_fallback(retailer_name, opportunity_account_name)
+            logger.warning("Line item pre-count failed, planning without it: %s", e)
+            return query_planner.choose(len(opportunity_ids))
+        return self._plan_from_counts(opportunity_ids, counts)
+    
+    def _line_item_count_query(self, opportunity_account_name: str) -> str:
+        # One grouped COUNT gives both the rows needed and the size of the whole account
+        return f"""
+        SELECT OpportunityId, COUNT(Id)
+        FROM OpportunityLineItem
+        WHERE
+            {self._account_line_item_filter(opportunity_account_name)}
+            AND Active__c = true
+        GROUP BY OpportunityId
+        """
+    
+    def _plan_from_counts(self, opportunity_ids: List[str], count_records: List[Dict]) -> Dict:
+        counts = {r['OpportunityId']: r['expr0'] for r in count_records}
+        needed_rows = sum(counts.get(opportunity_id, 0) for opportunity_id in opportunity_ids)
+        return query_planner.choose(len(opportunity_ids), needed_rows, sum(counts.values()))
+    
+    def _iter_line_items(self, plan: Dict, opportunity_account_name: str, opportunity_ids: List[str],
+                         progress: Optional[Callable] = None) -> Iterator[Dict]:
+        """Run the plan's queries, yielding the line items of ``opportunity_ids`` page by page
         
-        if not arc_results['records']:
-            print(f"[WARNING] No assigned rate cards found for {retailer_name}")
-            return pd.DataFrame()
+        Adds the actual cost (queries, API calls including pages, rows fetched
+        and used, seconds) to ``plan['actual']`` once exhausted. A query that
+        fails on its first page is skipped (or, account-wide, replaced by
+        batches); one that fails after records were yielded raises, as those
+        can't be taken back. Salesforce outages always raise.
+        """
+        started = time.perf_counter()
+        wanted = set(opportunity_ids)
+        actual = {'queries': 0, 'calls': 0, 'rows_fetched': 0, 'rows_used': 0}
         
-        # Step 2: For each unique opportunity, get its OpportunityLineItem records
-        flattened_records = []
-        processed_opportunities = set()
+        def run(soql, label):
+            actual['queries'] += 1
+            for records in self._query_pages(soql, label):
+                actual['calls'] += 1
+                actual['rows_fetched'] += len(records)
+                for record in records:
+                    if record.get('OpportunityId') in wanted:
+                        actual['rows_used'] += 1
+                        yield record
         
-        for arc_record in arc_results['records']:
+        if plan['strategy'] == 'account_wide':
             try:
-                opportunity_id = arc_record.get('Opportunity__c')
-                if opportunity_id in processed_opportunities:
-                    continue
-                processed_opportunities.add(opportunity_id)
-                
-                # Get OpportunityLineItem records for this specific opportunity
-                oli_query = f"""
-                SELECT
-                    Id,
-                    OpportunityId,
-                    Opportunity.Lender_Company__r.Name,
-                    Opportunity.Approved_Product__r.Name,
-                    Opportunity.Shermin_Commission__c,
-                    Product2.Name,
-                    Product2.APR__c,
-                    Product2.Term__c,
-                    Product2.ProductCode,
-                    Product2.Deferred_Period__c,
-                    Retailer_Subsidy__c,
-                    Retailer_Commission__c
-                FROM OpportunityLineItem
-                WHERE
-                    OpportunityId = '{opportunity_id}'
-                    AND Active__c = true
-                """
-                
-                oli_results = self.sf.query_all(oli_query)
-                print(f"[DEBUG] Opportunity {opportunity_id}: {len(oli_results['records'])} line items")
-                
-                for oli_record in oli_results['records']:
-                    flat_record = {
-                        'Opportunity_Id': oli_record.get('OpportunityId'),
-                        'Lender_Name': oli_record['Opportunity']['Lender_Company__r']['Name'] if oli_record.get('Opportunity') and oli_record['Opportunity'].get('Lender_Company__r') else None,
-                        'Product_Vertical': oli_record['Opportunity']['Approved_Product__r']['Name'] if oli_record.get('Opportunity') and oli_record['Opportunity'].get('Approved_Product__r') else None,
-                        'Commission': oli_record['Opportunity']['Shermin_Commission__c'] if oli_record.get('Opportunity') else None,
-                        'Product_Name': oli_record['Product2']['Name'] if oli_record.get('Product2') else None,
-                        'APR': oli_record['Product2']['APR__c'] if oli_record.get('Product2') else None,
-                        'Term': oli_record['Product2']['Term__c'] if oli_record.get('Product2') else None,
-                        'Product_Code': oli_record['Product2']['ProductCode'] if oli_record.get('Product2') else None,
-                        'Deferred_Period': oli_record['Product2']['Deferred_Period__c'] if oli_record.get('Product2') else None,
-                        'Subsidy': oli_record.get('Retailer_Subsidy__c', 0),
-                        'Retailer_Commission': oli_record.get('Retailer_Commission__c', 0),
-                        # Attach position data from the corresponding Assigned_Rate_Card__c record
-                        'Prime_SubPrime': arc_record.get('Prime_SubPrime__c'),
-                        'Prime_Position': arc_record.get('Prime_Lender_Position__c'),
-                        'SubPrime_Position': arc_record.get('Sub_Prime_Lender_Position__c')
-                    }
-                    
-                    # Only add records that have essential data
-                    if flat_record['Lender_Name'] and flat_record['Product_Vertical']:
-                        flattened_records.append(flat_record)
-                    else:
-                        print(f"[WARNING] Skipping record with missing lender or product vertical: {flat_record}")
-                        
+                yield from run(self._line_item_query(self._account_line_item_filter(opportunity_account_name)),
+                               'line_items_account')
+                self._report(progress, 'oli_batch',
+                             opportunities=len(opportunity_ids),
+                             line_items=actual['rows_used'],
+                             fetched=len(opportunity_ids),
+                             total=len(opportunity_ids))
+            except SalesforceUnavailable:
+                raise
             except Exception as e:
-                print(f"[ERROR] Failed to process ARC record: {e}")
-                print(f"[ERROR] Record data: {arc_record}")
+                if actual['rows_used']:
+                    raise
+                logger.error("Account-wide line item query failed, fetching in batches: %s", e)
+                plan['fallback_from'] = plan['strategy']
+                plan['strategy'] = 'batched'
         
-        print(f"[DEBUG] Total flattened records: {len(flattened_records)}")
-        return pd.DataFrame(flattened_records)
+        if plan['strategy'] != 'account_wide':
+            for start, batch, soql, label in self._line_item_batches(plan, opportunity_ids):
+                used_before = actual['rows_used']
+                try:
+                    yield from run(soql, label)
+                except SalesforceUnavailable:
+                    # Skipping would pass off a partial rate card as complete
+                    raise
+                except Exception as e:
+                    if actual['rows_used'] != used_before:
+                        raise
+                    # One failed query loses those opportunities, not the whole rate card
+                    logger.error("Line item query failed for %d opportunities: %s", len(batch), e,
+                                 extra=RATE_LIMITED)
+                    continue
+                line_items = actual['rows_used'] - used_before
+                logger.debug("Opportunities %s: %d line items", batch[0] if len(batch) == 1 else len(batch),
+                             line_items)
+                self._report(progress, 'oli_batch',
+                             opportunity_id=batch[0] if len(batch) == 1 else None,
+                             opportunities=len(batch),
+                             line_items=line_items,
+                             fetched=start + len(batch),
+                             total=len(opportunity_ids))
+        
+        actual['seconds'] = round(time.perf_counter() - started, 3)
+        plan['actual'] = actual
+    
+    def _line_item_batches(self, plan: Dict, opportunity_ids: List[str]) -> Iterator[Tuple[int, List[str], str, str]]:
+        """(start, opportunity IDs, SOQL, label) of each line item query of a per-opportunity or batched plan"""
+        batch_size = 1 if plan['strategy'] == 'per_opportunity' else plan['batch_size']
+        for start in range(0, len(opportunity_ids), batch_size):
+            batch = opportunity_ids[start:start + batch_size]
+            if len(batch) == 1:
+                yield start, batch, self._line_item_query(f"OpportunityId = '{batch[0]}'"), 'line_items'
+            else:
+                id_list = ', '.join(f"'{opportunity_id}'" for opportunity_id in batch)
+                yield start, batch, self._line_item_query(f"OpportunityId IN ({id_list})"), 'line_items_batch'
     
     def _get_rate_card_items_fallback(self, retailer_name: str, opportunity_account_name: str) -> pd.DataFrame:
         """Fallback method using the original approach if main query fails"""
-        print("[DEBUG] Using fallback method with separate queries")
+        logger.debug("Using fallback method with separate queries")
         
         try:
             # Use the original approach: get rate items and priorities separately, then merge
@@ -217,7 +637,7 @@ class RateCardGenerator:
             priorities_df = self.get_assigned_priorities(retailer_name)
             
             if rate_items_df.empty or priorities_df.empty:
-                print("[WARNING] Either rate items or priorities is empty in fallback")
+                logger.warning("Either rate items or priorities is empty in fallback")
                 return pd.DataFrame()
             
             # Merge with opportunity ID to ensure exact matching
@@ -228,11 +648,13 @@ class RateCardGenerator:
                 how='inner'
             )
             
-            print(f"[DEBUG] Fallback merge resulted in {len(merged_df)} records")
+            logger.debug("Fallback merge resulted in %d records", len(merged_df))
             return merged_df
             
+        except SalesforceUnavailable:
+            raise
         except Exception as e:
-            print(f"[ERROR] Fallback method failed: {e}")
+            logger.error("Fallback method failed: %s", e)
             return pd.DataFrame()
     
     def _get_rate_card_items_simple(self, retailer_name: str, opportunity_account_name: str) -> pd.DataFrame:
@@ -262,8 +684,8 @@ class RateCardGenerator:
             Opportunity.Approved_Product__r.Name
         """
         
-        results = self.sf.query_all(query)
-        print(f"[DEBUG] Simple query returned {len(results['records'])} opportunity line items")
+        results = self._query_all(query, 'line_items_simple')
+        logger.debug("Simple query returned %d opportunity line items", len(results['records']))
         
         # Flatten nested Salesforce response
         flattened_records = []
@@ -286,10 +708,9 @@ class RateCardGenerator:
                 if flat_record['Lender_Name'] and flat_record['Product_Vertical']:
                     flattened_records.append(flat_record)
                 else:
-                    print(f"[WARNING] Skipping item record with missing data: {flat_record}")
+                    logger.warning("Skipping item record with missing data: %s", flat_record, extra=RATE_LIMITED)
             except Exception as e:
-                print(f"[ERROR] Failed to process item record: {e}")
-                print(f"[ERROR] Record data: {record}")
+                logger.error("Failed to process item record: %s (record: %s)", e, record, extra=RATE_LIMITED)
         
         return pd.DataFrame(flattened_records)
     
@@ -313,17 +734,17 @@ class RateCardGenerator:
             Opportunity__r.Approved_Product__r.Name
         """
         
-        results = self.sf.query_all(query)
-        print(f"[DEBUG] Query returned {len(results['records'])} assigned priorities")
+        results = self._query_all(query, 'assigned_priorities')
+        logger.debug("Query returned %d assigned priorities", len(results['records']))
         
-        # Debug: Log JN Bank assigned priorities
-        for record in results['records']:
-            lender_name = record.get('Opportunity__r', {}).get('Lender_Company__r', {}).get('Name', 'Unknown') if record.get('Opportunity__r') else 'Unknown'
-            if 'JN' in lender_name.upper():
-                product_vertical = record.get('Opportunity__r', {}).get('Approved_Product__r', {}).get('Name', 'Unknown') if record.get('Opportunity__r') else 'Unknown'
-                prime_position = record.get('Prime_Lender_Position__c', 'None')
-                subprime_position = record.get('Sub_Prime_Lender_Position__c', 'None')
-                print(f"[DEBUG] Assigned: {lender_name} - {product_vertical} - Prime:{prime_position} SubPrime:{subprime_position}")
+        # Debug: Log JN Bank assigned priorities (skip the extra pass unless DEBUG is on)
+        if logger.isEnabledFor(logging.DEBUG):
+            for record in results['records']:
+                lender_name = record.get('Opportunity__r', {}).get('Lender_Company__r', {}).get('Name', 'Unknown') if record.get('Opportunity__r') else 'Unknown'
+                if 'JN' in lender_name.upper():
+                    product_vertical = record.get('Opportunity__r', {}).get('Approved_Product__r', {}).get('Name', 'Unknown') if record.get('Opportunity__r') else 'Unknown'
+                    logger.debug("Assigned: %s - %s - Prime:%s SubPrime:%s", lender_name, product_vertical,
+                                 record.get('Prime_Lender_Position__c', 'None'), record.get('Sub_Prime_Lender_Position__c', 'None'))
         
         # Flatten nested Salesforce response
         flattened_records = []
@@ -343,120 +764,198 @@ class RateCardGenerator:
                 if flat_record['Lender_Name'] and flat_record['Product_Vertical']:
                     flattened_records.append(flat_record)
                 else:
-                    print(f"[WARNING] Skipping priority record with missing data: {flat_record}")
+                    logger.warning("Skipping priority record with missing data: %s", flat_record, extra=RATE_LIMITED)
             except Exception as e:
-                print(f"[ERROR] Failed to process priority record: {e}")
-                print(f"[ERROR] Record data: {record}")
+                logger.error("Failed to process priority record: %s (record: %s)", e, record, extra=RATE_LIMITED)
         
         return pd.DataFrame(flattened_records)
     
-    def process_rate_cards(self, retailer_name: str) -> Dict[str, pd.DataFrame]:
-        """Process rate card data with embedded position information"""
-        # Get data with position information already included
-        rate_items_df = self.get_rate_card_items(retailer_name)
+    def process_rate_cards(self, retailer_name: str, progress: Optional[Callable] = None) -> Dict[str, pd.DataFrame]:
+        """Process rate card data with embedded position information
+        
+        Args:
+            retailer_name: Exact retailer account name
+            progress: Optional callback ``progress(stage, **data)``. In addition to the
+                      Salesforce stages it receives render_started, one vertical event
+                      per finished product vertical (with its DataFrame) and render_finished
+        """
+        return dict(self.iter_rate_cards(retailer_name, progress))
+    
+    def iter_rate_cards(self, retailer_name: str, progress: Optional[Callable] = None,
+                        previous: Optional[Dict[str, Dict]] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """Yield (product vertical, DataFrame) pairs as each vertical finishes processing
+        
+        Salesforce data is fetched before the first vertical is yielded, but each
+        vertical is only formatted when the caller asks for it, so a streaming
+        response can send the first table while the rest are still being built.
+        
+        Line items are consumed page by page and routed straight into per-vertical
+        buffers that keep only the first item of each rate card row (what
+        _process_vertical shows), so memory grows with the rows of the rate card,
+        not with the number of line items behind them.
+        
+        ``previous`` maps verticals to ``{'inputs': digest, 'rows': [...]}`` from the
+        last snapshot (see rate_card_snapshots). A vertical whose line items still
+        have that digest is rebuilt from its rows instead of being processed again.
+        Each vertical event carries its ``inputs`` digest and whether it was ``reused``.
+        """
+        buffers = self._new_buffers()
+        for order, flat_record in self.iter_rate_card_items(retailer_name, progress):
+            self._buffer_item(buffers, order, flat_record)
+        yield from self._iter_buffered_rate_cards(retailer_name, buffers, progress, previous)
+    
+    def _new_buffers(self) -> Dict:
+        return {
+            'verticals': {},  # vertical -> {row key: (order, flat_record)}
+            'first_seen': {},  # vertical -> order of its first item
+            'line_items': 0,
+        }
+    
+    def _buffer_item(self, buffers: Dict, order: Tuple, flat_record: Dict):
+        """Keep ``flat_record`` if it comes before the item buffered for its rate card row
+        
+        Items may arrive in any order; the one with the lowest ``order`` wins.
+        """
+        buffers['line_items'] += 1
+        vertical = flat_record['Product_Vertical']
+        if pd.isna(vertical):
+            return
+        buffer = buffers['verticals'].setdefault(vertical, {})
+        first_seen = buffers['first_seen']
+        if vertical not in first_seen or order < first_seen[vertical]:
+            first_seen[vertical] = order
+        
+        # The columns _process_vertical groups by; like groupby, items with a missing key are dropped
+        key = (flat_record['Lender_Name'], self._format_position(flat_record), flat_record['Term'],
+               flat_record['Product_Code'], flat_record['Deferred_Period'])
+        if any(pd.isna(value) for value in key):
+            return
+        if key not in buffer or order < buffer[key][0]:
+            buffer[key] = (order, flat_record)
+    
+    def _iter_buffered_rate_cards(self, retailer_name: str, buffers: Dict, progress: Optional[Callable] = None,
+                                  previous: Optional[Dict[str, Dict]] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """Process the buffered verticals one by one (see ``iter_rate_cards``)"""
+        line_items = buffers['line_items']
+        first_seen = buffers['first_seen']
+        by_vertical = buffers['verticals']
         
         # Log data counts for debugging
-        print(f"\n[DEBUG] Rate items with positions found: {len(rate_items_df)}")
+        logger.debug("Rate items with positions found: %d", line_items)
+        
+        if not line_items:
+            logger.warning("No rate card items found for %s", retailer_name)
+            return
         
-        if rate_items_df.empty:
-            print(f"[WARNING] No rate card items found for {retailer_name}")
-            return {}
+        # Verticals in order of their first item, as in get_rate_card_items
+        verticals = sorted(by_vertical, key=first_seen.get)
+        logger.debug("Processing data: %d rows", line_items)
+        logger.debug("Unique product verticals: %s", verticals)
         
-        # No merge needed - position data is already included
-        merged_df = rate_items_df.copy()
+        self._report(progress, 'render_started', verticals=len(verticals), rows=line_items)
+        processed = 0
+        total_rows = 0
+        for vertical in verticals:
+            # Release each buffer as its vertical is built
+            items = sorted(by_vertical.pop(vertical).values(), key=lambda item: item[0])
+            records = [flat_record for _, flat_record in items]
+            inputs = rate_card_snapshots.inputs_digest(records)
+            snapshot = (previous or {}).get(vertical)
+            reused = snapshot is not None and snapshot['inputs'] == inputs
+            
+            if reused:
+                result_df = pd.DataFrame(snapshot['rows'])
+            else:
+                with stage('process_vertical', vertical=vertical):
+                    # A vertical whose items all lack a row key still gets its (empty) table
+                    result_df = self._process_vertical(vertical, pd.DataFrame(records)) if records else pd.DataFrame()
+            processed += 1
+            total_rows += len(result_df)
+            logger.debug("%s %s: %d entries", 'Reused' if reused else 'Processed', vertical, len(result_df))
+            self._report(progress, 'vertical', vertical=vertical, data=result_df,
+                         processed=processed, total=len(verticals), inputs=inputs, reused=reused)
+            yield vertical, result_df
         
-        print(f"[DEBUG] Processing data: {len(merged_df)} rows")
-        print(f"[DEBUG] Unique product verticals: {merged_df['Product_Vertical'].unique()}")
+        self._report(progress, 'render_finished', verticals=processed, rows=total_rows)
+    
+    def _process_vertical(self, vertical: str, group_df: pd.DataFrame) -> pd.DataFrame:
+        """Format, de-duplicate and sort the line items of one product vertical"""
+        logger.debug("Processing %s with %d rows", vertical, len(group_df))
         
-        # Process each product vertical separately
-        processed_data = {}
-        for vertical in merged_df['Product_Vertical'].unique():
-            if pd.isna(vertical):
-                continue
-                
-            group_df = merged_df[merged_df['Product_Vertical'] == vertical].copy()
+        # Check for missing position data
+        missing_positions = group_df[
+            (group_df['Prime_Position'].isna() | (group_df['Prime_Position'] == '')) & 
+            (group_df['SubPrime_Position'].isna() | (group_df['SubPrime_Position'] == ''))
+        ]
+        if not missing_positions.empty:
+            logger.warning("%d rows missing position data for %s", len(missing_positions), vertical)
+            # Don't skip - we want to show all rate card items
+        
+        # Calculate position and format data
+        group_df['Position'] = group_df.apply(self._format_position, axis=1)
+        group_df['Commission'] = group_df['Commission'].apply(lambda x: f"{float(x):.2f}%" if pd.notna(x) and x != 0 else "0.00%")
+        
+        # New subsidy logic: show negative retailer commission if subsidy is 0/blank
+        def format_subsidy(row):
+            subsidy = row['Subsidy'] if pd.notna(row['Subsidy']) else 0
+            retailer_commission = row['Retailer_Commission'] if pd.notna(row['Retailer_Commission']) else 0
             
-            if not group_df.empty:
-                print(f"[DEBUG] Processing {vertical} with {len(group_df)} rows")
-                
-                # Check for missing position data
-                missing_positions = group_df[
-                    (group_df['Prime_Position'].isna() | (group_df['Prime_Position'] == '')) & 
-                    (group_df['SubPrime_Position'].isna() | (group_df['SubPrime_Position'] == ''))
-                ]
-                if not missing_positions.empty:
-                    print(f"[WARNING] {len(missing_positions)} rows missing position data for {vertical}")
-                    # Don't skip - we want to show all rate card items
-                
-                # Calculate position and format data
-                group_df['Position'] = group_df.apply(self._format_position, axis=1)
-                group_df['Commission'] = group_df['Commission'].apply(lambda x: f"{float(x):.2f}%" if pd.notna(x) and x != 0 else "0.00%")
-                
-                # New subsidy logic: show negative retailer commission if subsidy is 0/blank
-                def format_subsidy(row):
-                    subsidy = row['Subsidy'] if pd.notna(row['Subsidy']) else 0
-                    retailer_commission = row['Retailer_Commission'] if pd.notna(row['Retailer_Commission']) else 0
-                    
-                    if subsidy > 0:
-                        return f"{float(subsidy):.2f}%"
-                    elif retailer_commission > 0:
-                        return f"-{float(retailer_commission):.2f}%"
-                    else:
-                        return "0%"
-                
-                group_df['Subsidy'] = group_df.apply(format_subsidy, axis=1)
-                
-                # Create individual rows for each unique combination
-                result_data = []
-                
-                # Group by key characteristics to avoid duplicates while showing individual APRs
-                # Don't group by Commission, Subsidy, or Retailer_Commission as these are derived fields
-                grouped = group_df.groupby(['Lender_Name', 'Position', 'Term', 'Product_Code', 'Deferred_Period'])
-                
-                for (lender, position, term, product_code, deferred_period), term_group in grouped:
-                    # Get the first row for this unique combination
-                    first_row = term_group.iloc[0]
-                    
-                    # Get commission and subsidy from the first row
-                    commission = first_row['Commission']
-                    subsidy = first_row['Subsidy']
-                    
-                    # Format individual APR value (not a range)
-                    apr_value = f"{float(first_row['APR']):.1f}%" if pd.notna(first_row['APR']) else ""
-                    
-                    # Format term
-                    term_str = f"{int(term)} months" if pd.notna(term) else ""
-                    
-                    # Format deferred period
-                    deferred_period_str = f"{int(deferred_period)} months" if pd.notna(deferred_period) and deferred_period > 0 else ""
-                    
-                    # Get product code
-                    product_code_str = product_code if pd.notna(product_code) else ""
-                    
-                    result_data.append({
-                        'Lender_Name': lender,
-                        'Position': position,
-                        'Shermin_Commission': commission,
-                        'Term': term_str,
-                        'Product_Type': product_code_str,
-                        'Deferred_Period': deferred_period_str,
-                        'APR_Range': apr_value,
-                        'Subsidy': subsidy
-                    })
-                
-                result_df = pd.DataFrame(result_data)
-                
-                # Sort by position, lender, and term
-                if not result_df.empty:
-                    result_df['sort_order'] = result_df['Position'].apply(self._position_sort_key)
-                    result_df['term_numeric'] = result_df['Term'].str.extract(r'(\d+)').astype(float)
-                    result_df = result_df.sort_values(['sort_order', 'Lender_Name', 'term_numeric']).drop(['sort_order', 'term_numeric'], axis=1)
-                
-                # Store with product vertical name as key
-                processed_data[vertical] = result_df
-                print(f"[DEBUG] Processed {vertical}: {len(result_df)} entries")
-        
-        return processed_data
+            if subsidy > 0:
+                return f"{float(subsidy):.2f}%"
+            elif retailer_commission > 0:
+                return f"-{float(retailer_commission):.2f}%"
+            else:
+                return "0%"
+        
+        group_df['Subsidy'] = group_df.apply(format_subsidy, axis=1)
+        
+        # Create individual rows for each unique combination
+        result_data = []
+        
+        # Group by key characteristics to avoid duplicates while showing individual APRs
+        # Don't group by Commission, Subsidy, or Retailer_Commission as these are derived fields
+        grouped = group_df.groupby(['Lender_Name', 'Position', 'Term', 'Product_Code', 'Deferred_Period'])
+        
+        for (lender, position, term, product_code, deferred_period), term_group in grouped:
+            # Get the first row for this unique combination
+            first_row = term_group.iloc[0]
+            
+            # Get commission and subsidy from the first row
+            commission = first_row['Commission']
+            subsidy = first_row['Subsidy']
+            
+            # Format individual APR value (not a range)
+            apr_value = f"{float(first_row['APR']):.1f}%" if pd.notna(first_row['APR']) else ""
+            
+            # Format term
+            term_str = f"{int(term)} months" if pd.notna(term) else ""
+            
+            # Format deferred period
+            deferred_period_str = f"{int(deferred_period)} months" if pd.notna(deferred_period) and deferred_period > 0 else ""
+            
+            # Get product code
+            product_code_str = product_code if pd.notna(product_code) else ""
+            
+            result_data.append({
+                'Lender_Name': lender,
+                'Position': position,
+                'Shermin_Commission': commission,
+                'Term': term_str,
+                'Product_Type': product_code_str,
+                'Deferred_Period': deferred_period_str,
+                'APR_Range': apr_value,
+                'Subsidy': subsidy
+            })
+        
+        result_df = pd.DataFrame(result_data)
+        
+        # Sort by position, lender, and term
+        if not result_df.empty:
+            result_df['sort_order'] = result_df['Position'].apply(self._position_sort_key)
+            result_df['term_numeric'] = result_df['Term'].str.extract(r'(\d+)').astype(float)
+            result_df = result_df.sort_values(['sort_order', 'Lender_Name', 'term_numeric']).drop(['sort_order', 'term_numeric'], axis=1)
+        
+        return result_df
     
     def _format_position(self, row):
         """Format position string"""
@@ -509,25 +1008,44 @@ class RateCardGenerator:
         return (order, 999)
     
     
-    def generate_excel(self, retailer_name: str, data: Dict[str, pd.DataFrame], output_path: str = None, hide_commissions: bool = False):
-        """Generate Excel file with formatted rate cards"""
+    @staticmethod
+    def generate_excel(retailer_name: str, data, output_path: str = None, hide_commissions: bool = False,
+                       changes: Optional[Dict] = None):
+        """Generate Excel file with formatted rate cards (needs no Salesforce connection)
+        
+        ``data`` is a dict of vertical DataFrames or any iterable of (vertical,
+        DataFrame) pairs, e.g. ``iter_rate_cards``. The workbook is write-only, so
+        each table is streamed to the file as it arrives instead of being held
+        as cell objects until the end.
+        
+        ``changes`` (from ``rate_card_snapshots``) pre-fills the Changes column:
+        New on rows added since the previous card, and the rows it removed are
+        listed after each table marked Disable.
+        """
+        # openpyxl is only needed for exports, so keep it off the JSON/search import path
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+        from openpyxl.utils import get_column_letter
+        from openpyxl.worksheet.datavalidation import DataValidation
+        
         if output_path is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_name = "".join(c for c in retailer_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
             output_path = f"{safe_name}_Rate_Card_{timestamp}.xlsx"
         
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Rate Card Analysis"
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Rate Card Analysis")
         
-        # Title
-        ws['A1'] = f"{retailer_name} - Rate Card Analysis"
-        ws['A1'].font = Font(bold=True, size=16)
-        # Merge cells based on number of columns (8 if hiding commissions, 9 if showing)
-        end_col = 'H' if hide_commissions else 'I'
-        ws.merge_cells(f'A1:{end_col}1')
+        # Adjust column widths based on hide_commissions setting (write-only sheets need them before any row)
+        if hide_commissions:
+            # Redistribute commission column width to other columns when hidden
+            column_widths = [28, 18, 15, 18, 18, 15, 12, 15]  # Without commission column
+        else:
+            column_widths = [25, 15, 12, 12, 15, 15, 12, 10, 12]  # With commission column
         
-        current_row = 3
+        for i, width in enumerate(column_widths, 1):
+            ws.column_dimensions[get_column_letter(i)].width = width
         
         # Define styles
         header_font = Font(bold=True)
@@ -538,94 +1056,93 @@ class RateCardGenerator:
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
+        centered = Alignment(horizontal='center')
+        # Merge cells based on number of columns (8 if hiding commissions, 9 if showing)
+        end_col = 'H' if hide_commissions else 'I'
+        
+        if hide_commissions:
+            headers = ['Lender', 'Position', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy', 'Changes']
+            columns = ['Lender_Name', 'Position', 'Term', 'Product_Type', 'Deferred_Period', 'APR_Range', 'Subsidy']
+            centered_columns = {7}  # Subsidy column when commission is hidden
+        else:
+            headers = ['Lender', 'Position', 'Shermin Commission', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy', 'Changes']
+            columns = ['Lender_Name', 'Position', 'Shermin_Commission', 'Term', 'Product_Type', 'Deferred_Period', 'APR_Range', 'Subsidy']
+            centered_columns = {3, 8}  # Commission and Subsidy columns when commission is shown
+        
+        def styled(value, font=None, fill=None, cell_border=None, alignment=None):
+            cell = WriteOnlyCell(ws, value=value)
+            if font:
+                cell.font = font
+            if fill:
+                cell.fill = fill
+            if cell_border:
+                cell.border = cell_border
+            if alignment:
+                cell.alignment = alignment
+            return cell
+        
+        # Title
+        ws.append([styled(f"{retailer_name} - Rate Card Analysis", font=Font(bold=True, size=16))])
+        ws.merged_cells.add(f'A1:{end_col}1')
+        ws.append([])
+        current_row = 3
+        
+        changed_verticals = (changes or {}).get('verticals', {})
+        key_positions = [columns.index(column) for column in rate_card_snapshots.KEY_COLUMNS]
+        
+        def tables():
+            seen = set()
+            for group_name, df in (data.items() if isinstance(data, dict) else data):
+                seen.add(group_name)
+                yield group_name, df
+            # Verticals dropped since the previous card still get a table of Disable rows
+            for group_name in changed_verticals:
+                if group_name not in seen:
+                    yield group_name, pd.DataFrame()
         
         # Process each product vertical group
-        for group_name, df in data.items():
-            if df.empty:
+        for group_name, df in tables():
+            vertical_changes = changed_verticals.get(group_name, {})
+            added = {rate_card_snapshots.row_key(row) for row in vertical_changes.get('added', [])}
+            removed = pd.DataFrame(vertical_changes.get('removed', []))
+            if df.empty and removed.empty:
                 continue
-                
+            
             # Group header
-            ws.cell(row=current_row, column=1, value=f"{group_name} Waterfall")
-            ws.cell(row=current_row, column=1).font = Font(bold=True, size=14)
-            # Merge cells based on number of columns (8 if hiding commissions, 9 if showing)
-            end_col = 'H' if hide_commissions else 'I'
-            ws.merge_cells(f'A{current_row}:{end_col}{current_row}')
+            ws.append([styled(f"{group_name} Waterfall", font=Font(bold=True, size=14))])
+            ws.merged_cells.add(f'A{current_row}:{end_col}{current_row}')
             current_row += 1
             
             # Table headers
-            if hide_commissions:
-                headers = ['Lender', 'Position', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy', 'Changes']
-            else:
-                headers = ['Lender', 'Position', 'Shermin Commission', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy', 'Changes']
-            
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=current_row, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.border = border
-                cell.alignment = Alignment(horizontal='center')
-            
+            ws.append([styled(header, font=header_font, fill=header_fill, cell_border=border, alignment=centered)
+                       for header in headers])
             current_row += 1
             
-            # Data rows
-            for _, row in df.iterrows():
-                if hide_commissions:
-                    values = [
-                        row.get('Lender_Name', ''),
-                        row.get('Position', ''),
-                        row.get('Term', ''),
-                        row.get('Product_Type', ''),
-                        row.get('Deferred_Period', ''),
-                        row.get('APR_Range', ''),
-                        row.get('Subsidy', ''),
-                        ''  # Changes column - empty for user input
-                    ]
-                else:
-                    values = [
-                        row.get('Lender_Name', ''),
-                        row.get('Position', ''),
-                        row.get('Shermin_Commission', ''),
-                        row.get('Term', ''),
-                        row.get('Product_Type', ''),
-                        row.get('Deferred_Period', ''),
-                        row.get('APR_Range', ''),
-                        row.get('Subsidy', ''),
-                        ''  # Changes column - empty for user input
-                    ]
-                
-                for col, value in enumerate(values, 1):
-                    cell = ws.cell(row=current_row, column=col, value=value)
-                    cell.border = border
-                    # Center align commission and subsidy columns based on hide_commissions setting
-                    if hide_commissions:
-                        if col in [7]:  # Subsidy column when commission is hidden
-                            cell.alignment = Alignment(horizontal='center')
+            # Data rows, then the removed ones, with a Changes column for user input
+            first_data_row = current_row
+            for table, removed_rows in ((df, False), (removed, True)):
+                if table.empty:
+                    continue
+                for values in table.reindex(columns=columns, fill_value='').itertuples(index=False, name=None):
+                    if removed_rows:
+                        change = 'Disable'
                     else:
-                        if col in [3, 8]:  # Commission and Subsidy columns when commission is shown
-                            cell.alignment = Alignment(horizontal='center')
-                    
-                    # Add dropdown for Changes column (last column)
-                    if col == len(values):  # Changes column
-                        from openpyxl.worksheet.datavalidation import DataValidation
-                        dv = DataValidation(type="list", formula1='"Disable,New"', allow_blank=True)
-                        dv.add(cell)
-                        ws.add_data_validation(dv)
+                        change = 'New' if tuple(values[i] for i in key_positions) in added else ''
+                    ws.append([styled(value, cell_border=border, alignment=centered if col in centered_columns else None)
+                               for col, value in enumerate(values + (change,), 1)])
+                    current_row += 1
             
-                current_row += 1
+            # Dropdown for the Changes column (last column) of the whole table
+            changes_col = get_column_letter(len(headers))
+            dv = DataValidation(type="list", formula1='"Disable,New"', allow_blank=True)
+            dv.add(f"{changes_col}{first_data_row}:{changes_col}{current_row - 1}")
+            ws.data_validations.append(dv)
             
             # Add spacing between tables
+            ws.append([])
+            ws.append([])
             current_row += 2
         
-        # Adjust column widths based on hide_commissions setting
-        if hide_commissions:
-            # Redistribute commission column width to other columns when hidden
-            column_widths = [28, 18, 15, 18, 18, 15, 12, 15]  # Without commission column
-        else:
-            column_widths = [25, 15, 12, 12, 15, 15, 12, 10, 12]  # With commission column
-        
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(i)].width = width
-        
         # Save file
         wb.save(output_path)
         return output_path
@@ -672,13 +1189,9 @@ def generate_rate_card(retailer, username, password, token, domain, output):
     click.echo(f"\nGenerating rate card for: {selected_retailer}")
     
     try:
-        # Process rate cards
-        click.echo("Fetching rate card data...")
-        rate_card_data = generator.process_rate_cards(selected_retailer)
-        
-        # Generate Excel
-        click.echo("Generating Excel file...")
-        output_file = generator.generate_excel(selected_retailer, rate_card_data, output)
+        # Stream each product vertical into the workbook as it is built
+        click.echo("Fetching rate card data and generating Excel file...")
+        output_file = generator.generate_excel(selected_retailer, generator.iter_rate_cards(selected_retailer), output)
         
         click.echo(f"\n✅ Rate card generated successfully: {output_file}")
         
@@ -688,4 +1201,6 @@ def generate_rate_card(retailer, username, password, token, domain, output):
         traceback.print_exc()
 
 if __name__ == '__main__':
+    from log_config import setup_logging
+    setup_logging()
     generate_rate_card()
@@ -0,0 +1,224 @@
+"""
+Rate card snapshots and the changes between them
+
+Every rate card built from Salesforce is recorded per retailer in
+``RATE_CARD_SNAPSHOT_DIR``: its rows per product vertical plus a digest of the
+line items each vertical was built from. Two snapshots are kept, the current
+card and the last different one, so:
+
+- the changes since the previous card (rows added, removed, or with a new
+  commission, APR or subsidy, keyed by lender, position, term, product type and
+  deferred period) stay the same however often an unchanged card is rebuilt.
+  They are served as JSON by /generate-changes and pre-filled in the Changes
+  column of the Excel export (New for added rows, Disable for removed ones).
+- a rebuild reuses the processed rows of every vertical whose line items are
+  unchanged instead of processing them again (see
+  ``RateCardGenerator.iter_rate_cards``). The line items are still fetched to
+  compare, and exports are still rendered in full.
+- the last good card survives restarts, to be served (marked stale) while
+  Salesforce is unavailable.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from log_config import RATE_LIMITED
+from precompute import retailer_slug, write_text
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+RATE_CARD_SNAPSHOT_DIR = os.getenv(
+    'RATE_CARD_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_card_snapshots'),
+)
+logger = logging.getLogger(__name__)
+
+# Bump when _process_vertical's output changes, so older snapshots aren't reused
+SNAPSHOT_VERSION = 1
+
+# A rate card row is identified by these columns; the others are its values
+KEY_COLUMNS = ('Lender_Name', 'Position', 'Term', 'Product_Type', 'Deferred_Period')
+VALUE_COLUMNS = ('Shermin_Commission', 'APR_Range', 'Subsidy')
+
+
+def _digest(value) -> str:
+    payload = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def inputs_digest(records: List[Dict]) -> str:
+    """Digest of the line items one vertical is processed from"""
+    return _digest([SNAPSHOT_VERSION, records])
+
+
+def row_key(row: Dict) -> Tuple:
+    return tuple(row.get(column) for column in KEY_COLUMNS)
+
+
+def make_snapshot(data: Dict[str, 'pd.DataFrame'], inputs: Dict[str, str]) -> Dict:
+    """Snapshot of processed rate cards, with the inputs digest of each vertical"""
+    verticals = {vertical: {'inputs': inputs.get(vertical), 'rows': df.to_dict('records')}
+                 for vertical, df in data.items()}
+    return {
+        'taken_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'built_at': time.time(),
+        'digest': _digest({vertical: entry['rows'] for vertical, entry in verticals.items()}),
+        'verticals': verticals,
+    }
+
+
+def diff_snapshots(before: Optional[Dict], after: Dict, hide_commissions: bool = False) -> Dict:
+    """Rows added, removed and changed per vertical going from ``before`` to ``after``
+
+    With no ``before`` (a retailer's first card) nothing is reported as changed.
+    With ``hide_commissions`` commission values are left out, and rows whose
+    only change is their commission aren't reported.
+    """
+    value_columns = [c for c in VALUE_COLUMNS if not (hide_commissions and c == 'Shermin_Commission')]
+    changes = {'since': before['taken_at'] if before else None, 'verticals': {},
+               'summary': {'added': 0, 'removed': 0, 'changed': 0}}
+    if before is None:
+        return changes
+
+    def shown(row):
+        return {c: v for c, v in row.items() if not (hide_commissions and c == 'Shermin_Commission')}
+
+    old_verticals, new_verticals = before['verticals'], after['verticals']
+    for vertical in list(new_verticals) + [v for v in old_verticals if v not in new_verticals]:
+        old = {row_key(row): row for row in old_verticals.get(vertical, {}).get('rows', [])}
+        new = {row_key(row): row for row in new_verticals.get(vertical, {}).get('rows', [])}
+        added = [shown(row) for key, row in new.items() if key not in old]
+        removed = [shown(row) for key, row in old.items() if key not in new]
+        changed = []
+        for key, row in new.items():
+            if key not in old:
+                continue
+            differing = [c for c in value_columns if old[key].get(c) != row.get(c)]
+            if differing:
+                changed.append({'key': dict(zip(KEY_COLUMNS, key)),
+                                'before': {c: old[key].get(c) for c in differing},
+                                'after': {c: row.get(c) for c in differing}})
+        if added or removed or changed:
+            changes['verticals'][vertical] = {'added': added, 'removed': removed, 'changed': changed}
+            changes['summary']['added'] += len(added)
+            changes['summary']['removed'] += len(removed)
+            changes['summary']['changed'] += len(changed)
+    return changes
+
+
+class SnapshotStore:
+    """One JSON file per retailer holding its current and previous snapshot"""
+
+    def __init__(self, directory: str = RATE_CARD_SNAPSHOT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def path(self, retailer_name: str) -> str:
+        return os.path.join(self.directory, f"{retailer_slug(retailer_name)}.json")
+
+    def load(self, retailer_name: str) -> Optional[Dict]:
+        """``{'current': snapshot, 'previous': snapshot or None}``, or None if there is none"""
+        try:
+            with open(self.path(retailer_name), encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read rate card snapshot for %s: %s", retailer_name, e)
+            return None
+        if stored.get('version') != SNAPSHOT_VERSION or stored.get('retailer') != retailer_name:
+            return None
+        return stored
+
+    def record(self, retailer_name: str, snapshot: Dict):
+        """Make ``snapshot`` the current one; a different card moves the current one to previous"""
+        with self._lock:
+            stored = self.load(retailer_name) or {'current': None, 'previous': None}
+            current = stored['current']
+            if current is not None and current['digest'] == snapshot['digest']:
+                # Same card: keep when it first appeared, take the latest inputs
+                snapshot = dict(snapshot, taken_at=current['taken_at'])
+            else:
+                stored['previous'] = current
+            stored.update(version=SNAPSHOT_VERSION, retailer=retailer_name, current=snapshot)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                write_text(self.path(retailer_name), json.dumps(stored))
+            except OSError as e:
+                logger.warning("Could not save rate card snapshot for %s: %s", retailer_name, e,
+                               extra=RATE_LIMITED)
+
+    def reusable(self, retailer_name: str) -> Optional[Dict]:
+        """The current snapshot's verticals, for ``iter_rate_cards(previous=...)`` to reuse the processed rows of"""
+        stored = self.load(retailer_name)
+        return stored['current']['verticals'] if stored else None
+
+    def last_good(self, retailer_name: str) -> Optional[Tuple[Dict[str, 'pd.DataFrame'], float]]:
+        """The current snapshot as rate card data, with its age in seconds (for when Salesforce is down)"""
+        import pandas as pd
+
+        stored = self.load(retailer_name)
+        if stored is None:
+            return None
+        current = stored['current']
+        data = {vertical: pd.DataFrame(entry['rows']) for vertical, entry in current['verticals'].items()}
+        return data, time.time() - current.get('built_at', 0)
+
+    def changes(self, retailer_name: str, data: Dict[str, 'pd.DataFrame'], hide_commissions: bool = False) -> Dict:
+        """Changes in ``data`` since the last different card recorded for the retailer"""
+        after = make_snapshot(data, {})
+        stored = self.load(retailer_name)
+        if stored is None:
+            before = None
+        elif stored['current']['digest'] == after['digest']:
+            before = stored['previous']
+        else:
+            # Not recorded yet (or built elsewhere): compare with the latest card
+            before = stored['current']
+        return diff_snapshots(before, after, hide_commissions)
+
+
+snapshot_store = SnapshotStore()
+
+
+def build_rate_cards(gen, retailer_name: str, progress: Optional[Callable] = None,
+                     store: SnapshotStore = None) -> Dict[str, 'pd.DataFrame']:
+    """``process_rate_cards``, reusing the processed rows of unchanged verticals from the last snapshot
+
+    Salesforce is still queried for every line item (their digests decide what is
+    unchanged); only the per-vertical processing is skipped. Records the new snapshot.
+    """
+    store = store or snapshot_store
+    inputs = {}
+    data = dict(gen.iter_rate_cards(retailer_name, _collect_inputs(gen, progress, inputs),
+                                    previous=store.reusable(retailer_name)))
+    if data:
+        store.record(retailer_name, make_snapshot(data, inputs))
+    return data
+
+
+async def build_rate_cards_async(gen, retailer_name: str, progress: Optional[Callable] = None,
+                                 store: SnapshotStore = None) -> Dict[str, 'pd.DataFrame']:
+    """``build_rate_cards`` for an ``AsyncRateCardGenerator``, with the snapshot file I/O off the event loop"""
+    store = store or snapshot_store
+    inputs = {}
+    previous = await asyncio.to_thread(store.reusable, retailer_name)
+    data = await gen.process_rate_cards(retailer_name, _collect_inputs(gen, progress, inputs), previous=previous)
+    if data:
+        await asyncio.to_thread(store.record, retailer_name, make_snapshot(data, inputs))
+    return data
+
+
+def _collect_inputs(gen, progress: Optional[Callable], inputs: Dict[str, str]) -> Callable:
+    """Progress callback recording each vertical's inputs digest, then passing the event on"""
+    def on_progress(stage, **data):
+        if stage == 'vertical':
+            inputs[data['vertical']] = data['inputs']
+        gen._report(progress, stage, **data)
+    return on_progress
@@ -0,0 +1,105 @@
+"""
+Ranked, cursor-paginated retailer search
+
+Matches are ranked in two tiers: names starting with the search term, then
+names containing it elsewhere. Within a tier they are ordered by name
+(case-insensitive, as SOQL ``ORDER BY`` sorts) and then Id, so the last
+retailer on a page is a keyset cursor: the next page starts strictly after
+its (tier, name, Id). Cursors are opaque strings and mean the same thing
+whether the page comes from the in-memory retailer index or from the
+aggregate SOQL query in ``RateCardGenerator.find_retailer_page``.
+"""
+import base64
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+PREFIX, SUBSTRING = 0, 1
+
+# Retailers per /search page unless the client asks for another size, and the most it may ask for
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '100'))
+
+
+class CursorError(ValueError):
+    """The cursor wasn't produced by this module"""
+
+
+def encode_cursor(tier: int, name: str, retailer_id: str) -> str:
+    payload = json.dumps([tier, name, retailer_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[int, str, str]]:
+    """(tier, name, Id) the next page starts after, or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        tier, name, retailer_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise CursorError(f"Invalid search cursor: {cursor!r}") from e
+    if tier not in (PREFIX, SUBSTRING) or not isinstance(name, str) or not isinstance(retailer_id, str):
+        raise CursorError(f"Invalid search cursor: {cursor!r}")
+    return tier, name, retailer_id
+
+
+def same_salesforce_id(a: Optional[str], b: Optional[str]) -> bool:
+    """Whether two Salesforce IDs name the same record, in either the 15- or 18-character form
+
+    The API returns 18-character IDs, but profiles may hold the 15-character
+    form (as SOQL accepts); the extra 3 characters are a checksum of the first 15.
+    """
+    return bool(a) and bool(b) and a[:15] == b[:15]
+
+
+def tier_of(name: Optional[str], needle: str) -> Optional[int]:
+    """PREFIX or SUBSTRING for a name matching the lower-cased ``needle``, else None"""
+    name = (name or '').lower()
+    if name.startswith(needle):
+        return PREFIX
+    if needle in name:
+        return SUBSTRING
+    return None
+
+
+def order_key(retailer: Dict) -> Tuple[str, str]:
+    return (retailer['Name'] or '').lower(), retailer['Id'] or ''
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    return max(1, min(limit or SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE))
+
+
+def make_page(ranked: List[Tuple[int, Dict]], limit: int) -> Dict:
+    """Page of up to ``limit`` retailers from ``limit + 1`` ranked matches, with the next cursor"""
+    page = {'retailers': [retailer for _, retailer in ranked[:limit]], 'next_cursor': None}
+    if len(ranked) > limit:
+        tier, last = ranked[limit - 1]
+        page['next_cursor'] = encode_cursor(tier, last['Name'] or '', last['Id'])
+    return page
+
+
+def search_sorted(retailers: Sequence[Dict], partial_name: str, limit: int,
+                  cursor: Optional[str] = None) -> Dict:
+    """One page of matches from retailers already sorted by ``order_key``
+
+    Stops scanning as soon as the page is full, so a common prefix costs a
+    page's worth of work rather than one per match.
+    """
+    needle = partial_name.lower()
+    after = decode_cursor(cursor)
+    ranked = []
+    for tier in (PREFIX, SUBSTRING):
+        if after and tier < after[0]:
+            continue
+        start = (after[1].lower(), after[2]) if after and tier == after[0] else None
+        for retailer in retailers:
+            if tier_of(retailer['Name'], needle) != tier or (start and order_key(retailer) <= start):
+                continue
+            ranked.append((tier, retailer))
+            if len(ranked) > limit:
+                return make_page(ranked, limit)
+        if not needle:
+            # Every name starts with the empty string
+            break
+    return make_page(ranked, limit)
@@ -0,0 +1,209 @@
+"""
+Pool of authenticated Salesforce sessions
+
+Each pooled ``RateCardGenerator`` owns its own ``simple_salesforce`` client and
+``requests.Session`` (with a tuned keep-alive connection pool), and is used by
+one request at a time via ``checkout()``. Concurrent requests therefore run in
+parallel without sharing a session, and an expired session is logged into again
+transparently by the generator itself.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict
+
+from circuit_breaker import SalesforceUnavailable
+
+if TYPE_CHECKING:
+    import requests
+
+SF_POOL_SIZE = int(os.getenv('SF_POOL_SIZE', '4'))
+SF_POOL_CHECKOUT_TIMEOUT = float(os.getenv('SF_POOL_CHECKOUT_TIMEOUT', '30'))
+# Connections kept alive per session; one request can run a few queries at once
+SF_HTTP_POOL_MAXSIZE = int(os.getenv('SF_HTTP_POOL_MAXSIZE', '4'))
+
+
+class PoolExhausted(TimeoutError):
+    """No Salesforce session became free within the checkout timeout"""
+
+
+def make_salesforce_session(pool_maxsize: int = SF_HTTP_POOL_MAXSIZE) -> 'requests.Session':
+    """requests.Session with keep-alive pooling and retries on idempotent GETs
+
+    A read timeout isn't retried: the query has already had its full timeout
+    and retrying it would only add load to a struggling Salesforce.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retries = Retry(
+        total=2,
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=retries)
+    session.mount('https://', adapter)
+    return session
+
+
+def _connection_lost(error: Exception) -> bool:
+    """Whether ``error`` (or the error behind an outage) means the session's connections may be dead"""
+    import requests
+
+    if isinstance(error, SalesforceUnavailable):
+        error = error.__cause__
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class SalesforcePool:
+    """Fixed-size pool of RateCardGenerator instances with checkout/checkin
+
+    Sessions are created lazily up to ``size`` and reused LIFO so the most
+    recently used (warmest) connection is handed out first.
+    """
+
+    def __init__(self, factory: Callable, size: int = SF_POOL_SIZE,
+                 checkout_timeout: float = SF_POOL_CHECKOUT_TIMEOUT):
+        self.factory = factory
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self._idle = []  # LIFO
+        self._members = []
+        self._lock = threading.Lock()
+        # Notified whenever a checkout could succeed: a member checked in or a slot freed
+        self._available = threading.Condition(self._lock)
+        self._creating = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'login_failures': 0,
+            'discarded': 0,
+        }
+
+    @classmethod
+    def from_env(cls, size: int = SF_POOL_SIZE) -> 'SalesforcePool':
+        """Pool of generators logged in with the SF_* environment credentials"""
+        from rate_card_generator import RateCardGenerator
+
+        def factory():
+            return RateCardGenerator(
+                os.getenv('SF_USERNAME'),
+                os.getenv('SF_PASSWORD'),
+                os.getenv('SF_TOKEN'),
+                os.getenv('SF_DOMAIN', 'login'),
+                session=make_salesforce_session()
+            )
+        return cls(factory, size=size)
+
+    def _create(self):
+        try:
+            member = self.factory()
+        except Exception:
+            with self._available:
+                self._creating -= 1
+                self._stats['login_failures'] += 1
+                # The slot is free again: a waiter may log in instead
+                self._available.notify()
+            raise
+        with self._lock:
+            self._creating -= 1
+            self._members.append(member)
+        return member
+
+    def _acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._available:
+            while True:
+                if self._idle:
+                    member = self._idle.pop()
+                    break
+                if len(self._members) + self._creating < self.size:
+                    self._creating += 1
+                    member = None
+                    break
+                # Pool is full: wait for a session to be checked in or discarded
+                remaining = start + self.checkout_timeout - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolExhausted(f"No Salesforce session free after {self.checkout_timeout:.0f}s")
+                waited = True
+                self._available.wait(remaining)
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_seconds'] += time.monotonic() - start
+        if member is None:
+            return self._create()
+        return member
+
+    def _release(self, member):
+        with self._available:
+            self._idle.append(member)
+            self._available.notify()
+
+    @contextmanager
+    def checkout(self):
+        """Borrow a generator for the duration of a ``with`` block"""
+        member = self._acquire()
+        with self._lock:
+            self._stats['checkouts'] += 1
+        broken = False
+        try:
+            yield member
+        except Exception as e:
+            # The session's connections may be dead - replace it rather than reuse
+            broken = _connection_lost(e)
+            raise
+        finally:
+            if broken:
+                self.discard(member)
+            else:
+                self._release(member)
+
+    def discard(self, member):
+        """Drop a member so a fresh session is created in its place (by a waiting checkout, if any)"""
+        with self._available:
+            if member in self._members:
+                self._members.remove(member)
+                self._stats['discarded'] += 1
+                self._available.notify()
+        session = getattr(member, 'session', None)
+        if session is not None:
+            session.close()
+
+    def prefill(self, count: int = None):
+        """Log in up to ``count`` sessions ahead of demand (default: the whole pool)"""
+        target = min(count or self.size, self.size)
+        created = []
+        while True:
+            with self._lock:
+                if len(self._members) + self._creating >= target:
+                    break
+                self._creating += 1
+            created.append(self._create())
+        for member in created:
+            self._release(member)
+        return len(created)
+
+    def stats(self) -> Dict:
+        """Health metrics for the pool"""
+        with self._lock:
+            members = list(self._members)
+            stats = dict(self._stats)
+            idle = len(self._idle)
+        stats.update({
+            'size': self.size,
+            'sessions': len(members),
+            'idle': idle,
+            'in_use': len(members) - idle,
+            'relogins': sum(getattr(m, 'relogins', 0) for m in members),
+            'wait_seconds': round(stats['wait_seconds'], 3),
+        })
+        return stats
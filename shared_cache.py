@@ -0,0 +1,242 @@
+"""
+A cache shared by every worker process on the host, kept in one SQLite file
+
+With ``CACHE_BACKEND=sqlite`` the rate card cache, the retailer search index and
+the profile cache keep their entries in ``SHARED_CACHE_PATH`` rather than in
+process memory, so gunicorn/uwsgi workers share one warm cache: a rate card
+built by one worker is a hit in all the others, and invalidating a profile drops
+it everywhere. No server is involved. The file is opened in WAL mode, so readers
+never wait for each other or for a writer, and every write takes SQLite's write
+lock (``BEGIN IMMEDIATE``), which serializes writers across processes.
+
+Values are pickled (DataFrames keep their dtypes). Entries expire after their
+TTL, but are kept for stale fallbacks until evicted: once the values outgrow
+``SHARED_CACHE_MAX_MB``, expired entries go first, then the least recently used.
+Unpickling runs code, so the file must only be writable by this app.
+
+A cache that can't be read or written (a locked or full disk) behaves as a
+miss, so requests go to Salesforce rather than fail.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from log_config import RATE_LIMITED
+
+# 'memory' keeps each process's caches to itself; 'sqlite' shares them through SHARED_CACHE_PATH
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+SHARED_CACHE_PATH = os.getenv(
+    'SHARED_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_card_cache.sqlite3'),
+)
+SHARED_CACHE_MAX_MB = float(os.getenv('SHARED_CACHE_MAX_MB', '256'))
+# Seconds a write waits for another process to release the write lock
+SHARED_CACHE_BUSY_TIMEOUT = float(os.getenv('SHARED_CACHE_BUSY_TIMEOUT', '5'))
+
+# A read records its time for LRU eviction at most this often per entry, so hot entries don't cost a write each
+TOUCH_INTERVAL = 10.0
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    fingerprint TEXT,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_by_access ON entries (namespace, accessed);
+"""
+
+
+class SqliteStore:
+    """Pickled values by namespace and key, with TTLs and size-bounded LRU eviction, in a SQLite file"""
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, max_bytes: int = int(SHARED_CACHE_MAX_MB * 1024 * 1024),
+                 busy_timeout: float = SHARED_CACHE_BUSY_TIMEOUT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use (and again after a fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit: reads see the latest commit, writes open their own transactions
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            # SQLite may already have rolled back (e.g. after an I/O error)
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def get(self, namespace: str, key: str, allow_expired: bool = False,
+            known_created: Optional[float] = None) -> Optional[Dict]:
+        """``{'value', 'fingerprint', 'created', 'expires'}``, or None if absent or expired
+
+        With ``allow_expired`` an expired entry is still returned. If the entry
+        is still the one created at ``known_created``, its value isn't read or
+        unpickled: the result has ``unchanged`` set instead, for the caller to
+        reuse its own copy.
+        """
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                'SELECT CASE WHEN created = ? THEN NULL ELSE value END, fingerprint, created, expires, accessed '
+                'FROM entries WHERE namespace = ? AND key = ?',
+                (known_created, namespace, key),
+            ).fetchone()
+            now = time.time()
+            if row is None or (row[3] < now and not allow_expired):
+                return None
+            if now - row[4] >= TOUCH_INTERVAL:
+                self._touch(conn, namespace, key, now)
+            entry = {'fingerprint': row[1], 'created': row[2], 'expires': row[3]}
+            if row[0] is None:
+                entry['unchanged'] = True
+                return entry
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Shared cache read of %s/%s failed: %s", namespace, key, e, extra=RATE_LIMITED)
+            return None
+        try:
+            entry['value'] = pickle.loads(row[0])
+        except Exception as e:
+            # Corrupt, or pickled by code that has since changed (a renamed class, a
+            # newer pandas): a miss, and dropped unless it was replaced meanwhile
+            logger.warning("Shared cache entry %s/%s can't be unpickled, dropping it: %r", namespace, key, e,
+                           extra=RATE_LIMITED)
+            try:
+                conn.execute('DELETE FROM entries WHERE namespace = ? AND key = ? AND created = ?',
+                             (namespace, key, row[2]))
+            except sqlite3.Error:
+                pass
+            return None
+        return entry
+
+    def _touch(self, conn: sqlite3.Connection, namespace: str, key: str, now: float):
+        """Record a read for LRU eviction, if the write lock is free right now
+
+        Best effort: a read never waits behind a writer for this, and a touch
+        that can't be made leaves the hit a hit.
+        """
+        conn.execute('PRAGMA busy_timeout = 0')
+        try:
+            conn.execute('UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?', (now, namespace, key))
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, fingerprint: Optional[str] = None,
+            max_entries: Optional[int] = None) -> Optional[float]:
+        """Store ``value`` for ``ttl`` seconds; returns its creation time, or None if it couldn't be stored
+
+        ``max_entries`` bounds the namespace, dropping its least recently used entries.
+        """
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        try:
+            with self._write() as conn:
+                conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (namespace, key, blob, fingerprint, now, now + ttl, now, len(blob)))
+                if max_entries is not None:
+                    conn.execute(
+                        'DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries WHERE namespace = ? '
+                        'ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                        (namespace, max_entries),
+                    )
+                self._evict(conn, now)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Shared cache write of %s/%s failed: %s", namespace, key, e, extra=RATE_LIMITED)
+            return None
+        return now
+
+    def add(self, namespace: str, key: str, value: Any, ttl: float) -> Optional[bool]:
+        """Store ``value`` unless a live entry exists: True if stored, False if not, None if the store failed
+
+        Only one of several processes adding the same key gets True, so it can serve as a lock with a TTL.
+        """
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        try:
+            with self._write() as conn:
+                row = conn.execute('SELECT expires FROM entries WHERE namespace = ? AND key = ?',
+                                   (namespace, key)).fetchone()
+                if row is not None and row[0] >= now:
+                    return False
+                conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (namespace, key, blob, None, now, now + ttl, now, len(blob)))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Shared cache add of %s/%s failed: %s", namespace, key, e, extra=RATE_LIMITED)
+            return None
+        return True
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Delete entries until the values fit in ``max_bytes``: expired ones first, then by last access"""
+        excess = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        doomed = []
+        for rowid, size in conn.execute('SELECT rowid, size FROM entries ORDER BY expires >= ?, accessed',
+                                        (now,)).fetchall():
+            doomed.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM entries WHERE rowid = ?', doomed)
+
+    def delete(self, namespace: str, key: Optional[str] = None):
+        """Drop one entry, or the whole namespace when no key is given"""
+        try:
+            with self._write() as conn:
+                if key is None:
+                    conn.execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+                else:
+                    conn.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Shared cache delete of %s/%s failed: %s", namespace, key, e, extra=RATE_LIMITED)
+
+    def stats(self, namespace: Optional[str] = None) -> Dict:
+        """Entries and bytes stored, in one namespace or overall"""
+        try:
+            if namespace is None:
+                row = self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            else:
+                row = self._connection().execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?', (namespace,),
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Shared cache stats failed: %s", e, extra=RATE_LIMITED)
+            return {'entries': None, 'bytes': None}
+        return {'entries': row[0], 'bytes': row[1]}
+
+
+# None unless CACHE_BACKEND=sqlite; the file is opened on first use
+store = SqliteStore() if CACHE_BACKEND == 'sqlite' else None
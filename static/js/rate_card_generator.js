@@ -0,0 +1,386 @@
+let currentRetailer = null;
+let currentRateCardData = null;
+let userRole = null;
+
+// Get user info and show commission checkbox for admin users
+async function initializeUserInterface() {
+    try {
+        const response = await fetch('/user-info');
+        const userInfo = await response.json();
+        userRole = userInfo.role;
+
+        // Show commission checkbox only for admin users
+        if (userRole === 'admin') {
+            document.getElementById('commissionGroup').style.display = 'block';
+        }
+    } catch (error) {
+        console.error('Failed to get user info:', error);
+    }
+}
+
+// Initialize on page load
+document.addEventListener('DOMContentLoaded', initializeUserInterface);
+async function searchRetailers(cursor) {
+    const search = document.getElementById('retailerSearch').value;
+    if (!search) return;
+
+    document.getElementById('status').textContent = 'Searching...';
+    const results = document.getElementById('results');
+    // A "More results" click appends the next page; a new search starts over
+    const moreButton = document.getElementById('moreRetailers');
+    if (moreButton) moreButton.remove();
+    if (!cursor) results.innerHTML = '';
+
+    try {
+        let url = '/search?q=' + encodeURIComponent(search);
+        if (cursor) url += '&cursor=' + encodeURIComponent(cursor);
+        const response = await fetch(url);
+        const data = await response.json();
+
+        // Check if the response is an error
+        if (data.error) {
+            document.getElementById('status').textContent = 'Error: ' + data.error;
+            results.innerHTML = '';
+            return;
+        }
+
+        // Handle successful response (array of retailers)
+        if (data.length === 0 && !cursor) {
+            results.innerHTML = '<p>No retailers found</p>';
+        } else {
+            const html = data.map(r =>
+                `<div class="retailer-option" onclick="generateRateCard('${r.name}')"">${r.name}</div>`
+            ).join('');
+            results.insertAdjacentHTML('beforeend', html);
+        }
+
+        const nextCursor = response.headers.get('X-Next-Cursor');
+        if (nextCursor) {
+            const more = document.createElement('div');
+            more.id = 'moreRetailers';
+            more.className = 'retailer-option';
+            more.textContent = 'More results...';
+            more.onclick = () => searchRetailers(nextCursor);
+            results.appendChild(more);
+        }
+        document.getElementById('status').textContent = '';
+    } catch (error) {
+        document.getElementById('status').textContent = 'Error: ' + error.message;
+        results.innerHTML = '';
+    }
+}
+
+async function generateRateCard(retailerName) {
+    document.getElementById('status').innerHTML = 'Generating rate card for ' + retailerName + '...<span class="loading-spinner"></span>';
+    document.getElementById('results').innerHTML = '';
+    currentRetailer = retailerName;
+
+    // Stream progress when the browser supports it, otherwise wait for the full payload
+    if (window.EventSource) {
+        streamRateCard(retailerName);
+    } else {
+        await fetchRateCard(retailerName);
+    }
+}
+
+function rateCardUrl(path, retailerName, hideCommissions) {
+    return path + '?retailer=' + encodeURIComponent(retailerName) + '&hide_commissions=' + hideCommissions;
+}
+
+function setProgress(text) {
+    document.getElementById('status').innerHTML = text + '<span class="loading-spinner"></span>';
+}
+
+function staleMessage(reason, ageSeconds) {
+    let age = '';
+    if (ageSeconds !== null && ageSeconds !== undefined) {
+        const minutes = Math.round(Number(ageSeconds) / 60);
+        age = minutes < 60 ? ` (${minutes} min old)` : ` (${Math.round(minutes / 60)} h old)`;
+    }
+    return 'Showing the last saved rate card' + age + ': ' + reason;
+}
+
+function streamRateCard(retailerName) {
+    const source = new EventSource('/generate-stream?retailer=' + encodeURIComponent(retailerName));
+    let received = false;
+    let staleReason = null;
+    let staleAge = null;
+    currentRateCardData = {};
+    startRateCardDisplay();
+
+    source.addEventListener('account_resolved', e => {
+        received = true;
+        const d = JSON.parse(e.data);
+        setProgress('Found account ' + d.account + '...');
+    });
+    source.addEventListener('arc_count', e => {
+        const d = JSON.parse(e.data);
+        setProgress('Found ' + d.count + ' assigned rate cards across ' + d.opportunities + ' opportunities...');
+    });
+    source.addEventListener('oli_batch', e => {
+        const d = JSON.parse(e.data);
+        setProgress('Fetched rates for opportunity ' + d.fetched + ' of ' + d.total + '...');
+    });
+    source.addEventListener('render_started', e => {
+        // Cached rate cards start here, without the Salesforce query events
+        received = true;
+        const d = JSON.parse(e.data);
+        setProgress('Building ' + d.verticals + ' product verticals...');
+    });
+    source.addEventListener('vertical', e => {
+        const d = JSON.parse(e.data);
+        currentRateCardData[d.vertical] = d.rows;
+        appendVerticalSection(d.vertical, d.rows);
+        setProgress('Built ' + d.processed + ' of ' + d.total + ' product verticals...');
+    });
+    source.addEventListener('stale', e => {
+        // Salesforce API budget is low or Salesforce is down: the last saved rate card follows
+        received = true;
+        const d = JSON.parse(e.data);
+        staleReason = d.reason;
+        staleAge = d.age_seconds;
+    });
+    source.addEventListener('done', () => {
+        source.close();
+        document.getElementById('status').textContent = staleReason ? staleMessage(staleReason, staleAge) : '';
+    });
+    source.addEventListener('error', e => {
+        // Always close - EventSource would otherwise reconnect and regenerate
+        source.close();
+        if (e.data) {
+            document.getElementById('status').textContent = 'Error: ' + JSON.parse(e.data).error;
+        } else if (!received) {
+            // Stream could not be opened, use the plain JSON endpoint instead
+            fetchRateCard(retailerName);
+        } else {
+            document.getElementById('status').textContent = 'Error: Connection lost while generating rate card';
+        }
+    });
+}
+
+async function fetchRateCard(retailerName) {
+    // Get commission setting - always true for BDMs, checkbox value for admins
+    const commissionCheckbox = document.getElementById('hideSherminCommissions');
+    const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
+
+    // Without streamed response bodies, the compact columnar payload is fetched in one go
+    const streaming = !!(window.ReadableStream && window.TextDecoder);
+
+    try {
+        // Ask for one JSON line per vertical so tables render as they arrive.
+        // GET lets the browser cache revalidate with If-None-Match.
+        const response = streaming
+            ? await fetch(rateCardUrl('/generate-data', retailerName, hideCommissions) + '&stream=ndjson', {
+                headers: {'Accept': 'application/x-ndjson'}
+            })
+            : await fetch(rateCardUrl('/generate-data', retailerName, hideCommissions) + '&format=columnar');
+
+        if (!response.ok) {
+            const body = await response.json().catch(() => ({}));
+            throw new Error(body.error || 'Failed to generate rate card');
+        }
+        const staleReason = response.headers.get('X-Rate-Card-Stale');
+        const staleAge = response.headers.get('X-Rate-Card-Age');
+
+        if (!streaming) {
+            currentRateCardData = decodeColumnar(await response.json());
+            displayRateCard(currentRateCardData);
+            document.getElementById('status').textContent = staleReason ? staleMessage(staleReason, staleAge) : '';
+            return;
+        }
+
+        currentRateCardData = {};
+        startRateCardDisplay();
+
+        const handleLine = (line) => {
+            if (!line.trim()) return;
+            const item = JSON.parse(line);
+            if (item.error) throw new Error(item.error);
+            currentRateCardData[item.vertical] = item.rows;
+            appendVerticalSection(item.vertical, item.rows);
+        };
+
+        if (response.body && response.body.getReader) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.forEach(handleLine);
+            }
+            handleLine(buffer);
+        } else {
+            (await response.text()).split('\n').forEach(handleLine);
+        }
+        document.getElementById('status').textContent = staleReason ? staleMessage(staleReason, staleAge) : '';
+    } catch (error) {
+        document.getElementById('status').textContent = 'Error: ' + error.message;
+    }
+}
+
+function startRateCardDisplay() {
+    // Update header
+    document.getElementById('retailerTitle').textContent = currentRetailer + ' - Rate Card Analysis';
+    document.getElementById('generationDate').textContent = 'Generated: ' + new Date().toLocaleDateString('en-GB', {
+        day: 'numeric',
+        month: 'long',
+        year: 'numeric'
+    });
+
+    // Clear content and show the rate card display
+    document.getElementById('rateCardContent').innerHTML = '';
+    document.getElementById('rateCardDisplay').style.display = 'block';
+}
+
+const COLUMNAR_FORMAT = 'rate-card-columnar/1';
+
+// Rows per vertical, as in the plain JSON response, from /generate-data?format=columnar
+function decodeColumnar(payload) {
+    if (payload.format !== COLUMNAR_FORMAT) return payload;
+
+    const data = {};
+    payload.verticals.forEach(vertical => {
+        const rows = [];
+        for (let i = 0; i < vertical.rows; i++) rows.push({});
+        payload.columns.forEach((column, index) => {
+            const values = vertical.data[index];
+            const dictionary = column.dictionary ? payload.dictionaries[column.name] : null;
+            for (let i = 0; i < vertical.rows; i++) {
+                rows[i][column.name] = dictionary ? dictionary[values[i]] : values[i];
+            }
+        });
+        data[vertical.name] = rows;
+    });
+    return data;
+}
+
+function displayRateCard(data) {
+    data = decodeColumnar(data);
+    startRateCardDisplay();
+
+    // Process each product vertical
+    for (const [vertical, rows] of Object.entries(data)) {
+        appendVerticalSection(vertical, rows);
+    }
+}
+
+function appendVerticalSection(vertical, rows) {
+    if (rows.length === 0) return;
+
+    const section = document.createElement('div');
+    section.className = 'product-vertical-section';
+
+    const title = document.createElement('h3');
+    title.className = 'product-vertical-title';
+    title.textContent = vertical + ' Waterfall';
+    section.appendChild(title);
+
+    const table = document.createElement('table');
+    table.className = 'rate-table';
+
+    // Check if we should hide commissions
+    // Get commission setting - always true for BDMs, checkbox value for admins
+    const commissionCheckbox = document.getElementById('hideSherminCommissions');
+    const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
+
+    // Header
+    const thead = document.createElement('thead');
+    const headerRow = document.createElement('tr');
+    const headers = hideCommissions
+        ? ['Lender', 'Position', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy']
+        : ['Lender', 'Position', 'Shermin Commission', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy'];
+
+    headers.forEach(header => {
+        const th = document.createElement('th');
+        th.textContent = header;
+        headerRow.appendChild(th);
+    });
+    thead.appendChild(headerRow);
+    table.appendChild(thead);
+
+    // Body
+    const tbody = document.createElement('tbody');
+    rows.forEach(row => {
+        const tr = document.createElement('tr');
+        const dataKeys = hideCommissions
+            ? ['Lender_Name', 'Position', 'Term', 'Product_Type', 'Deferred_Period', 'APR_Range', 'Subsidy']
+            : ['Lender_Name', 'Position', 'Shermin_Commission', 'Term', 'Product_Type', 'Deferred_Period', 'APR_Range', 'Subsidy'];
+
+        dataKeys.forEach(key => {
+            const td = document.createElement('td');
+            td.textContent = row[key] || '';
+            tr.appendChild(td);
+        });
+        tbody.appendChild(tr);
+    });
+    table.appendChild(tbody);
+
+    section.appendChild(table);
+    document.getElementById('rateCardContent').appendChild(section);
+}
+
+async function downloadExcel() {
+    if (!currentRetailer) return;
+
+    document.getElementById('status').innerHTML = 'Generating Excel file...<span class="loading-spinner"></span>';
+
+    // Get commission setting - always true for BDMs, checkbox value for admins
+    const commissionCheckbox = document.getElementById('hideSherminCommissions');
+    const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
+
+    try {
+        const response = await fetch(rateCardUrl('/generate', currentRetailer, hideCommissions));
+
+        if (response.ok) {
+            const blob = await response.blob();
+            const url = window.URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = currentRetailer.replace(/[^a-z0-9]/gi, '_') + '_Rate_Card.xlsx';
+            document.body.appendChild(a);
+            a.click();
+            window.URL.revokeObjectURL(url);
+            document.getElementById('status').textContent = '✅ Excel downloaded!';
+            setTimeout(() => { document.getElementById('status').textContent = ''; }, 3000);
+        } else {
+            throw new Error('Failed to generate Excel');
+        }
+    } catch (error) {
+        document.getElementById('status').textContent = 'Error: ' + error.message;
+    }
+}
+
+async function downloadPDF() {
+    if (!currentRetailer) return;
+
+    document.getElementById('status').innerHTML = 'Generating PDF file...<span class="loading-spinner"></span>';
+
+    // Get commission setting - always true for BDMs, checkbox value for admins
+    const commissionCheckbox = document.getElementById('hideSherminCommissions');
+    const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
+
+    try {
+        const response = await fetch(rateCardUrl('/generate-pdf', currentRetailer, hideCommissions));
+
+        if (response.ok) {
+            const blob = await response.blob();
+            const url = window.URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = currentRetailer.replace(/[^a-z0-9]/gi, '_') + '_Rate_Card.pdf';
+            document.body.appendChild(a);
+            a.click();
+            window.URL.revokeObjectURL(url);
+            document.getElementById('status').textContent = '✅ PDF downloaded!';
+            setTimeout(() => { document.getElementById('status').textContent = ''; }, 3000);
+        } else {
+            throw new Error('Failed to generate PDF');
+        }
+    } catch (error) {
+        document.getElementById('status').textContent = 'Error: ' + error.message;
+    }
+}
@@ -1,21 +1,164 @@
 import os
-from supabase import create_client, Client
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
 from dotenv import load_dotenv
 
+import shared_cache
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+# The supabase SDK is imported on first use rather than at module load, so
+# importing this module (and web_app) stays cheap on serverless cold starts.
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Supabase configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_ANON_KEY = os.getenv('SUPABASE_ANON_KEY')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 
-def get_supabase_client() -> Client:
-    """Get Supabase client instance"""
+# Connection pool tuning for the shared HTTP client behind both Supabase clients
+SUPABASE_HTTP_TIMEOUT = float(os.getenv('SUPABASE_HTTP_TIMEOUT', '10'))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', '20'))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_KEEPALIVE_EXPIRY', '60'))
+
+# Profile cache: profiles change rarely, but role edits should show up within the TTL
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '300'))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '1000'))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+class ProfileCache:
+    """Thread-safe TTL + LRU cache of profile rows keyed by user ID"""
+    
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, max_size: int = PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, user_id: str, profile: dict):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user's profile, or every profile when no ID is given"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+class SharedProfileCache:
+    """ProfileCache kept in the shared store, so an invalidation reaches every worker process"""
+    
+    NAMESPACE = 'profiles'
+    
+    def __init__(self, store: shared_cache.SqliteStore, ttl: float = PROFILE_CACHE_TTL,
+                 max_size: int = PROFILE_CACHE_SIZE):
+        self.store = store
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, user_id: str) -> Optional[dict]:
+        entry = self.store.get(self.NAMESPACE, user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['value']
+    
+    def set(self, user_id: str, profile: dict):
+        self.store.set(self.NAMESPACE, user_id, profile, self.ttl, max_entries=self.max_size)
+    
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user's profile, or every profile when no ID is given"""
+        self.store.delete(self.NAMESPACE, user_id)
+
+if shared_cache.store is not None:
+    profile_cache = SharedProfileCache(shared_cache.store)
+else:
+    profile_cache = ProfileCache()
+
+def _build_client(key: str) -> 'Client':
+    """Create a long-lived client on its own keep-alive HTTP connection pool"""
+    import httpx
+    from supabase import create_client, ClientOptions
+    
+    http_client = httpx.Client(
+        timeout=SUPABASE_HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+    )
+    # Sessions belong to the Flask session cookie, not to this shared client,
+    # so it must never persist or auto-refresh a signed-in user's tokens
+    options = ClientOptions(auto_refresh_token=False, persist_session=False, httpx_client=http_client)
+    return create_client(SUPABASE_URL, key, options)
+
+def _get_pooled_client(name: str, key: str) -> 'Client':
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _build_client(key)
+                _clients[name] = client
+    return client
+
+def get_supabase_client() -> 'Client':
+    """Get the shared anon-key client
+    
+    Only used for auth endpoints: signing in attaches that user's token to the
+    client, so table queries go through get_service_client instead.
+    """
     if not SUPABASE_URL or not SUPABASE_ANON_KEY:
         raise ValueError("Missing Supabase configuration. Check SUPABASE_URL and SUPABASE_ANON_KEY in .env file")
     
-    return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+    return _get_pooled_client('anon', SUPABASE_ANON_KEY)
+
+def get_service_client() -> 'Client':
+    """Get the shared service-role client (bypasses RLS)"""
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        raise ValueError("Missing Supabase configuration. Check SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY in .env file")
+    
+    return _get_pooled_client('service', SUPABASE_SERVICE_KEY)
+
+def reset_clients():
+    """Close and forget the pooled clients (e.g. after changing configuration)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.options.httpx_client.close()
+        _clients.clear()
 
 def authenticate_user(email: str, password: str):
     """Authenticate user with email and password"""
@@ -27,23 +170,47 @@ def authenticate_user(email: str, password: str):
         })
         return response
     except Exception as e:
-        print(f"Authentication error: {e}")
+        logger.warning("Authentication error: %s", e)
         return None
 
-def get_user_profile(user_id: str):
-    """Get user profile from profiles table"""
+def refresh_user_session(refresh_token: str):
+    """Exchange a refresh token for a new session"""
+    try:
+        supabase = get_supabase_client()
+        return supabase.auth.refresh_session(refresh_token)
+    except Exception as e:
+        logger.warning("Session refresh error: %s", e)
+        return None
+
+def get_user_profile(user_id: str, use_cache: bool = True):
+    """Get user profile from profiles table
+    
+    Profiles are served from a TTL/LRU cache; call invalidate_user_profile after
+    changing a profile to make the change visible immediately.
+    """
+    if use_cache:
+        profile = profile_cache.get(user_id)
+        if profile is not None:
+            return profile
+    
     try:
         # Use service role key for database queries (bypasses RLS)
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        supabase = get_service_client()
         response = supabase.table('profiles').select('*').eq('id', user_id).execute()
         
         if response.data and len(response.data) > 0:
-            return response.data[0]
+            profile = response.data[0]
+            profile_cache.set(user_id, profile)
+            return profile
         return None
     except Exception as e:
-        print(f"Profile fetch error: {e}")
+        logger.error("Profile fetch error: %s", e)
         return None
 
+def invalidate_user_profile(user_id: Optional[str] = None):
+    """Drop a cached profile (or all of them) so the next lookup hits Supabase"""
+    profile_cache.invalidate(user_id)
+
 def test_supabase_connection():
     """Test connection to Supabase"""
     try:
@@ -58,4 +225,4 @@ def test_supabase_connection():
 
 if __name__ == "__main__":
     # Test connection when run directly
-    test_supabase_connection()
\ No newline at end of file
+    test_supabase_connection()
@@ -0,0 +1,190 @@
+"""
+Local verification of Supabase access tokens
+
+The access token returned by ``sign_in_with_password`` is kept in the Flask
+session and checked on every request without calling Supabase: signature
+(HS256 with the project's JWT secret, or RS256/ES256 against the cached JWKS),
+expiry, audience and issuer.
+
+A token close to expiry is refreshed inline by the first request to notice.
+Supabase refresh tokens can be used once, so workers must not each refresh
+the same one: the refresh is claimed in a SQLite file shared by every process
+on the host (``SUPABASE_TOKEN_REFRESH_STORE``), other requests carrying the same
+cookie wait for its result, and the new tokens are kept for a while for any
+request that still arrives with the old refresh token.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SUPABASE_URL = (os.getenv('SUPABASE_URL') or '').rstrip('/')
+# Legacy projects sign tokens with a shared secret; newer ones publish a JWKS
+SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+SUPABASE_JWT_AUDIENCE = os.getenv('SUPABASE_JWT_AUDIENCE', 'authenticated')
+
+JWKS_CACHE_TTL = float(os.getenv('SUPABASE_JWKS_CACHE_TTL', '3600'))
+# Start refreshing this many seconds before the access token expires
+TOKEN_REFRESH_AHEAD = float(os.getenv('SUPABASE_TOKEN_REFRESH_AHEAD', '300'))
+# Tolerated clock skew between us and Supabase
+TOKEN_LEEWAY = float(os.getenv('SUPABASE_TOKEN_LEEWAY', '10'))
+# Where refreshes are claimed and their results kept, shared by every worker on the host
+TOKEN_REFRESH_STORE = (os.getenv('SUPABASE_TOKEN_REFRESH_STORE')
+                       or os.path.join(tempfile.gettempdir(), 'supabase_token_refresh.sqlite3'))
+# How long a refresh's new tokens are handed to requests still carrying the old refresh token
+TOKEN_REFRESH_RESULT_TTL = float(os.getenv('SUPABASE_TOKEN_REFRESH_RESULT_TTL', '600'))
+# Longest a request waits for another worker's refresh of the same token
+TOKEN_REFRESH_WAIT = float(os.getenv('SUPABASE_TOKEN_REFRESH_WAIT', '10'))
+REFRESH_POLL_INTERVAL = 0.05
+# Bound on the finished refreshes kept
+REFRESH_MAX_ENTRIES = 10000
+
+ASYMMETRIC_ALGORITHMS = ['RS256', 'ES256']
+
+_jwks_client = None
+_jwks_lock = threading.Lock()
+
+_refresh_store = None
+_refresh_store_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class TokenError(Exception):
+    """The access token is missing, malformed, forged or expired"""
+
+
+class TokenExpiredError(TokenError):
+    """The access token was valid but has expired - a refresh may recover it"""
+
+
+def _get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None:
+        with _jwks_lock:
+            if _jwks_client is None:
+                from jwt import PyJWKClient
+                _jwks_client = PyJWKClient(
+                    f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json",
+                    cache_keys=True,
+                    lifespan=JWKS_CACHE_TTL,
+                )
+    return _jwks_client
+
+
+def verify_access_token(token: str) -> dict:
+    """Verify a Supabase access token locally and return its claims
+
+    Raises TokenError if the token can't be trusted. Only the JWKS fetch (once
+    per JWKS_CACHE_TTL, or when an unknown key ID appears) touches the network.
+    """
+    import jwt
+
+    if not token:
+        raise TokenError("No access token")
+
+    try:
+        algorithm = jwt.get_unverified_header(token).get('alg')
+        if algorithm == 'HS256':
+            if not SUPABASE_JWT_SECRET:
+                raise TokenError("HS256 token but SUPABASE_JWT_SECRET is not configured")
+            key = SUPABASE_JWT_SECRET
+            algorithms = ['HS256']
+        elif algorithm in ASYMMETRIC_ALGORITHMS:
+            key = _get_jwks_client().get_signing_key_from_jwt(token).key
+            algorithms = [algorithm]
+        else:
+            raise TokenError(f"Unsupported token algorithm: {algorithm}")
+
+        options = {'require': ['exp', 'sub']}
+        issuer = f"{SUPABASE_URL}/auth/v1" if SUPABASE_URL else None
+        return jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=SUPABASE_JWT_AUDIENCE,
+            issuer=issuer,
+            leeway=TOKEN_LEEWAY,
+            options=options,
+        )
+    except jwt.ExpiredSignatureError as e:
+        raise TokenExpiredError("Access token expired") from e
+    except (jwt.InvalidTokenError, jwt.PyJWKClientError) as e:
+        raise TokenError(f"Invalid access token: {e}") from e
+
+
+def needs_refresh(claims: dict) -> bool:
+    """True once the token is inside the refresh-ahead window"""
+    return claims['exp'] - time.time() < TOKEN_REFRESH_AHEAD
+
+
+def session_tokens(auth_session) -> dict:
+    """The parts of a Supabase session kept in the Flask session cookie"""
+    return {
+        'access_token': auth_session.access_token,
+        'refresh_token': auth_session.refresh_token,
+    }
+
+
+def refresh_tokens(refresh_token: str) -> Optional[dict]:
+    """Exchange a refresh token for new tokens (blocking), or None on failure"""
+    from supabase_client import refresh_user_session
+
+    response = refresh_user_session(refresh_token)
+    if response and response.session:
+        return session_tokens(response.session)
+    return None
+
+
+def _get_refresh_store():
+    global _refresh_store
+    if _refresh_store is None:
+        with _refresh_store_lock:
+            if _refresh_store is None:
+                from shared_cache import SqliteStore
+                # It holds live tokens: create it readable by this user only
+                try:
+                    os.close(os.open(TOKEN_REFRESH_STORE, os.O_CREAT | os.O_WRONLY, 0o600))
+                except OSError:
+                    pass
+                _refresh_store = SqliteStore(TOKEN_REFRESH_STORE)
+    return _refresh_store
+
+
+def refresh_session(refresh_token: str) -> Optional[dict]:
+    """New tokens for ``refresh_token``, exchanged with Supabase at most once across workers
+
+    The first request to get here claims the refresh and records its result;
+    concurrent ones wait for it (up to TOKEN_REFRESH_WAIT) and later ones reuse
+    it, so the refresh token is never presented twice. None if the refresh
+    failed or the wait timed out. If the store can't be used, refreshes inline.
+    """
+    store = _get_refresh_store()
+    # Keyed by a digest so the refresh token itself isn't stored
+    key = hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+    deadline = time.monotonic() + TOKEN_REFRESH_WAIT
+    while True:
+        finished = store.get('refreshed', key)
+        if finished is not None:
+            return finished['value']
+        if store.add('refreshing', key, os.getpid(), TOKEN_REFRESH_WAIT) is not False:
+            break
+        if time.monotonic() >= deadline:
+            logger.warning("Timed out waiting for another worker to refresh the session")
+            return None
+        time.sleep(REFRESH_POLL_INTERVAL)
+
+    try:
+        tokens = refresh_tokens(refresh_token)
+        if tokens:
+            store.set('refreshed', key, tokens, TOKEN_REFRESH_RESULT_TTL, max_entries=REFRESH_MAX_ENTRIES)
+        return tokens
+    finally:
+        store.delete('refreshing', key)
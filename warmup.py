@@ -0,0 +1,162 @@
+"""
+Warm-up of Salesforce sessions and caches
+
+A warm-up run logs a pooled Salesforce session in, loads the retailer search
+index and builds the rate cards of the most requested retailers into the result
+cache, so the first real request after a deploy or cold start doesn't pay for
+them. Runs are triggered at startup (``WARMUP_ON_STARTUP``), every
+``WARMUP_INTERVAL`` seconds, or through the ``/warmup`` endpoint (Vercel cron).
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+WARMUP_ON_STARTUP = os.getenv('WARMUP_ON_STARTUP', 'false').lower() in ('1', 'true', 'yes')
+# Seconds between scheduled runs in a long-lived process; 0 disables the schedule
+WARMUP_INTERVAL = float(os.getenv('WARMUP_INTERVAL', '0'))
+WARMUP_TOP_RETAILERS = int(os.getenv('WARMUP_TOP_RETAILERS', '5'))
+# Retailers warmed before any requests have been counted, e.g. "Acme Solar,Heat Co"
+WARMUP_RETAILERS = [name.strip() for name in os.getenv('WARMUP_RETAILERS', '').split(',') if name.strip()]
+
+_status = {
+    'state': 'idle',
+    'runs': 0,
+    'started_at': None,
+    'finished_at': None,
+    'duration_seconds': None,
+    'current_step': None,
+    'steps_done': 0,
+    'steps_total': 0,
+    'steps': [],
+    'error': None,
+}
+_status_lock = threading.Lock()
+_run_lock = threading.Lock()
+_scheduler = None
+
+logger = logging.getLogger(__name__)
+
+
+def _update(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+
+def get_status() -> Dict:
+    """Progress of the current (or last) run, plus cache sizes"""
+    from rate_card_cache import result_cache, retailer_index
+
+    with _status_lock:
+        status = dict(_status)
+        status['steps'] = [dict(step) for step in _status['steps']]
+    status['result_cache'] = result_cache.stats()
+    status['retailer_index'] = retailer_index.stats()
+    return status
+
+
+def hot_retailers(limit: int = WARMUP_TOP_RETAILERS) -> List[str]:
+    """The most requested retailers, topped up with WARMUP_RETAILERS"""
+    from rate_card_cache import request_counter
+
+    retailers = request_counter.most_common(limit)
+    for name in WARMUP_RETAILERS:
+        if len(retailers) >= limit:
+            break
+        if name not in retailers:
+            retailers.append(name)
+    return retailers
+
+
+def _run_step(name: str, func):
+    with _status_lock:
+        _status['current_step'] = name
+    step = {'name': name, 'ok': True}
+    start = time.monotonic()
+    try:
+        func()
+    except Exception as e:
+        # One bad retailer must not stop the rest of the warm-up
+        step['ok'] = False
+        step['error'] = str(e)
+        logger.warning("Warm-up step %s failed: %s", name, e)
+    step['seconds'] = round(time.monotonic() - start, 3)
+    with _status_lock:
+        _status['steps'].append(step)
+        _status['steps_done'] += 1
+    return step['ok']
+
+
+def run_warmup(pool, limit: int = WARMUP_TOP_RETAILERS) -> bool:
+    """Warm ``pool`` and the caches; returns False if a run was already in progress"""
+    from rate_card_cache import data_fingerprint, get_rate_cards, retailer_index
+
+    if not _run_lock.acquire(blocking=False):
+        return False
+    try:
+        retailers = hot_retailers(limit)
+        started = time.time()
+        _update(state='running', started_at=started, finished_at=None, duration_seconds=None,
+                steps=[], steps_done=0, steps_total=2 + len(retailers), error=None)
+        logger.info("Warm-up started for %d retailers", len(retailers))
+
+        if not _run_step('salesforce_login', lambda: pool.prefill(1)):
+            _update(state='failed', error='Salesforce login failed')
+            return True
+
+        def load_index():
+            with pool.checkout() as gen:
+                retailer_index.load(gen.find_retailer(''))
+        _run_step('retailer_index', load_index)
+
+        for retailer_name in retailers:
+            def build(retailer_name=retailer_name):
+                with pool.checkout() as gen:
+                    get_rate_cards(gen, retailer_name, data_fingerprint(gen, retailer_name))
+            _run_step(f"rate_card:{retailer_name}", build)
+
+        finished = time.time()
+        _update(state='finished', finished_at=finished, duration_seconds=round(finished - started, 3))
+        logger.info("Warm-up finished in %.2fs", finished - started)
+        return True
+    except Exception as e:
+        _update(state='failed', error=str(e))
+        raise
+    finally:
+        with _status_lock:
+            _status['runs'] += 1
+            _status['current_step'] = None
+        _run_lock.release()
+
+
+def start_warmup(pool, limit: int = WARMUP_TOP_RETAILERS) -> bool:
+    """Run a warm-up on a background thread; False if one is already running"""
+    if _run_lock.locked():
+        return False
+    threading.Thread(target=run_warmup, args=(pool, limit), daemon=True).start()
+    return True
+
+
+def start_scheduler(get_pool, interval: float = WARMUP_INTERVAL):
+    """Warm up now and then every ``interval`` seconds (once if interval is 0)
+
+    ``get_pool`` is called on the scheduler thread, so creating the pool (and
+    importing pandas and simple_salesforce) stays off the caller's thread.
+    """
+    global _scheduler
+    if _scheduler is not None:
+        return
+
+    def loop():
+        while True:
+            try:
+                run_warmup(get_pool())
+            except Exception as e:
+                logger.exception("Warm-up failed: %s", e)
+            if interval <= 0:
+                break
+            time.sleep(interval)
+
+    _scheduler = threading.Thread(target=loop, daemon=True)
+    _scheduler.start()
@@ -1,35 +1,141 @@
 # web_app.py
-from flask import Flask, render_template, request, send_file, jsonify, send_from_directory, session, redirect, url_for
+from flask import Flask, render_template, request, send_file, jsonify, send_from_directory, session, redirect, url_for, Response, stream_with_context, make_response, g
 import os
-from rate_card_generator import RateCardGenerator
-from pdf_generator import PDFGenerator
+import queue
+import threading
+import contextvars
+import hashlib
+import gzip
+import time
+# rate_card_generator (pandas, openpyxl, simple_salesforce) and pdf_generator
+# (reportlab) are imported inside the routes that use them, so serverless cold
+# starts for /login and /dashboard don't pay for them.
 from supabase_client import authenticate_user, get_user_profile
+from supabase_jwt import (TokenError, TokenExpiredError, verify_access_token, needs_refresh,
+                          session_tokens, refresh_session)
+from assets import asset_url, serve_asset
+from circuit_breaker import SalesforceUnavailable
+from salesforce_pool import PoolExhausted
+import rate_card_cache
+import warmup
+import change_events
+from precompute import artifact_store
+import instrumentation
+import api_budget
+import query_planner
+import circuit_breaker
+import rate_card_snapshots
+import retailer_search
+import columnar
 from dotenv import load_dotenv
+from log_config import setup_logging
+import logging
 import tempfile
 import json
 
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static')
 app.secret_key = 'shermin_rate_card_secret_key_2025'  # For session management
+instrumentation.init_app(app)  # Server-Timing headers and /metrics histograms
+
+# Session keys set at login and cleared at logout
+SESSION_KEYS = ('authenticated', 'user_profile', 'user_email', 'user_id', 'access_token', 'refresh_token')
+
+# Endpoints served without looking at the signed-in user
+PUBLIC_ENDPOINTS = {'login', 'logout', 'static', 'serve_static', 'serve_fingerprinted_asset'}
+
+def clear_session():
+    for key in SESSION_KEYS:
+        session.pop(key, None)
+
+@app.before_request
+def validate_session_token():
+    """Verify the session's Supabase access token locally on every request
+    
+    No network I/O on the normal path. Inside the refresh-ahead window, or once
+    the token has expired, it is refreshed inline (once across all workers, see
+    supabase_jwt.refresh_session) and the new tokens go out in this response's cookie.
+    """
+    g.user_claims = None
+    if request.endpoint in PUBLIC_ENDPOINTS or not session.get('authenticated'):
+        return
+    
+    refresh_token = session.get('refresh_token')
+    try:
+        claims = verify_access_token(session.get('access_token'))
+    except TokenExpiredError:
+        claims = None
+    except TokenError as e:
+        logger.warning("Rejected session token: %s", e)
+        clear_session()
+        return
+    
+    if refresh_token and (claims is None or needs_refresh(claims)):
+        tokens = refresh_session(refresh_token)
+        if tokens:
+            session.update(tokens)
+            try:
+                claims = verify_access_token(tokens['access_token'])
+            except TokenError as e:
+                logger.warning("Refreshed access token rejected: %s", e)
+                clear_session()
+                return
+    if claims is None:
+        # Expired and couldn't be refreshed (a token still inside the window stays usable)
+        clear_session()
+        return
+    g.user_claims = claims
+
+@app.before_request
+def charge_salesforce_calls():
+    """Attribute this request's Salesforce API calls to the signed-in user"""
+    claims = g.get('user_claims')
+    api_budget.start_request((claims.get('email') or claims['sub']) if claims else 'anonymous')
+
+@app.after_request
+def report_salesforce_calls(response):
+    """Expose how many Salesforce API calls the request cost (streams aren't finished yet)"""
+    calls = api_budget.request_calls()
+    if calls:
+        response.headers['X-Salesforce-API-Calls'] = str(calls)
+    return response
 
 def get_current_user():
-    """Get current user profile from session"""
+    """Get current user profile
+    
+    Looked up by the verified token's subject through the short-TTL profile
+    cache, so role changes in profiles apply without signing in again.
+    """
+    claims = g.get('user_claims')
+    if claims:
+        profile = get_user_profile(claims['sub'])
+        if profile:
+            return profile
     return session.get('user_profile')
 
-# Initialize Salesforce connection
-generator = None
+# Pool of authenticated Salesforce sessions, created on first use
+salesforce_pool = None
+salesforce_pool_lock = threading.Lock()
+
+def get_salesforce_pool():
+    global salesforce_pool
+    if salesforce_pool is None:
+        with salesforce_pool_lock:
+            if salesforce_pool is None:
+                from salesforce_pool import SalesforcePool
+                salesforce_pool = SalesforcePool.from_env()
+    return salesforce_pool
 
-def get_generator():
-    global generator
-    if generator is None:
-        generator = RateCardGenerator(
-            os.getenv('SF_USERNAME'),
-            os.getenv('SF_PASSWORD'),
-            os.getenv('SF_TOKEN'),
-            os.getenv('SF_DOMAIN', 'login')
-        )
-    return generator
+def checkout_generator():
+    """Borrow a RateCardGenerator (with its own Salesforce session) for a with block"""
+    return get_salesforce_pool().checkout()
+
+# Warm-up runs on a background thread, so enabling it doesn't slow the cold start
+if warmup.WARMUP_ON_STARTUP or warmup.WARMUP_INTERVAL > 0:
+    warmup.start_scheduler(get_salesforce_pool)
 
 # Simple tool structure in web_app.py
 AVAILABLE_TOOLS = {
@@ -55,12 +161,19 @@ def get_available_tools(user_role):
     return user_tools
 
 def is_authenticated():
-    return session.get('authenticated', False)
+    return session.get('authenticated', False) and g.get('user_claims') is not None
+
+app.add_template_global(asset_url)
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory('static', filename)
 
+@app.route('/assets/<path:filename>')
+def serve_fingerprinted_asset(filename):
+    """Static files addressed by content hash, cached for a year"""
+    return serve_asset(filename)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -79,6 +192,9 @@ def login():
                 session['authenticated'] = True
                 session['user_profile'] = user_profile
                 session['user_email'] = email
+                session['user_id'] = auth_response.user.id
+                # Kept so each request can be verified locally (see validate_session_token)
+                session.update(session_tokens(auth_response.session))
                 return redirect(url_for('dashboard'))
             else:
                 return render_login_page(error="User profile not found. Please contact administrator.")
@@ -89,9 +205,7 @@ def login():
 
 @app.route('/logout')
 def logout():
-    session.pop('authenticated', None)
-    session.pop('user_profile', None)
-    session.pop('user_email', None)
+    clear_session()
     return redirect(url_for('login'))
 
 def render_login_page(error=None):
@@ -116,435 +230,11 @@ def rate_card_generator():
     if not is_authenticated():
         return redirect(url_for('login'))
     
-    # Keep existing HTML unchanged (copy from current index route)
-    return '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Stax Rate Card Generator</title>
-        <style>
-            body { font-family: Arial, sans-serif; max-width: 1200px; margin: 0 auto; padding: 20px; background: #f9f9f9; }
-            .header-container { position: relative; }
-            .logout-btn { 
-                position: absolute; 
-                top: 10px; 
-                right: 10px; 
-                background-color: #666; 
-                color: white; 
-                padding: 8px 15px; 
-                font-size: 14px; 
-                text-decoration: none; 
-                border-radius: 4px;
-                transition: background-color 0.3s;
-            }
-            .logout-btn:hover { background-color: #555; }
-            .dashboard-btn { 
-                position: absolute; 
-                top: 10px; 
-                left: 10px; 
-                background-color: #477085; 
-                color: white; 
-                padding: 8px 15px; 
-                font-size: 14px; 
-                text-decoration: none; 
-                border-radius: 4px;
-                transition: background-color 0.3s;
-            }
-            .dashboard-btn:hover { background-color: #365566; }
-            .logo-container { text-align: center; margin-bottom: 30px; }
-            .logo { max-width: 300px; height: auto; }
-            h1 { color: #477085; text-align: center; margin-top: 20px; }
-            h2 { color: #477085; margin-top: 30px; margin-bottom: 15px; }
-            .form-group { margin-bottom: 20px; text-align: center; }
-            input, button { padding: 10px; font-size: 16px; border-radius: 4px; }
-            input { width: 300px; border: 1px solid #ddd; }
-            button { 
-                background-color: #2ab7e3; 
-                color: white; 
-                border: none; 
-                cursor: pointer; 
-                margin: 0 5px;
-                transition: background-color 0.3s;
-            }
-            button:hover { background-color: #1a97c3; }
-            button:disabled { 
-                background-color: #ccc; 
-                cursor: not-allowed; 
-            }
-            .download-button {
-                background-color: #477085;
-                padding: 12px 24px;
-                font-size: 18px;
-                margin: 10px;
-            }
-            .download-button:hover { background-color: #365566; }
-            #results { margin-top: 20px; }
-            .retailer-option { 
-                padding: 10px; 
-                cursor: pointer; 
-                border: 1px solid #ddd; 
-                margin: 5px 0; 
-                background: white;
-                border-radius: 4px;
-                transition: all 0.2s;
-            }
-            .retailer-option:hover { 
-                background-color: #e8f4f8; 
-                border-color: #2ab7e3;
-                transform: translateX(5px);
-            }
-            #status { margin-top: 20px; color: #666; text-align: center; }
-            
-            /* Rate card display styles */
-            #rateCardDisplay {
-                display: none;
-                margin-top: 30px;
-                background: white;
-                padding: 30px;
-                border-radius: 8px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            }
-            .rate-card-header {
-                border-bottom: 2px solid #477085;
-                padding-bottom: 20px;
-                margin-bottom: 30px;
-            }
-            .rate-card-header h2 {
-                margin: 0;
-                color: #477085;
-            }
-            .generation-date {
-                color: #666;
-                font-size: 14px;
-                margin-top: 5px;
-            }
-            .download-section {
-                text-align: center;
-                margin: 30px 0;
-                padding: 20px;
-                background: #f5f5f5;
-                border-radius: 8px;
-            }
-            .rate-table {
-                width: 100%;
-                border-collapse: collapse;
-                margin-bottom: 30px;
-            }
-            .rate-table th {
-                background-color: #477085;
-                color: white;
-                padding: 12px;
-                text-align: left;
-                font-weight: bold;
-            }
-            .rate-table td {
-                padding: 10px;
-                border-bottom: 1px solid #ddd;
-            }
-            .rate-table tr:nth-child(even) {
-                background-color: #f5f5f5;
-            }
-            .rate-table tr:hover {
-                background-color: #e8f4f8;
-            }
-            .product-vertical-section {
-                margin-bottom: 40px;
-            }
-            .product-vertical-title {
-                color: #477085;
-                font-size: 20px;
-                margin-bottom: 15px;
-                padding-bottom: 10px;
-                border-bottom: 1px solid #ddd;
-            }
-            .loading-spinner {
-                display: inline-block;
-                width: 20px;
-                height: 20px;
-                border: 3px solid #f3f3f3;
-                border-top: 3px solid #2ab7e3;
-                border-radius: 50%;
-                animation: spin 1s linear infinite;
-                margin-left: 10px;
-                vertical-align: middle;
-            }
-            @keyframes spin {
-                0% { transform: rotate(0deg); }
-                100% { transform: rotate(360deg); }
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header-container">
-            <a href="/dashboard" class="dashboard-btn">← Dashboard</a>
-            <a href="/logout" class="logout-btn">Logout</a>
-            <div class="logo-container">
-                <img src="/static/stax-logo.png" alt="Stax - Simply. Payments." class="logo" style="max-width: 200px; height: auto;">
-            </div>
-            <h1>Rate Card Generator</h1>
-        </div>
-    ''' + '''
-        <div class="form-group">
-            <input type="text" id="retailerSearch" placeholder="Enter retailer name..." />
-            <button onclick="searchRetailers()">Search</button>
-        </div>
-        <!-- Commission checkbox only shown for admin users -->
-        <div class="form-group" id="commissionGroup" style="display: none;">
-            <label style="display: flex; align-items: center; justify-content: center; gap: 8px; font-size: 14px; color: #666;">
-                <input type="checkbox" id="hideSherminCommissions" style="margin: 0;">
-                Hide Shermin Commissions?
-            </label>
-        </div>
-        <div id="results"></div>
-        <div id="status"></div>
-        
-        <div id="rateCardDisplay">
-            <div class="rate-card-header">
-                <h2 id="retailerTitle"></h2>
-                <div class="generation-date" id="generationDate"></div>
-            </div>
-            
-            <div class="download-section">
-                <h3>Download Rate Card</h3>
-                <button class="download-button" onclick="downloadExcel()">📊 Download as Excel</button>
-                <button class="download-button" onclick="downloadPDF()">📄 Download as PDF</button>
-            </div>
-            
-            <div id="rateCardContent"></div>
-        </div>
-        
-        <script>
-            let currentRetailer = null;
-            let currentRateCardData = null;
-            let userRole = null;
-            
-            // Get user info and show commission checkbox for admin users
-            async function initializeUserInterface() {
-                try {
-                    const response = await fetch('/user-info');
-                    const userInfo = await response.json();
-                    userRole = userInfo.role;
-                    
-                    // Show commission checkbox only for admin users
-                    if (userRole === 'admin') {
-                        document.getElementById('commissionGroup').style.display = 'block';
-                    }
-                } catch (error) {
-                    console.error('Failed to get user info:', error);
-                }
-            }
-            
-            // Initialize on page load
-            document.addEventListener('DOMContentLoaded', initializeUserInterface);
-            async function searchRetailers() {
-                const search = document.getElementById('retailerSearch').value;
-                if (!search) return;
-                
-                document.getElementById('status').textContent = 'Searching...';
-                document.getElementById('results').innerHTML = '';
-                
-                try {
-                    const response = await fetch('/search?q=' + encodeURIComponent(search));
-                    const data = await response.json();
-                    
-                    // Check if the response is an error
-                    if (data.error) {
-                        document.getElementById('status').textContent = 'Error: ' + data.error;
-                        document.getElementById('results').innerHTML = '';
-                        return;
-                    }
-                    
-                    // Handle successful response (array of retailers)
-                    if (data.length === 0) {
-                        document.getElementById('results').innerHTML = '<p>No retailers found</p>';
-                    } else {
-                        const html = data.map(r => 
-                            `<div class="retailer-option" onclick="generateRateCard('${r.name}')"">${r.name}</div>`
-                        ).join('');
-                        document.getElementById('results').innerHTML = html;
-                    }
-                    document.getElementById('status').textContent = '';
-                } catch (error) {
-                    document.getElementById('status').textContent = 'Error: ' + error.message;
-                    document.getElementById('results').innerHTML = '';
-                }
-            }
-    ''' + '''
-            async function generateRateCard(retailerName) {
-                document.getElementById('status').innerHTML = 'Generating rate card for ' + retailerName + '...<span class="loading-spinner"></span>';
-                document.getElementById('results').innerHTML = '';
-                currentRetailer = retailerName;
-                
-                // Get commission setting - always true for BDMs, checkbox value for admins
-                const commissionCheckbox = document.getElementById('hideSherminCommissions');
-                const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
-                
-                try {
-                    const response = await fetch('/generate-data', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({retailer: retailerName, hide_commissions: hideCommissions})
-                    });
-                    
-                    if (response.ok) {
-                        const data = await response.json();
-                        currentRateCardData = data;
-                        displayRateCard(data);
-                        document.getElementById('status').textContent = '';
-                    } else {
-                        throw new Error('Failed to generate rate card');
-                    }
-                } catch (error) {
-                    document.getElementById('status').textContent = 'Error: ' + error.message;
-                }
-            }
-            
-            function displayRateCard(data) {
-                // Update header
-                document.getElementById('retailerTitle').textContent = currentRetailer + ' - Rate Card Analysis';
-                document.getElementById('generationDate').textContent = 'Generated: ' + new Date().toLocaleDateString('en-GB', { 
-                    day: 'numeric', 
-                    month: 'long', 
-                    year: 'numeric' 
-                });
-                
-                // Clear and populate content
-                const contentDiv = document.getElementById('rateCardContent');
-                contentDiv.innerHTML = '';
-                
-                // Process each product vertical
-                for (const [vertical, rows] of Object.entries(data)) {
-                    if (rows.length === 0) continue;
-                    
-                    const section = document.createElement('div');
-                    section.className = 'product-vertical-section';
-                    
-                    const title = document.createElement('h3');
-                    title.className = 'product-vertical-title';
-                    title.textContent = vertical + ' Waterfall';
-                    section.appendChild(title);
-                    
-                    const table = document.createElement('table');
-                    table.className = 'rate-table';
-                    
-                    // Check if we should hide commissions
-                    // Get commission setting - always true for BDMs, checkbox value for admins
-                const commissionCheckbox = document.getElementById('hideSherminCommissions');
-                const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
-                    
-                    // Header
-                    const thead = document.createElement('thead');
-                    const headerRow = document.createElement('tr');
-                    const headers = hideCommissions 
-                        ? ['Lender', 'Position', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy']
-                        : ['Lender', 'Position', 'Shermin Commission', 'Term', 'Product Type', 'Deferred Period', 'APR Range', 'Subsidy'];
-                    
-                    headers.forEach(header => {
-                        const th = document.createElement('th');
-                        th.textContent = header;
-                        headerRow.appendChild(th);
-                    });
-                    thead.appendChild(headerRow);
-                    table.appendChild(thead);
-                    
-                    // Body
-                    const tbody = document.createElement('tbody');
-                    rows.forEach(row => {
-                        const tr = document.createElement('tr');
-                        const dataKeys = hideCommissions 
-                            ? ['Lender_Name', 'Position', 'Term', 'Product_Type', 'Deferred_Period', 'APR_Range', 'Subsidy']
-                            : ['Lender_Name', 'Position', 'Shermin_Commission', 'Term', 'Product_Type', 'Deferred_Period', 'APR_Range', 'Subsidy'];
-                        
-                        dataKeys.forEach(key => {
-                            const td = document.createElement('td');
-                            td.textContent = row[key] || '';
-                            tr.appendChild(td);
-                        });
-                        tbody.appendChild(tr);
-                    });
-                    table.appendChild(tbody);
-                    
-                    section.appendChild(table);
-                    contentDiv.appendChild(section);
-                }
-                
-                // Show the rate card display
-                document.getElementById('rateCardDisplay').style.display = 'block';
-            }
-            
-            async function downloadExcel() {
-                if (!currentRetailer) return;
-                
-                document.getElementById('status').innerHTML = 'Generating Excel file...<span class="loading-spinner"></span>';
-                
-                // Get commission setting - always true for BDMs, checkbox value for admins
-                const commissionCheckbox = document.getElementById('hideSherminCommissions');
-                const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
-                
-                try {
-                    const response = await fetch('/generate', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({retailer: currentRetailer, hide_commissions: hideCommissions})
-                    });
-                    
-                    if (response.ok) {
-                        const blob = await response.blob();
-                        const url = window.URL.createObjectURL(blob);
-                        const a = document.createElement('a');
-                        a.href = url;
-                        a.download = currentRetailer.replace(/[^a-z0-9]/gi, '_') + '_Rate_Card.xlsx';
-                        document.body.appendChild(a);
-                        a.click();
-                        window.URL.revokeObjectURL(url);
-                        document.getElementById('status').textContent = '✅ Excel downloaded!';
-                        setTimeout(() => { document.getElementById('status').textContent = ''; }, 3000);
-                    } else {
-                        throw new Error('Failed to generate Excel');
-                    }
-                } catch (error) {
-                    document.getElementById('status').textContent = 'Error: ' + error.message;
-                }
-            }
-            
-            async function downloadPDF() {
-                if (!currentRetailer) return;
-                
-                document.getElementById('status').innerHTML = 'Generating PDF file...<span class="loading-spinner"></span>';
-                
-                // Get commission setting - always true for BDMs, checkbox value for admins
-                const commissionCheckbox = document.getElementById('hideSherminCommissions');
-                const hideCommissions = userRole === 'admin' ? (commissionCheckbox ? commissionCheckbox.checked : false) : true;
-                
-                try {
-                    const response = await fetch('/generate-pdf', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({retailer: currentRetailer, hide_commissions: hideCommissions})
-                    });
-                    
-                    if (response.ok) {
-                        const blob = await response.blob();
-                        const url = window.URL.createObjectURL(blob);
-                        const a = document.createElement('a');
-                        a.href = url;
-                        a.download = currentRetailer.replace(/[^a-z0-9]/gi, '_') + '_Rate_Card.pdf';
-                        document.body.appendChild(a);
-                        a.click();
-                        window.URL.revokeObjectURL(url);
-                        document.getElementById('status').textContent = '✅ PDF downloaded!';
-                        setTimeout(() => { document.getElementById('status').textContent = ''; }, 3000);
-                    } else {
-                        throw new Error('Failed to generate PDF');
-                    }
-                } catch (error) {
-                    document.getElementById('status').textContent = 'Error: ' + error.message;
-                }
-            }
-        </script>
-    </body>
-    </html>
-    '''
+    # Small shell page - the CSS/JS are fingerprinted assets cached by the browser
+    response = make_response(render_template('rate_card_generator.html'))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/')
 def index():
@@ -560,23 +250,47 @@ def search_retailers():
         return jsonify({'error': 'Authentication required'}), 401
     
     query = request.args.get('q', '')
+    limit = retailer_search.clamp_page_size(request.args.get('limit', type=int))
+    cursor = request.args.get('cursor')
     user_profile = get_current_user()
     
     try:
-        gen = get_generator()
-        
+        retailer_search.decode_cursor(cursor)
+    except retailer_search.CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
         # Apply user-based filtering
         if user_profile['role'] == 'admin':
             # Admin users see all retailers
-            retailers = gen.find_retailer(query)
+            salesforce_id = None
         else:
             # Regular users only see retailers they own
             salesforce_id = user_profile.get('salesforce_id')
             if not salesforce_id:
                 return jsonify({'error': 'User profile missing Salesforce ID. Please contact administrator.'}), 400
-            retailers = gen.find_retailer(query, salesforce_id)
         
-        return jsonify([{'name': r['Name'], 'id': r['Id']} for r in retailers[:20]])
+        page = rate_card_cache.retailer_index.search_page(query, salesforce_id, limit, cursor)
+        if page is None:
+            budget_problem = api_budget.governor.check(cost=1)
+            outage = None
+            if not budget_problem:
+                try:
+                    with checkout_generator() as gen:
+                        page = rate_card_cache.search_retailer_page(gen, query, salesforce_id, limit, cursor)
+                except SALESFORCE_DOWN as e:
+                    outage = salesforce_outage(None, e)
+            if page is None:
+                # Search an expired index rather than spend scarce API calls on it (or wait on Salesforce)
+                page = rate_card_cache.retailer_index.search_page(query, salesforce_id, limit, cursor, allow_stale=True)
+                if page is None:
+                    return no_stale_response(budget_problem, outage)
+        
+        # The body stays a plain list; the cursor for the next page travels in a header
+        response = jsonify([{'name': r['Name'], 'id': r['Id']} for r in page['retailers']])
+        if page['next_cursor']:
+            response.headers['X-Next-Cursor'] = page['next_cursor']
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -593,94 +307,591 @@ def user_info():
         'name': user_profile['full_name']
     })
 
-@app.route('/generate-data', methods=['POST'])
-def generate_data():
-    """Generate rate card data and return as JSON for display"""
+@app.route('/health/salesforce')
+def salesforce_health():
+    """Salesforce session pool metrics (admin only)"""
+    if not is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if get_current_user()['role'] != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    return jsonify({**get_salesforce_pool().stats(), 'api_usage': api_budget.governor.stats(),
+                    'query_plans': query_planner.plan_log.stats(),
+                    'circuit_breakers': circuit_breaker.breakers.stats(),
+                    'refreshing': rate_card_cache.refresher.running(),
+                    'fingerprint_cache': rate_card_cache.fingerprint_cache.stats(),
+                    'change_index': change_events.reverse_index.stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this process (bearer METRICS_TOKEN, or an admin session)"""
+    metrics_token = os.getenv('METRICS_TOKEN')
+    if not (metrics_token and request.headers.get('Authorization') == f"Bearer {metrics_token}"):
+        if not is_authenticated():
+            return jsonify({'error': 'Authentication required'}), 401
+        if get_current_user()['role'] != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+    
+    api_stats = api_budget.governor.stats()
+    gauges = {
+        'result_cache_entries': ('Rate cards held in the result cache',
+                                 rate_card_cache.result_cache.stats()['entries']),
+        'salesforce_api_budget_remaining': ('Calls left in this process\'s hourly API token bucket',
+                                            api_stats['global_budget_remaining']),
+        'stale_responses': ('Responses served from stale data because the API budget was low or Salesforce was down',
+                            api_stats['degraded_responses']),
+        'salesforce_circuits_open': ('Salesforce query types whose circuit breaker is open or half-open',
+                                     circuit_breaker.breakers.open_count()),
+    }
+    if api_stats['org_api_total'] is not None:
+        gauges['salesforce_org_api_used'] = ('Org API calls used today (Sforce-Limit-Info)', api_stats['org_api_used'])
+        gauges['salesforce_org_api_limit'] = ('Org daily API allocation (Sforce-Limit-Info)', api_stats['org_api_total'])
+    # Only report the pool if a request already created it; a scrape shouldn't log in
+    if salesforce_pool is not None:
+        pool_stats = salesforce_pool.stats()
+        gauges['salesforce_pool_sessions'] = ('Logged-in Salesforce sessions', pool_stats['sessions'])
+        gauges['salesforce_pool_in_use'] = ('Salesforce sessions checked out', pool_stats['in_use'])
+    
+    return Response(instrumentation.registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+def is_cron_request():
+    """True for Vercel cron invocations, which send ``Authorization: Bearer $CRON_SECRET``"""
+    cron_secret = os.getenv('CRON_SECRET')
+    return bool(cron_secret) and request.headers.get('Authorization') == f"Bearer {cron_secret}"
+
+@app.route('/warmup', methods=['GET', 'POST'])
+def run_warmup():
+    """Run a warm-up (Vercel cron) or start one in the background (admin)
+    
+    Cron invocations run to completion before responding, since a serverless
+    function may be frozen as soon as its response has been sent.
+    """
+    if is_cron_request():
+        started = warmup.run_warmup(get_salesforce_pool())
+        return jsonify({'started': started, 'status': warmup.get_status()})
+    
     if not is_authenticated():
         return jsonify({'error': 'Authentication required'}), 401
-    retailer_name = request.json.get('retailer')
-    hide_commissions = request.json.get('hide_commissions', False)
+    if get_current_user()['role'] != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    started = warmup.start_warmup(get_salesforce_pool())
+    return jsonify({'started': started, 'status': warmup.get_status()}), 202 if started else 200
+
+@app.route('/warmup/status')
+def warmup_status():
+    """Progress and duration of the current or last warm-up run"""
+    if not is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    return jsonify(warmup.get_status())
+
+@app.route('/webhooks/salesforce-changes', methods=['POST'])
+def salesforce_changes():
+    """Drop the cached rate cards affected by Salesforce Outbound Messages or CDC events
+    
+    Authenticated with CHANGE_WEBHOOK_SECRET (bearer header or ``?token=``).
+    ``?action=refresh`` also rebuilds them in the background. While Salesforce
+    can't be asked which retailers a change affects the notification isn't
+    acknowledged, so it is delivered again.
+    """
+    if not change_events.authorized(request.headers.get('Authorization'), request.args.get('token')):
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    action = request.args.get('action', change_events.CHANGE_EVENT_ACTION)
+    if action not in change_events.ACTIONS:
+        return jsonify({'error': f"Unknown action {action}"}), 400
+    try:
+        changes, outbound = change_events.parse_notification(request.get_data(), request.content_type,
+                                                             request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        result = change_events.apply(changes, get_salesforce_pool, action)
+    except SALESFORCE_DOWN as e:
+        logger.warning("Change notification not acknowledged: %s", e)
+        return jsonify({'error': str(e)}), 503
+    
+    if outbound:
+        return Response(change_events.OUTBOUND_ACK, mimetype='text/xml')
+    return jsonify(result)
+
+# Authenticated data: browsers may store it but must revalidate every time
+RATE_CARD_CACHE_CONTROL = 'private, no-cache'
+
+def get_rate_card_request():
+    """Read retailer and hide_commissions from the query string (GET) or JSON body (POST)"""
+    if request.method in ('GET', 'HEAD'):
+        retailer_name = request.args.get('retailer')
+        hide_commissions = request.args.get('hide_commissions', 'false').lower() in ('1', 'true', 'yes')
+    else:
+        payload = request.get_json(silent=True) or {}
+        retailer_name = payload.get('retailer')
+        hide_commissions = payload.get('hide_commissions', False)
     
     # For BDM users, always hide commissions regardless of checkbox
     user_profile = get_current_user()
     if user_profile['role'] != 'admin':
         hide_commissions = True
+    return retailer_name, hide_commissions
+
+def rate_card_etag(fingerprint, variant):
+    """Strong ETag for one representation of a retailer's rate card
+    
+    Only set for GET/HEAD, since POST responses are never reused by caches.
+    None when the data fingerprint couldn't be built so the request still succeeds.
+    """
+    if request.method not in ('GET', 'HEAD') or fingerprint is None:
+        return None
+    return hashlib.sha256(f"{fingerprint}:{variant}".encode('utf-8')).hexdigest()[:32]
+
+def add_cache_headers(response, etag):
+    """Attach the validator and caching policy to a rate card response"""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = RATE_CARD_CACHE_CONTROL
+        # Content depends on who is signed in (role controls commissions)
+        response.vary.add('Cookie')
+    return response
+
+def not_modified_response(etag):
+    """Return a 304 if the client already holds this ETag, otherwise None"""
+    if etag and request.if_none_match.contains(etag):
+        return add_cache_headers(Response(status=304), etag)
+    return None
+
+# Salesforce can't be asked right now: answered with the last good rate card instead
+SALESFORCE_DOWN = (SalesforceUnavailable, PoolExhausted)
+
+def stale_rate_card(retailer_name, artifact):
+    """Last known rate card for when the API budget is low or Salesforce is down
+    
+    Returns (artifact path, None, age) for a precomputed file, (None, data, age)
+    for a cached or snapshotted rate card, or (None, None, None) if there is
+    nothing to fall back on. The freshest source wins; age is in seconds.
+    """
+    candidates = []
+    path = artifact_store.latest_path(retailer_name, artifact)
+    if path is not None:
+        candidates.append((path, None, time.time() - os.path.getmtime(path)))
+    last_good = stale_rate_card_data(retailer_name)
+    if last_good is not None:
+        candidates.append((None,) + last_good)
+    if not candidates:
+        return None, None, None
+    return min(candidates, key=lambda candidate: candidate[2])
+
+def stale_rate_card_data(retailer_name):
+    """(data, age in seconds) of the last processed rate card, cached or snapshotted, or None"""
+    data = rate_card_cache.result_cache.get_stale(retailer_name)
+    if data is not None:
+        return data, rate_card_cache.result_cache.age(retailer_name) or 0
+    # The snapshot outlives restarts, but is only read when nothing newer is in memory
+    return rate_card_snapshots.snapshot_store.last_good(retailer_name)
+
+def salesforce_outage(retailer_name, error):
+    """Reason to serve a stale rate card; also starts rebuilding it in the background"""
+    logger.warning("Salesforce unavailable for %s: %s", retailer_name, error)
+    if retailer_name:
+        rate_card_cache.refresher.start(get_salesforce_pool, retailer_name)
+    return f"Salesforce is unavailable: {error}"
+
+def budget_exhausted_response(reason):
+    """429 for when the API budget is low and nothing cached can be served"""
+    response = jsonify({'error': reason})
+    response.status_code = 429
+    response.headers['Retry-After'] = '300'
+    return response
+
+def salesforce_unavailable_response(reason):
+    """503 for when Salesforce is down and nothing cached can be served"""
+    response = jsonify({'error': reason})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(circuit_breaker.SF_BREAKER_RESET_SECONDS))
+    return response
+
+def no_stale_response(budget_problem, outage):
+    """The 429 or 503 for when there is no stale rate card to serve instead"""
+    return salesforce_unavailable_response(outage) if outage else budget_exhausted_response(budget_problem)
+
+def mark_stale(response, reason, age=None):
+    """Flag a response built from old data because the API budget is low or Salesforce is down"""
+    api_budget.governor.note_degraded()
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    response.headers['X-Rate-Card-Stale'] = reason
+    if age is not None:
+        response.headers['X-Rate-Card-Age'] = str(int(age))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def wants_ndjson():
+    """True when the client asked for newline-delimited JSON streaming"""
+    return (request.args.get('stream') == 'ndjson' or
+            'application/x-ndjson' in request.headers.get('Accept', ''))
+
+def wants_columnar():
+    """True when the client asked for the columnar, dictionary-encoded JSON payload (see columnar)"""
+    return request.args.get('format') == 'columnar'
+
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+
+def accepts_gzip():
+    return bool(request.accept_encodings['gzip'])
+
+def gzip_response(response):
+    """Compress a buffered response body for clients that accept gzip"""
+    response.vary.add('Accept-Encoding')
+    if (accepts_gzip() and not response.direct_passthrough and
+            (response.content_length or 0) >= GZIP_MIN_BYTES):
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def stream_rate_card_ndjson(retailer_name, fingerprint, rate_card_data=None):
+    """Yield one NDJSON line per product vertical as soon as it is processed
+    
+    Each vertical's rows are serialised straight from its DataFrame, so the full
+    response is never held in memory as one dict. The Salesforce session is held
+    until the last line has been produced. Cached (or given) rate cards are
+    streamed without a session; freshly built ones are added to the cache.
+    """
+    def ndjson_line(vertical, df):
+        return '{"vertical": %s, "rows": %s}\n' % (json.dumps(vertical), df.to_json(orient='records'))
+    
+    try:
+        cached = rate_card_data if rate_card_data is not None else rate_card_cache.result_cache.get(retailer_name, fingerprint)
+        if cached is not None:
+            for vertical, df in cached.items():
+                yield ndjson_line(vertical, df)
+            return
+        
+        rate_card_data = {}
+        with checkout_generator() as gen:
+            for vertical, df in gen.iter_rate_cards(retailer_name):
+                rate_card_data[vertical] = df
+                yield ndjson_line(vertical, df)
+        rate_card_cache.result_cache.set(retailer_name, fingerprint, rate_card_data)
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        yield json.dumps({'error': str(e)}) + '\n'
+
+@app.route('/generate-data', methods=['GET', 'POST'])
+def generate_data():
+    """Generate rate card data and return as JSON for display
+    
+    With ``?stream=ndjson`` (or ``Accept: application/x-ndjson``) the response is
+    streamed as one ``{"vertical": ..., "rows": [...]}`` line per product vertical.
+    With ``?format=columnar`` it is the gzipped columnar payload (see columnar).
+    GET requests carry an ETag and answer ``If-None-Match`` with 304, except
+    for NDJSON that is streamed as it is generated rather than precomputed.
+    """
+    if not is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+    retailer_name, hide_commissions = get_rate_card_request()
+    rate_card_cache.request_counter.record(retailer_name)
+    
+    variant = 'ndjson' if wants_ndjson() else 'columnar' if wants_columnar() else 'json'
+    # The gzipped body is a representation of its own, so it needs its own ETag
+    etag_variant = 'columnar:gzip' if variant == 'columnar' and accepts_gzip() else variant
+    
     try:
-        gen = get_generator()
-        rate_card_data = gen.process_rate_cards(retailer_name)
+        artifact = rate_card_data = None
+        budget_problem = api_budget.governor.check()
+        outage = None
+        if not budget_problem:
+            try:
+                with checkout_generator() as gen:
+                    fingerprint = rate_card_cache.data_fingerprint(gen, retailer_name)
+                    artifact = artifact_store.fresh_path(retailer_name, fingerprint, variant)
+                    # A streamed NDJSON body can break off part-way, so only a precomputed one gets a validator
+                    streamed = variant == 'ndjson' and artifact is None
+                    etag = None if streamed else rate_card_etag(fingerprint, etag_variant)
+                    cached = not_modified_response(etag)
+                    if cached is not None:
+                        return cached
+                    
+                    if artifact is None and variant != 'ndjson':
+                        rate_card_data = rate_card_cache.get_rate_cards(gen, retailer_name, fingerprint)
+            except SALESFORCE_DOWN as e:
+                outage = salesforce_outage(retailer_name, e)
+        stale_reason = budget_problem or outage
+        if stale_reason:
+            fingerprint = etag = None
+            artifact, rate_card_data, age = stale_rate_card(retailer_name, variant)
+            if artifact is None and rate_card_data is None:
+                return no_stale_response(budget_problem, outage)
         
-        # Convert DataFrames to JSON-serializable format
-        json_data = {}
-        for vertical, df in rate_card_data.items():
-            json_data[vertical] = df.to_dict('records')
+        if artifact is not None and variant == 'columnar':
+            # Small enough to read whole and compress
+            with open(artifact, 'rb') as f:
+                response = Response(f.read(), mimetype=columnar.MIMETYPE)
+        elif artifact is not None:
+            # Precomputed by precompute.py (from the same fingerprint unless stale)
+            response = send_file(artifact, mimetype='application/x-ndjson' if wants_ndjson() else 'application/json')
+        elif wants_ndjson():
+            response = Response(stream_with_context(stream_rate_card_ndjson(retailer_name, fingerprint, rate_card_data)),
+                                mimetype='application/x-ndjson',
+                                headers={'X-Accel-Buffering': 'no'})
+        elif variant == 'columnar':
+            response = Response(columnar.dumps(rate_card_data), mimetype=columnar.MIMETYPE)
+        else:
+            # Convert DataFrames to JSON-serializable format
+            json_data = {}
+            for vertical, df in rate_card_data.items():
+                json_data[vertical] = df.to_dict('records')
+            response = jsonify(json_data)
+        if variant == 'columnar':
+            response = gzip_response(response)
         
-        return jsonify(json_data)
+        if stale_reason:
+            return mark_stale(response, stale_reason, age)
+        return add_cache_headers(response, etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/generate', methods=['POST'])
-def generate():
-    """Generate Excel file"""
+def format_sse(event, data):
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.route('/generate-stream')
+def generate_stream():
+    """Stream rate card generation progress as Server-Sent Events
+    
+    Emits account_resolved, arc_count, oli_batch, render_started, one vertical
+    event per product vertical (with its rows), render_finished and finally done
+    (or error). The rows in vertical events match /generate-data so the page can
+    render each table as soon as it arrives.
+    """
     if not is_authenticated():
         return jsonify({'error': 'Authentication required'}), 401
     
-    retailer_name = request.json.get('retailer')
-    hide_commissions = request.json.get('hide_commissions', False)
+    retailer_name = request.args.get('retailer', '')
+    if not retailer_name:
+        return jsonify({'error': 'Retailer is required'}), 400
+    rate_card_cache.request_counter.record(retailer_name)
     
-    # For BDM users, always hide commissions regardless of checkbox
-    user_profile = get_current_user()
-    if user_profile['role'] != 'admin':
-        hide_commissions = True
+    events = queue.Queue()
+    
+    def on_progress(stage, **data):
+        if stage == 'vertical':
+            # Convert here so the worker thread does the serialisation work
+            data['rows'] = data.pop('data').to_dict('records')
+        events.put((stage, data))
+    
+    def worker():
+        try:
+            stale_reason = api_budget.governor.check()
+            if not stale_reason:
+                try:
+                    with checkout_generator() as gen:
+                        fingerprint = rate_card_cache.data_fingerprint(gen, retailer_name)
+                        rate_card_cache.get_rate_cards(gen, retailer_name, fingerprint, progress=on_progress)
+                except SALESFORCE_DOWN as e:
+                    stale_reason = salesforce_outage(retailer_name, e)
+            if stale_reason:
+                last_good = stale_rate_card_data(retailer_name)
+                if last_good is None:
+                    raise RuntimeError(stale_reason)
+                rate_card_data, age = last_good
+                api_budget.governor.note_degraded()
+                events.put(('stale', {'reason': stale_reason, 'age_seconds': int(age)}))
+                for processed, (vertical, df) in enumerate(rate_card_data.items(), 1):
+                    on_progress('vertical', vertical=vertical, data=df, processed=processed, total=len(rate_card_data))
+            events.put(('done', {'retailer': retailer_name}))
+        except Exception as e:
+            events.put(('error', {'error': str(e)}))
+        finally:
+            events.put(None)
+    
+    # Run in a copy of this request's context so API calls are charged to the user
+    threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True).start()
+    
+    def stream():
+        while True:
+            try:
+                item = events.get(timeout=15)
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                break
+            stage, data = item
+            yield format_sse(stage, data)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/generate', methods=['GET', 'POST'])
+def generate():
+    """Generate Excel file (GET requests support ETag revalidation)"""
+    if not is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    retailer_name, hide_commissions = get_rate_card_request()
+    rate_card_cache.request_counter.record(retailer_name)
+        
+    artifact_name = 'xlsx_hidden' if hide_commissions else 'xlsx'
         
     try:
-        gen = get_generator()
-        rate_card_data = gen.process_rate_cards(retailer_name)
+        artifact = rate_card_data = None
+        budget_problem = api_budget.governor.check()
+        outage = None
+        if not budget_problem:
+            try:
+                with checkout_generator() as gen:
+                    fingerprint = rate_card_cache.data_fingerprint(gen, retailer_name)
+                    etag = rate_card_etag(fingerprint, f"xlsx:{hide_commissions}")
+                    cached = not_modified_response(etag)
+                    if cached is not None:
+                        return cached
+                    
+                    artifact = artifact_store.fresh_path(retailer_name, fingerprint, artifact_name)
+                    if artifact is None:
+                        rate_card_data = rate_card_cache.get_rate_cards(gen, retailer_name, fingerprint)
+            except SALESFORCE_DOWN as e:
+                outage = salesforce_outage(retailer_name, e)
+        stale_reason = budget_problem or outage
+        if stale_reason:
+            etag = None
+            artifact, rate_card_data, age = stale_rate_card(retailer_name, artifact_name)
+            if artifact is None and rate_card_data is None:
+                return no_stale_response(budget_problem, outage)
+        
+        if artifact is not None:
+            response = send_file(artifact, as_attachment=True,
+                                 download_name=f"{retailer_name}_Rate_Card.xlsx",
+                                 mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            if stale_reason:
+                return mark_stale(response, stale_reason, age)
+            return add_cache_headers(response, etag)
         
         # Generate Excel in temp file
         with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
             output_path = tmp.name
         
-        gen.generate_excel(retailer_name, rate_card_data, output_path, hide_commissions)
+        # Rendering needs no Salesforce session, so it runs after check-in
+        from rate_card_generator import RateCardGenerator
+        changes = rate_card_snapshots.snapshot_store.changes(retailer_name, rate_card_data, hide_commissions)
+        with instrumentation.stage('render_xlsx'):
+            RateCardGenerator.generate_excel(retailer_name, rate_card_data, output_path, hide_commissions, changes)
         
-        return send_file(output_path, as_attachment=True,
-                        download_name=f"{retailer_name}_Rate_Card.xlsx",
-                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response = send_file(output_path, as_attachment=True,
+                             download_name=f"{retailer_name}_Rate_Card.xlsx",
+                             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        if stale_reason:
+            return mark_stale(response, stale_reason, age)
+        return add_cache_headers(response, etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/generate-pdf', methods=['POST'])
-def generate_pdf():
-    """Generate PDF file"""
+@app.route('/generate-changes', methods=['GET', 'POST'])
+def generate_changes():
+    """Rows added, removed and changed since the retailer's previous rate card, as JSON"""
     if not is_authenticated():
         return jsonify({'error': 'Authentication required'}), 401
     
-    retailer_name = request.json.get('retailer')
-    hide_commissions = request.json.get('hide_commissions', False)
+    retailer_name, hide_commissions = get_rate_card_request()
+    artifact_name = 'changes_hidden' if hide_commissions else 'changes'
     
-    # For BDM users, always hide commissions regardless of checkbox
-    user_profile = get_current_user()
-    if user_profile['role'] != 'admin':
-        hide_commissions = True
+    try:
+        artifact = rate_card_data = None
+        budget_problem = api_budget.governor.check()
+        outage = None
+        if not budget_problem:
+            try:
+                with checkout_generator() as gen:
+                    fingerprint = rate_card_cache.data_fingerprint(gen, retailer_name)
+                    artifact = artifact_store.fresh_path(retailer_name, fingerprint, artifact_name)
+                    if artifact is None:
+                        rate_card_data = rate_card_cache.get_rate_cards(gen, retailer_name, fingerprint)
+            except SALESFORCE_DOWN as e:
+                outage = salesforce_outage(retailer_name, e)
+        stale_reason = budget_problem or outage
+        if stale_reason:
+            artifact, rate_card_data, age = stale_rate_card(retailer_name, artifact_name)
+            if artifact is None and rate_card_data is None:
+                return no_stale_response(budget_problem, outage)
+        
+        if artifact is not None:
+            response = send_file(artifact, mimetype='application/json')
+        else:
+            response = jsonify(rate_card_snapshots.snapshot_store.changes(retailer_name, rate_card_data,
+                                                                          hide_commissions))
+        if stale_reason:
+            return mark_stale(response, stale_reason, age)
+        response.headers['Cache-Control'] = RATE_CARD_CACHE_CONTROL
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/generate-pdf', methods=['GET', 'POST'])
+def generate_pdf():
+    """Generate PDF file (GET requests support ETag revalidation)"""
+    if not is_authenticated():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    retailer_name, hide_commissions = get_rate_card_request()
+    rate_card_cache.request_counter.record(retailer_name)
+        
+    artifact_name = 'pdf_hidden' if hide_commissions else 'pdf'
         
     try:
-        gen = get_generator()
-        rate_card_data = gen.process_rate_cards(retailer_name)
+        artifact = rate_card_data = None
+        budget_problem = api_budget.governor.check()
+        outage = None
+        if not budget_problem:
+            try:
+                with checkout_generator() as gen:
+                    fingerprint = rate_card_cache.data_fingerprint(gen, retailer_name)
+                    etag = rate_card_etag(fingerprint, f"pdf:{hide_commissions}")
+                    cached = not_modified_response(etag)
+                    if cached is not None:
+                        return cached
+                    
+                    artifact = artifact_store.fresh_path(retailer_name, fingerprint, artifact_name)
+                    if artifact is None:
+                        rate_card_data = rate_card_cache.get_rate_cards(gen, retailer_name, fingerprint)
+            except SALESFORCE_DOWN as e:
+                outage = salesforce_outage(retailer_name, e)
+        stale_reason = budget_problem or outage
+        if stale_reason:
+            etag = None
+            artifact, rate_card_data, age = stale_rate_card(retailer_name, artifact_name)
+            if artifact is None and rate_card_data is None:
+                return no_stale_response(budget_problem, outage)
+        
+        if artifact is not None:
+            response = send_file(artifact, as_attachment=True,
+                                 download_name=f"{retailer_name}_Rate_Card.pdf",
+                                 mimetype='application/pdf')
+            if stale_reason:
+                return mark_stale(response, stale_reason, age)
+            return add_cache_headers(response, etag)
         
         # Generate PDF in temp file
         with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
             output_path = tmp.name
         
+        from pdf_generator import PDFGenerator
         pdf_gen = PDFGenerator()
-        pdf_gen.generate_pdf(retailer_name, rate_card_data, output_path, hide_commissions)
+        with instrumentation.stage('render_pdf'):
+            pdf_gen.generate_pdf(retailer_name, rate_card_data, output_path, hide_commissions)
         
-        return send_file(output_path, as_attachment=True,
-                        download_name=f"{retailer_name}_Rate_Card.pdf",
-                        mimetype='application/pdf')
+        response = send_file(output_path, as_attachment=True,
+                             download_name=f"{retailer_name}_Rate_Card.pdf",
+                             mimetype='application/pdf')
+        if stale_reason:
+            return mark_stale(response, stale_reason, age)
+        return add_cache_headers(response, etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
-    print(f"Starting Rate Card Generator on port {port}")
-    print(f"Open http://localhost:{port} in your browser")
+    logger.info("Starting Rate Card Generator on port %d", port)
+    logger.info("Open http://localhost:%d in your browser", port)
     app.run(debug=False, host='0.0.0.0', port=port)